@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Analyzer benchmarks for the Personal Email Management Assistant
+Runs EmailAnalyzer against the local LLM stand-in server (or a recorded cassette)
+and reports emails/sec, p50/p99 call latency and tokens per email for each path
+
+Usage:
+    python benchmarks/bench_analyzer.py --emails 200 --latency 0.3 --error-rate 0.02
+    
+    # Record real answers once, then replay them offline
+    OPENAI_API_KEY=... python benchmarks/bench_analyzer.py --record cassette.json --base-url https://...
+    python benchmarks/bench_analyzer.py --replay cassette.json
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+from unittest import mock
+
+import httpx
+import openai
+
+# Add the repository root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.ai.analyzer import EmailAnalyzer
+from src.ai.cache import AnalysisCache
+from src.ai.llm_client import AsyncLLMClient
+from tests.llm_server import CassetteTransport, LLMStandInServer
+
+# (sender, subject, body) templates of a mixed inbox
+TEMPLATES = [
+    ("manager@corp.example.com", "Project deadline moved to Friday {i}",
+     "Hi team,\n\nThe deadline for milestone {i} moved to Friday. Please update your tasks.\n\nThanks"),
+    ("news@deals.example.com", "Weekly deals {i}: 30% discount",
+     "<html><body><p>Big sale on everything.</p><p>Unsubscribe here.</p></body></html>"),
+    ("friend@home.example.org", "Family dinner {i}",
+     "Are you free on Sunday?\n\nOn Mon, 1 Jan 2024, you wrote:\n> Let's meet soon"),
+    ("noreply@alerts.example.com", "Your statement {i} is ready",
+     "Your monthly statement is ready to view online.\n-- \nExample Bank"),
+]
+
+def make_emails(count: int, offset: int = 0) -> List[Dict]:
+    """Build count distinct synthetic emails"""
+    emails = []
+    for index in range(offset, offset + count):
+        sender, subject, body = TEMPLATES[index % len(TEMPLATES)]
+        emails.append({'id': str(index), 'uid': index, 'from': sender,
+                       'subject': subject.format(i=index), 'body': body.format(i=index) * (1 + index % 3)})
+    return emails
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+def measure(name: str, analyzer: EmailAnalyzer, calls: List[List[Dict]], run: Callable[[List[Dict]], List[Dict]]) -> Dict:
+    """Analyze the emails of every call in turn, timing each call"""
+    requests_before = analyzer.llm_client.stats['requests']
+    retries_before = analyzer.llm_client.stats['retries']
+    latencies = []
+    tokens = 0
+    emails = 0
+    
+    start = time.perf_counter()
+    for call in calls:
+        call_start = time.perf_counter()
+        results = run(call)
+        latencies.append(time.perf_counter() - call_start)
+        emails += len(call)
+        tokens += sum((result.get('prompt_tokens') or 0) + (result.get('completion_tokens') or 0) for result in results)
+    elapsed = time.perf_counter() - start
+    
+    return {
+        'name': name,
+        'emails': emails,
+        'seconds': elapsed,
+        'rate': emails / elapsed if elapsed else float('inf'),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'requests': analyzer.llm_client.stats['requests'] - requests_before,
+        'retries': analyzer.llm_client.stats['retries'] - retries_before,
+        'tokens_per_email': tokens / emails if emails else 0.0
+    }
+
+def print_results(results: List[Dict]):
+    header = (f"{'path':<30} {'emails':>7} {'seconds':>9} {'emails/sec':>11} {'p50 ms':>9} {'p99 ms':>9} "
+              f"{'requests':>9} {'retries':>8} {'tokens/email':>13}")
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        print(f"{row['name']:<30} {row['emails']:>7} {row['seconds']:>9.3f} {row['rate']:>11.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['requests']:>9} {row['retries']:>8} "
+              f"{row['tokens_per_email']:>13.1f}")
+
+def make_analyzer(args, base_url: str, transport, cache_path: str) -> EmailAnalyzer:
+    """Build an analyzer whose LLM client talks to base_url through transport"""
+    with mock.patch.dict('os.environ', {}, clear=True):
+        analyzer = EmailAnalyzer(cache=AnalysisCache(cache_path), local_model=None)
+    api = openai.AsyncOpenAI(
+        api_key=os.getenv('DASHSCOPE_API_KEY') or os.getenv('OPENAI_API_KEY') or "bench",
+        base_url=base_url,
+        http_client=httpx.AsyncClient(transport=transport, timeout=args.timeout),
+        max_retries=0
+    )
+    analyzer.model = args.model
+    analyzer.llm_client = AsyncLLMClient(api, args.model, max_concurrent_requests=args.concurrency,
+                                         requests_per_minute=None, tokens_per_minute=None,
+                                         request_timeout=args.timeout, backoff_base=0.05)
+    return analyzer
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EmailAnalyzer against a local OpenAI-compatible stand-in")
+    parser.add_argument("--emails", type=int, default=200, help="Emails analyzed per path")
+    parser.add_argument("--sample", type=int, default=40, help="Emails analyzed one request at a time")
+    parser.add_argument("--cycle-size", type=int, default=100, help="Emails per analyze_batch call (one check)")
+    parser.add_argument("--batch-size", type=int, default=20, help="Emails per batched request")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM requests in flight at once")
+    parser.add_argument("--latency", type=float, default=0.3, help="Stand-in seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Up to this many seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds before a request is abandoned")
+    parser.add_argument("--model", default=os.getenv('OPENAI_MODEL', 'qwen-plus'), help="Model name sent")
+    parser.add_argument("--base-url", default=os.getenv('OPENAI_BASE_URL', 'https://dashscope.aliyuncs.com/compatible-mode/v1'),
+                        help="Real endpoint used with --record")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="FILE", help="Record the real endpoint's answers to a cassette")
+    cassette.add_argument("--replay", metavar="FILE", help="Replay a recorded cassette instead of the stand-in")
+    args = parser.parse_args()
+    
+    server = None
+    if args.record:
+        base_url, transport, source = args.base_url, CassetteTransport(args.record, mode="record"), f"recording to {args.record}"
+    elif args.replay:
+        base_url, transport, source = args.base_url, CassetteTransport(args.replay), f"replaying {args.replay}"
+    else:
+        server = LLMStandInServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=1)
+        server.start()
+        base_url, transport = server.base_url, httpx.AsyncHTTPTransport()
+        source = (f"stand-in server, {args.latency * 1000:.0f}+{args.jitter * 1000:.0f} ms latency, "
+                  f"{args.error_rate:.0%} errors")
+    
+    # Fixed email sets, so replays send exactly the recorded requests
+    single = make_emails(args.sample)
+    batched = make_emails(args.emails, offset=args.sample)
+    cycles = [batched[start:start + args.cycle_size] for start in range(0, len(batched), args.cycle_size)]
+    results = []
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        analyzer = make_analyzer(args, base_url, transport, os.path.join(temp_dir, "analysis_cache.db"))
+        try:
+            results.append(measure("single (analyze_email)", analyzer, [[email_data] for email_data in single],
+                                   lambda call: [analyzer.analyze_email(call[0])]))
+            
+            batch = lambda call: analyzer.analyze_batch(call, max_batch_tokens=1000000, max_batch_size=args.batch_size)
+            results.append(measure(f"batched, {args.batch_size} per request", analyzer, cycles, batch))
+            results.append(measure("cached (same emails again)", analyzer, cycles, batch))
+        finally:
+            analyzer.close()
+            if server:
+                server.stop()
+    
+    print(f"\nEmailAnalyzer against {source}, {args.concurrency} concurrent requests\n")
+    print_results(results)
+    print("\nLatency is per analyze call: one email for the single path, one check of "
+          f"{args.cycle_size} emails for the others")
+
+if __name__ == "__main__":
+    main()
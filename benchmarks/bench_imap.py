@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+IMAP benchmarks for the Personal Email Management Assistant
+Runs EmailProcessor against the IMAP stand-in server and reports messages/sec,
+IMAP round trips and peak Python memory for each operation
+
+Usage:
+    python benchmarks/bench_imap.py --messages 10000 --latency 0.02
+"""
+
+import argparse
+import imaplib
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+# Add the repository root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.email_handler.processor import EmailProcessor
+from tests.imap_server import IMAPStandInServer
+
+def _serve(port_queue, messages: int, latency: float, attachment_size: int, bandwidth):
+    """Run the stand-in server in its own process so it doesn't skew memory measurements"""
+    server = IMAPStandInServer(latency=latency, bandwidth=bandwidth)
+    server.populate(messages, attachment_size=attachment_size)
+    port_queue.put(server.port)
+    server.serve_forever()
+
+class RoundTripCounter:
+    """Counts tagged IMAP commands, i.e. client/server round trips"""
+    
+    def __init__(self):
+        self.count = 0
+        self._original = imaplib.IMAP4._command
+    
+    def __enter__(self):
+        counter = self
+        original = self._original
+        
+        def counting_command(mail, name, *args):
+            counter.count += 1
+            return original(mail, name, *args)
+        
+        imaplib.IMAP4._command = counting_command
+        return self
+    
+    def __exit__(self, *exc):
+        imaplib.IMAP4._command = self._original
+
+def measure(name: str, messages: int, func: Callable[[], object]) -> Dict:
+    """Run func once and collect timing, round trips and peak memory"""
+    tracemalloc.start()
+    with RoundTripCounter() as counter:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return {
+        'name': name,
+        'messages': messages,
+        'seconds': elapsed,
+        'rate': messages / elapsed if elapsed else float('inf'),
+        'round_trips': counter.count,
+        'peak_mb': peak / (1024 * 1024)
+    }
+
+def print_results(results: List[Dict]):
+    header = f"{'operation':<34} {'msgs':>7} {'seconds':>9} {'msgs/sec':>10} {'round trips':>12} {'peak MB':>9}"
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        print(f"{row['name']:<34} {row['messages']:>7} {row['seconds']:>9.3f} {row['rate']:>10.1f} "
+              f"{row['round_trips']:>12} {row['peak_mb']:>9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EmailProcessor against a local IMAP stand-in server")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages in the synthetic INBOX")
+    parser.add_argument("--latency", type=float, default=0.01, help="Injected seconds per round trip")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Server send rate in bytes/sec")
+    parser.add_argument("--attachment-size", type=int, default=200000, help="Bytes per attachment (every 5th message)")
+    parser.add_argument("--batch-size", type=int, default=50, help="Messages per FETCH")
+    parser.add_argument("--sample", type=int, default=100, help="Messages used for per-message flag operations")
+    args = parser.parse_args()
+    
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=_serve, args=(port_queue, args.messages, args.latency, args.attachment_size, args.bandwidth),
+        daemon=True
+    )
+    server.start()
+    port = port_queue.get(timeout=120)
+    
+    processor = EmailProcessor()
+    processor.add_account("bench@example.com", "password", "127.0.0.1", port, use_ssl=False)
+    account = processor.accounts[0]
+    results = []
+    
+    try:
+        connections = 5
+        results.append(measure("connect_account", connections, lambda: [
+            processor.connect_account(account, timeout=60).logout() for _ in range(connections)
+        ]))
+        
+        mail = processor.connect_account(account, timeout=60)
+        
+        # BODY.PEEK fetches leave messages unseen, so every fetch sees the whole mailbox
+        sample = min(args.sample, args.messages)
+        results.append(measure("fetch_emails full, batch 1", sample, lambda: processor.fetch_emails(
+            mail, limit=sample, batch_size=1, fetch_mode='full', max_message_bytes=64 * 1024 * 1024
+        )))
+        results.append(measure(f"fetch_emails full, batch {args.batch_size}", args.messages, lambda: processor.fetch_emails(
+            mail, limit=args.messages, batch_size=args.batch_size, fetch_mode='full', max_message_bytes=64 * 1024 * 1024
+        )))
+        results.append(measure(f"fetch_emails partial, batch {args.batch_size}", args.messages, lambda: processor.fetch_emails(
+            mail, limit=args.messages, batch_size=args.batch_size, fetch_mode='partial', max_body_bytes=32768
+        )))
+        
+        uids = [str(uid) for uid in range(1, args.messages + 1)]
+        single, bulk = uids[:sample], uids[sample:]
+        
+        results.append(measure("mark_as_read, per message", len(single), lambda: [
+            processor.mark_as_read(mail, uid) for uid in single
+        ]))
+        results.append(measure("mark_as_read, bulk", len(bulk), lambda: processor.apply_flag_changes(
+            mail, read_ids=bulk
+        )))
+        
+        delete_single, delete_bulk = single[:sample // 2], single[sample // 2:]
+        results.append(measure("delete_email, per message", len(delete_single), lambda: [
+            processor.delete_email(mail, uid) for uid in delete_single
+        ]))
+        results.append(measure("delete_email, bulk", len(delete_bulk), lambda: processor.apply_flag_changes(
+            mail, delete_ids=delete_bulk
+        )))
+        
+        mail.logout()
+    finally:
+        server.terminate()
+    
+    print(f"\n{args.messages} messages, {args.latency * 1000:.0f} ms injected latency per round trip\n")
+    print_results(results)
+
+if __name__ == "__main__":
+    main()
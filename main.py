@@ -32,8 +32,10 @@ def main():
     # Handle different modes
     if args.review:
         assistant.review_emails()
+        assistant.shutdown()
     elif args.once:
         assistant.process_emails()
+        assistant.shutdown()
     else:
         assistant.run()
 
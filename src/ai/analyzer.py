@@ -3,207 +3,562 @@ AI analyzer for the Personal Email Management Assistant
 Handles LLM API integrations and email analysis
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import logging
+import asyncio
 import openai
 import os
 import httpx
+from src.ai.cache import AnalysisCache, content_key, normalized_sender
+from src.ai.similarity import SimHashIndex
+from src.ai.local_model import LocalClassifier
+from src.ai.rules import RuleEngine
+from src.ai.prompt import PromptBuilder, count_tokens
+from src.ai.response_parser import (ANALYSIS_SCHEMA, BATCH_SCHEMA, extract_objects,
+                                    recover_fields, validate_analysis)
+from src.ai.llm_client import AsyncLLMClient, LLMRequestError
+from src.ai.router import LLMRouter
+
+# Bump when the prompts change so cached analyses from older prompts are not reused
+PROMPT_VERSION = "4"
+
+SYSTEM_PROMPT = "You are an email analysis assistant. Analyze emails and provide their importance, summary, category, and recommended action."
+
+ANALYSIS_INSTRUCTIONS = """Analyze the following email and provide:
+1. Importance (0-1 scale, where 1 is very important)
+2. Brief summary (2-3 sentences)
+3. Category (work, personal, newsletter, spam, other)
+4. Recommended action (read, archive, delete)
+
+Respond with only a JSON object:
+{"importance": 0.8, "summary": "Brief summary of the email", "category": "work", "action": "read"}
+
+Email:
+"""
+
+BATCH_INSTRUCTIONS = """Analyze each of the following emails and provide:
+1. Importance (0-1 scale, where 1 is very important)
+2. Brief summary (2-3 sentences)
+3. Category (work, personal, newsletter, spam, other)
+4. Recommended action (read, archive, delete)
+
+Respond with only a JSON object whose "analyses" array holds one object per email, using the email's id:
+{"analyses": [
+  {"id": "e0", "importance": 0.8, "summary": "Brief summary of the email", "category": "work", "action": "read"}
+]}
+
+Emails:
+"""
+
+# Answer tokens reserved per email in a batch request
+OUTPUT_TOKENS_PER_EMAIL = 150
+
+# Per-email token usage recorded with LLM analyses, not kept when they are reused
+TOKEN_FIELDS = ('prompt_tokens', 'completion_tokens')
 
 class EmailAnalyzer:
     """Analyzes emails using LLM APIs to determine importance and generate summaries"""
     
-    def __init__(self):
+    def __init__(self, max_concurrent_requests: int = 4, requests_per_minute: Optional[float] = 60,
+                 tokens_per_minute: Optional[float] = 100000, request_timeout: float = 60,
+                 max_retries: int = 5, cache: Optional[AnalysisCache] = None,
+                 similarity_index: Optional[SimHashIndex] = None,
+                 local_model: Optional[LocalClassifier] = None,
+                 local_confidence_threshold: float = 0.9, local_min_examples: int = 50,
+                 rules: Optional[RuleEngine] = None, body_tokens: int = 300,
+                 response_format: str = "json_object", providers: Optional[List[Dict]] = None,
+                 hedge_requests: bool = True, latency_window: float = 300):
+        """
+        Args:
+            max_concurrent_requests: LLM requests in flight at once
+            requests_per_minute: Request budget of the LLM provider, None for unlimited
+            tokens_per_minute: Token budget of the LLM provider, None for unlimited
+            request_timeout: Seconds before a single LLM request is abandoned
+            max_retries: Retries of rate-limited, timed out or failed LLM requests
+            cache: Cache of LLM analyses by email content, None to always call the LLM
+            similarity_index: Index of analyzed emails whose analyses are reused for
+                              near-duplicates from the same sender, None to disable
+            local_model: Classifier answering before the LLM, learning from its verdicts,
+                         None to send every email to the LLM
+            local_confidence_threshold: Confidence the local model needs for its verdict to be used
+            local_min_examples: Emails the local model must have learned before it is used
+            rules: Keyword rules of the heuristic analysis, None for the default rules
+            body_tokens: Token budget of an email's cleaned body in a prompt
+            response_format: Structured output requested from the LLM: "json_schema",
+                             "json_object", or "text" for providers supporting neither
+            providers: OpenAI-compatible LLM providers (name, base_url, model, api_key_env
+                       and optionally their own quotas) to route requests between, None
+                       for the single provider configured by environment variables
+            hedge_requests: With several providers, also send requests running late to a second one
+            latency_window: Seconds of requests the providers' latency and error rates are measured over
+        """
         self.logger = logging.getLogger(__name__)
-        self.openai_client = None
+        self.cache = cache
+        self.similarity_index = similarity_index
+        self.local_model = local_model
+        self.local_confidence_threshold = local_confidence_threshold
+        self.local_min_examples = local_min_examples
+        self.rules = rules or RuleEngine()
+        self.prompt_builder = PromptBuilder(body_tokens)
+        self.response_format = response_format
+        self.llm_client = None
         self.model = "qwen-plus"  # Default to Qwen Plus
         
+        client_options = {
+            'max_concurrent_requests': max_concurrent_requests,
+            'requests_per_minute': requests_per_minute,
+            'tokens_per_minute': tokens_per_minute,
+            'request_timeout': request_timeout,
+            'max_retries': max_retries
+        }
+        if providers:
+            self._init_router(providers, client_options, hedge_requests, latency_window)
+            return
+        
         # Try to load Qwen configuration from environment
         api_key = os.getenv('DASHSCOPE_API_KEY') or os.getenv('OPENAI_API_KEY')
         base_url = os.getenv('OPENAI_BASE_URL', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
         
         # If we have API key, initialize the client
         if api_key:
-            # Handle proxy configuration
-            http_client = None
-            proxy_url = os.getenv('HTTPS_PROXY') or os.getenv('HTTP_PROXY')
-            if proxy_url and proxy_url.startswith('socks'):
-                # SOCKS proxy is not directly supported by httpx, so we skip it
-                self.logger.warning(f"SOCKS proxy {proxy_url} is not supported, ignoring proxy configuration")
-                proxy_url = None
-            
-            if proxy_url:
-                try:
-                    http_client = httpx.Client(proxy=proxy_url)
-                except Exception as e:
-                    self.logger.warning(f"Failed to configure proxy {proxy_url}: {str(e)}")
-            
-            self.openai_client = openai.OpenAI(
-                api_key=api_key,
-                base_url=base_url,
-                http_client=http_client
-            )
-            
             # Use the model specified in environment or default to qwen-plus
             self.model = os.getenv('OPENAI_MODEL', 'qwen-plus')
+            self.llm_client = self._create_client(api_key, base_url, self.model, client_options)
             self.logger.info(f"Initialized Qwen analyzer with model: {self.model}")
     
+    def _create_client(self, api_key: str, base_url: str, model: str, client_options: Dict) -> AsyncLLMClient:
+        """Create a client of an OpenAI-compatible endpoint, going through HTTPS_PROXY/HTTP_PROXY if set"""
+        # Handle proxy configuration
+        http_client = None
+        proxy_url = os.getenv('HTTPS_PROXY') or os.getenv('HTTP_PROXY')
+        if proxy_url and proxy_url.startswith('socks'):
+            # SOCKS proxy is not directly supported by httpx, so we skip it
+            self.logger.warning(f"SOCKS proxy {proxy_url} is not supported, ignoring proxy configuration")
+            proxy_url = None
+        
+        if proxy_url:
+            try:
+                http_client = httpx.AsyncClient(proxy=proxy_url)
+            except Exception as e:
+                self.logger.warning(f"Failed to configure proxy {proxy_url}: {str(e)}")
+        
+        # Retries are handled by AsyncLLMClient, which shares the rate budgets
+        openai_client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            max_retries=0
+        )
+        return AsyncLLMClient(openai_client, model, **client_options)
+    
+    def _init_router(self, providers: List[Dict], client_options: Dict, hedge_requests: bool,
+                     latency_window: float):
+        """Create a client per configured provider with an API key and route requests between them"""
+        clients = {}
+        for index, provider in enumerate(providers):
+            name = provider.get('name') or f"provider{index + 1}"
+            api_key = os.getenv(provider.get('api_key_env') or 'OPENAI_API_KEY')
+            if not api_key or not provider.get('base_url') or not provider.get('model'):
+                self.logger.warning(f"LLM provider {name} needs base_url, model and an API key "
+                                    f"in ${provider.get('api_key_env') or 'OPENAI_API_KEY'}, skipping it")
+                continue
+            # Providers may have their own quotas; the rest of the settings are shared
+            options = dict(client_options)
+            options.update({key: provider[key] for key in client_options if key in provider})
+            clients[name] = self._create_client(api_key, provider['base_url'], provider['model'], options)
+        
+        if not clients:
+            self.logger.warning("No LLM provider is usable, analyzing without an LLM")
+            return
+        
+        # Stored analyses are looked up under the preferred provider's model, which answers
+        # most requests, and kept under the model of the provider that answered them
+        self.model = next(iter(clients.values())).model
+        if len(clients) == 1:
+            self.llm_client = next(iter(clients.values()))
+        else:
+            self.llm_client = LLMRouter(clients, hedge_requests=hedge_requests, window=latency_window)
+        self.logger.info(f"Initialized analyzer with LLM providers: {', '.join(clients)}")
+    
     def analyze_email(self, email_data: Dict) -> Dict:
         """
         Analyze an email to determine its importance and generate a summary
         
         Args:
             email_data: Dictionary containing email information
-            
+        
         Returns:
             Dictionary with analysis results including:
             - importance: float between 0 and 1
             - summary: brief summary of the email
             - category: email category (e.g., work, personal, spam)
             - action: recommended action (e.g., read, archive, delete)
+            - source: the tier that produced the verdict: "llm", "cache" when the LLM's
+              analysis of identical content was cached, "near_duplicate" when the
+              analysis of a near-duplicate email was reused (its key is in
+              reused_from), "local" when the local model was confident enough (its
+              posterior is in confidence), or "heuristic" when the LLM was unavailable
+            - prompt_tokens, completion_tokens: tokens the LLM used for this email,
+              only present when it was sent to the LLM
+            - model: the model that wrote an LLM analysis
         """
-        # If no LLM API key is available, return default analysis
-        if not self.openai_client:
-            return self._default_analysis(email_data)
+        # If no LLM API key is available, return local or default analysis
+        if not self.llm_client:
+            return self._local_analysis(email_data) or self._default_analysis(email_data)
+        
+        key = self._content_key(email_data)
+        analysis = self._find_stored_analysis(key, email_data) or self._local_analysis(email_data)
+        if analysis is None:
+            analysis = self._analyze_with_llm(email_data)
+            self._store_analysis(email_data, analysis)
+        return analysis
+    
+    def _find_stored_analysis(self, key: str, email_data: Dict) -> Optional[Dict]:
+        """Find an earlier analysis for an email: its own cached one, else a near-duplicate's"""
+        if self.cache:
+            analysis = self.cache.get(key)
+            if analysis is not None:
+                return dict(analysis, source='cache')
+        
+        if self.similarity_index:
+            match = self.similarity_index.find(self._similarity_scope(email_data), self._similarity_text(email_data))
+            if match:
+                reused_key, distance, analysis = match
+                self.logger.info(f"Reusing analysis {reused_key[:12]} for near-duplicate email "
+                                 f"'{email_data.get('subject', '')}' (distance {distance})")
+                return dict(analysis, source='near_duplicate', reused_from=reused_key)
         
+        return None
+    
+    def _local_analysis(self, email_data: Dict) -> Optional[Dict]:
+        """Get the local model's verdict, or None when it is untrained or not confident enough"""
+        if not self.local_model or self.local_model.examples < self.local_min_examples:
+            return None
+        analysis = self.local_model.predict(email_data)
+        if analysis is None or analysis['confidence'] < self.local_confidence_threshold:
+            return None
+        return analysis
+    
+    def _store_analysis(self, email_data: Dict, analysis: Dict):
+        """Keep an LLM analysis for identical and near-duplicate emails, under the model that wrote it, and learn from it"""
+        if analysis.get('source') != 'llm':
+            return
+        model = analysis.get('model') or self.model
+        key = self._content_key(email_data, model)
+        analysis = {field: value for field, value in analysis.items() if field not in TOKEN_FIELDS}
+        if self.local_model:
+            self.local_model.learn(email_data, analysis)
+        if self.cache:
+            self.cache.put(key, analysis)
+        if self.similarity_index:
+            self.similarity_index.add(key, self._similarity_scope(email_data, model), self._similarity_text(email_data),
+                                      analysis)
+    
+    def _content_key(self, email_data: Dict, model: Optional[str] = None) -> str:
+        """The cache key of an email for model (the preferred one by default), built from the cleaned body the prompt shows the LLM"""
+        cleaned = dict(email_data, body=self.prompt_builder.clean_body(email_data.get('body')))
+        return content_key(cleaned, model or self.model, PROMPT_VERSION)
+    
+    def _similarity_scope(self, email_data: Dict, model: Optional[str] = None) -> str:
+        """Near-duplicates are only looked for among emails of the same sender, model and prompt"""
+        return f"{normalized_sender(email_data)}|{model or self.model}|{PROMPT_VERSION}"
+    
+    def _similarity_text(self, email_data: Dict) -> str:
+        """The text compared for near-duplicates: what the prompt shows the LLM"""
+        return f"{email_data.get('subject', '')}\n{self.prompt_builder.clean_body(email_data.get('body'))}"
+    
+    def _analyze_with_llm(self, email_data: Dict) -> Dict:
+        """Analyze a single email with one LLM request"""
         # Prepare prompt for LLM
         prompt = self._create_analysis_prompt(email_data)
         
         try:
             # Call Qwen API
-            response = self.openai_client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an email analysis assistant. Analyze emails and provide their importance, summary, category, and recommended action."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=300
-            )
+            prompt_tokens = count_tokens(SYSTEM_PROMPT) + count_tokens(prompt)
+            completion = self.llm_client.run(self._complete(prompt, 300, prompt_tokens, ANALYSIS_SCHEMA))
             
             # Parse response
-            analysis_text = response.choices[0].message.content.strip()
-            return self._parse_analysis_response(analysis_text)
-            
-        except openai.APIError as e:
-            self.logger.error(f"OpenAI API error analyzing email: {str(e)}")
+            analysis = self._parse_analysis_response(completion.text.strip())
+            if analysis is None:
+                self.logger.error("No analysis found in LLM response, using heuristic analysis")
+                analysis = self._default_analysis(email_data)
+            else:
+                analysis['model'] = completion.model or self.model
+            analysis['prompt_tokens'], analysis['completion_tokens'] = self._usage(completion, prompt_tokens)
+            return analysis
+        
+        except LLMRequestError as e:
+            self.logger.error(f"LLM request analyzing email failed, using heuristic analysis: {str(e)}")
             return self._default_analysis(email_data)
         except Exception as e:
             self.logger.error(f"Error analyzing email with Qwen: {str(e)}")
             return self._default_analysis(email_data)
     
-    def _create_analysis_prompt(self, email_data: Dict) -> str:
-        """Create a prompt for the LLM to analyze an email"""
-        prompt = f"""
-        Analyze the following email and provide:
-        1. Importance (0-1 scale, where 1 is very important)
-        2. Brief summary (2-3 sentences)
-        3. Category (work, personal, newsletter, spam, other)
-        4. Recommended action (read, archive, delete)
-
-        Email details:
-        From: {email_data.get('from', 'Unknown')}
-        Subject: {email_data.get('subject', 'No subject')}
-        Body: {email_data.get('body', 'No body')[:1000]}  # Limit body length
-
-        Format your response as JSON:
-        {{
-          "importance": 0.8,
-          "summary": "Brief summary of the email",
-          "category": "work",
-          "action": "read"
-        }}
+    def analyze_batch(self, emails: List[Dict], max_batch_tokens: int = 6000,
+                      max_batch_size: int = 20, max_retries: int = 1) -> List[Dict]:
+        """
+        Analyze several emails with as few API requests as possible
+        
+        Emails are packed into requests that share one system prompt and one copy of
+        the format instructions, each tagged with a stable ID (e0, e1, ...). A request
+        holds as many emails as fit max_batch_tokens, counting the estimated prompt and
+        the answer reserved for every email. Emails whose entry in the returned JSON
+        array is missing or malformed are sent again in the next round; those still
+        failing after max_retries rounds are analyzed one at a time. The requests of a
+        round run concurrently within the LLM client's rate budgets. Emails found in the
+        analysis cache or the near-duplicate index, those the local model classifies
+        confidently, and repeats of an email within the call, are not sent at all.
+        
+        Args:
+            emails: Email dictionaries as passed to analyze_email
+            max_batch_tokens: Token budget of one request
+            max_batch_size: Maximum number of emails in one request
+            max_retries: Rounds in which emails that failed to parse are re-queued
+        
+        Returns:
+            One analysis per email, in the order of emails (see analyze_email)
         """
-        return prompt
+        if not self.llm_client:
+            results = [self._local_analysis(email_data) for email_data in emails]
+            missing = [index for index, analysis in enumerate(results) if analysis is None]
+            if missing:
+                self.logger.info(f"Using default analysis for {len(missing)} emails")
+                for index, analysis in zip(missing, self._default_analyses([emails[index] for index in missing])):
+                    results[index] = analysis
+            return results
+        
+        results: List[Optional[Dict]] = [None] * len(emails)
+        pending = []
+        sent = []
+        duplicates = {}
+        first_with_key = {}
+        spent = {}
+        
+        for index, email_data in enumerate(emails):
+            key = self._content_key(email_data)
+            if key in first_with_key:
+                # Identical content, e.g. the same newsletter in several accounts
+                duplicates[index] = first_with_key[key]
+                continue
+            first_with_key[key] = index
+            results[index] = self._find_stored_analysis(key, email_data) or self._local_analysis(email_data)
+            if results[index] is None:
+                sent.append(index)
+                pending.append(index)
+        
+        for _ in range(max_retries + 1):
+            if not pending:
+                break
+            failed = []
+            
+            items = {index: self._format_batch_item(index, emails[index]) for index in pending}
+            batches = self._pack_batches(items, max_batch_tokens, max_batch_size)
+            responses = self.llm_client.run(self._request_batches(items, batches))
+            
+            for batch, (analyses, usage) in zip(batches, responses):
+                if usage:
+                    # Shared by the emails of the request in proportion to their size
+                    sizes = [count_tokens(items[index]) for index in batch]
+                    for index, size in zip(batch, sizes):
+                        tokens = spent.setdefault(index, [0, 0])
+                        tokens[0] += round(usage[0] * size / sum(sizes))
+                        tokens[1] += round(usage[1] / len(batch))
+                
+                if analyses is None:
+                    # The request itself failed, which a retry is unlikely to fix
+                    for index in batch:
+                        results[index] = self._default_analysis(emails[index])
+                    continue
+                
+                for index in batch:
+                    analysis = analyses.get(f"e{index}")
+                    if analysis is None:
+                        failed.append(index)
+                    else:
+                        results[index] = analysis
+            
+            if failed:
+                self.logger.warning(f"No valid analysis for {len(failed)} emails in batch response, re-queueing")
+            pending = failed
+        
+        for index in pending:
+            results[index] = self._analyze_with_llm(emails[index])
+        
+        for index, (prompt_tokens, completion_tokens) in spent.items():
+            results[index] = dict(results[index],
+                                  prompt_tokens=prompt_tokens + results[index].get('prompt_tokens', 0),
+                                  completion_tokens=completion_tokens + results[index].get('completion_tokens', 0))
+        
+        for index in sent:
+            self._store_analysis(emails[index], results[index])
+        for index, original in duplicates.items():
+            results[index] = {field: value for field, value in results[original].items() if field not in TOKEN_FIELDS}
+        
+        return results
+    
+    def _format_batch_item(self, index: int, email_data: Dict) -> str:
+        """Render one email of a batch request"""
+        return f"--- id: e{index}\n" + self.prompt_builder.format_email(email_data)
+    
+    def _pack_batches(self, items: Dict[int, str], max_batch_tokens: int, max_batch_size: int) -> List[List[int]]:
+        """Group rendered emails into batches that fit the token budget"""
+        overhead = count_tokens(SYSTEM_PROMPT) + count_tokens(BATCH_INSTRUCTIONS)
+        batches = []
+        batch = []
+        used = overhead
+        
+        for index, item in items.items():
+            cost = count_tokens(item) + OUTPUT_TOKENS_PER_EMAIL
+            # An email that exceeds the budget on its own still gets a batch of its own
+            if batch and (used + cost > max_batch_tokens or len(batch) >= max_batch_size):
+                batches.append(batch)
+                batch = []
+                used = overhead
+            batch.append(index)
+            used += cost
+        
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    async def _request_batches(self, items: Dict[int, str],
+                               batches: List[List[int]]) -> List[Tuple[Optional[Dict[str, Dict]], Optional[Tuple[int, int]]]]:
+        """Send the requests of several batches concurrently"""
+        return await asyncio.gather(*(self._request_batch(items, batch) for batch in batches))
     
-    def _parse_analysis_response(self, response_text: str) -> Dict:
-        """Parse the LLM response and extract analysis results"""
-        import json
+    async def _request_batch(self, items: Dict[int, str],
+                             batch: List[int]) -> Tuple[Optional[Dict[str, Dict]], Optional[Tuple[int, int]]]:
+        """
+        Send one batch request
+        
+        Returns:
+            The valid analyses by email ID, or None if the request failed, and the
+            prompt and completion tokens of the request, or None if it failed
+        """
+        prompt = BATCH_INSTRUCTIONS + "\n".join(items[index] for index in batch)
+        prompt_tokens = count_tokens(SYSTEM_PROMPT) + count_tokens(prompt)
         
         try:
-            # Try to parse as JSON
-            analysis = json.loads(response_text)
-            return analysis
-        except json.JSONDecodeError:
-            # If JSON parsing fails, extract information manually
-            self.logger.warning("Failed to parse LLM response as JSON, using fallback parsing")
-            return self._extract_analysis_manually(response_text)
+            completion = await self._complete(prompt, OUTPUT_TOKENS_PER_EMAIL * len(batch) + 50,
+                                              prompt_tokens, BATCH_SCHEMA)
+            
+            self.logger.info(f"Analyzed batch of {len(batch)} emails in one request")
+            analyses = self._parse_batch_response(completion.text.strip())
+            for analysis in analyses.values():
+                analysis['model'] = completion.model or self.model
+            return analyses, self._usage(completion, prompt_tokens)
+        
+        except LLMRequestError as e:
+            self.logger.error(f"LLM request analyzing batch of {len(batch)} emails failed, "
+                              f"using heuristic analysis: {str(e)}")
+            return None, None
+        except Exception as e:
+            self.logger.error(f"Error analyzing batch of {len(batch)} emails with Qwen: {str(e)}")
+            return None, None
+    
+    async def _complete(self, prompt: str, max_tokens: int, prompt_tokens: int, schema: Dict):
+        """
+        Send an analysis prompt, asking for structured output in response_format
+        
+        A provider that rejects the response format gets plain text requests from
+        then on (see AsyncLLMClient), while other providers keep the format.
+        """
+        options = {}
+        if self.response_format == "json_schema":
+            options['response_format'] = {
+                "type": "json_schema",
+                "json_schema": {"name": "email_analysis", "schema": schema, "strict": True}
+            }
+        elif self.response_format == "json_object":
+            options['response_format'] = {"type": "json_object"}
+        
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        return await self.llm_client.complete(messages, max_tokens=max_tokens, temperature=0.3,
+                                              estimated_prompt_tokens=prompt_tokens, **options)
+    
+    def _usage(self, completion, prompt_tokens: int) -> Tuple[int, int]:
+        """Get the prompt and completion tokens of a request, counted locally where the server didn't report them"""
+        return (
+            completion.prompt_tokens if completion.prompt_tokens is not None else prompt_tokens,
+            completion.completion_tokens if completion.completion_tokens is not None
+            else count_tokens(completion.text or '')
+        )
+    
+    def _parse_batch_response(self, response_text: str) -> Dict[str, Dict]:
+        """Parse a batch response into analyses by email ID, skipping malformed entries"""
+        analyses = {}
+        for item in extract_objects(response_text):
+            analysis = validate_analysis(item, require_id=True)
+            if analysis is not None:
+                analyses[analysis.pop('id')] = dict(analysis, source="llm")
+        
+        if not analyses:
+            self.logger.warning("Batch response contains no valid analysis")
+        return analyses
+    
+    def _create_analysis_prompt(self, email_data: Dict) -> str:
+        """Create a prompt for the LLM to analyze an email"""
+        return ANALYSIS_INSTRUCTIONS + self.prompt_builder.format_email(email_data)
     
-    def _extract_analysis_manually(self, response_text: str) -> Dict:
-        """Extract analysis information manually from LLM response"""
-        # This is a simplified implementation
-        # In a real application, you'd want more robust parsing
+    def _parse_analysis_response(self, response_text: str) -> Optional[Dict]:
+        """
+        Parse the LLM response and extract analysis results
+        
+        The first object in the response matching the analysis schema is used, even
+        inside a code fence or prose. Otherwise whatever fields can be found are
+        recovered, the rest filled with neutral values.
+        
+        Returns:
+            The analysis, or None if the response holds none of its fields
+        """
+        for item in extract_objects(response_text):
+            analysis = validate_analysis(item)
+            if analysis is not None:
+                return dict(analysis, source="llm")
         
-        # Default values
+        fields = recover_fields(response_text)
+        if not fields:
+            return None
+        
+        self.logger.warning(f"LLM response is not a valid analysis, recovered {', '.join(fields)}")
         analysis = {
             "importance": 0.5,
             "summary": "Unable to generate summary",
             "category": "other",
-            "action": "read"
+            "action": "read",
+            "source": "llm"
         }
-        
-        # Simple keyword-based extraction
-        if "importance" in response_text.lower():
-            # Try to extract importance value
-            import re
-            imp_match = re.search(r"importance.*?([0-9]*\.?[0-9]+)", response_text, re.IGNORECASE)
-            if imp_match:
-                try:
-                    analysis["importance"] = float(imp_match.group(1))
-                except ValueError:
-                    pass
-        
+        analysis.update(fields)
         return analysis
     
+    def close(self):
+        """Stop the LLM client's background event loop"""
+        if self.llm_client:
+            self.llm_client.close()
+    
     def _default_analysis(self, email_data: Dict) -> Dict:
         """Provide a default analysis when LLM is not available"""
-        self.logger.info("Using default email analysis (no LLM API key)")
-        
-        # Simple heuristic-based analysis
-        subject = email_data.get('subject', '').lower()
-        body = email_data.get('body', '').lower()
-        sender = email_data.get('from', '').lower()
-        
-        # Determine category based on keywords
-        category = "other"
-        if any(word in subject for word in ['meeting', 'urgent', 'asap', 'deadline', 'project', 'task']):
-            category = "work"
-        elif any(word in subject for word in ['offer', 'deal', 'discount', 'sale', 'newsletter']):
-            category = "newsletter"
-        elif any(word in body for word in ['unsubscribe', 'opt out']) or 'noreply' in sender:
-            category = "spam"
-        elif any(word in subject for word in ['personal', 'friend', 'family']):
-            category = "personal"
-        
-        # Determine action based on category
-        action = "read"
-        if category == "spam":
-            action = "delete"
-        elif category == "newsletter":
-            action = "archive"
-        
-        # Determine importance based on category and keywords
-        importance = 0.5
-        if category == "work":
-            importance = 0.8
-        elif category == "spam":
-            importance = 0.1
-        elif category == "newsletter":
-            importance = 0.3
-        elif category == "personal":
-            importance = 0.7
-            
-        # Adjust importance based on sender
-        if any(domain in sender for domain in ['boss@', 'manager@', 'supervisor@']):
-            importance = min(1.0, importance + 0.2)
+        self.logger.info("Using default email analysis")
+        return self._default_analyses([email_data])[0]
+    
+    def _default_analyses(self, emails: List[Dict]) -> List[Dict]:
+        """Provide default analyses of several emails from the keyword rules"""
+        analyses = []
+        for email_data, analysis in zip(emails, self.rules.evaluate_batch(emails)):
+            # Generate a simple summary
+            subject = email_data.get('subject', '')
+            summary = f"Email from {email_data.get('from', 'Unknown sender')}"
+            if subject:
+                summary += f" with subject: {subject[:50]}{'...' if len(subject) > 50 else ''}"
             
-        # Generate a simple summary
-        summary = f"Email from {email_data.get('from', 'Unknown sender')}"
-        if subject:
-            summary += f" with subject: {subject[:50]}{'...' if len(subject) > 50 else ''}"
-        
-        return {
-            "importance": importance,
-            "summary": summary,
-            "category": category,
-            "action": action
-        }
\ No newline at end of file
+            analyses.append({
+                "importance": analysis['importance'],
+                "summary": summary,
+                "category": analysis['category'],
+                "action": analysis['action'],
+                "source": "heuristic"
+            })
+        return analyses
@@ -0,0 +1,157 @@
+"""
+Analysis cache for the Personal Email Management Assistant
+Persists LLM analyses by content hash so identical emails are only analyzed once
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from email.utils import parseaddr
+from typing import Dict, Optional
+
+_WHITESPACE = re.compile(r'\s+')
+
+def _normalize(text: Optional[str]) -> str:
+    return _WHITESPACE.sub(' ', str(text or '')).strip().lower()
+
+def normalized_sender(email_data: Dict) -> str:
+    """Get the lower-cased address of an email's sender"""
+    return _normalize(parseaddr(str(email_data.get('from') or ''))[1] or email_data.get('from'))
+
+def content_key(email_data: Dict, model: str, prompt_version: str) -> str:
+    """
+    Build the content key of an email
+    
+    Hashes the normalized sender address, subject and body together with the model
+    and prompt version, so a new model or prompt never reuses old answers. Callers
+    that clean the body for the prompt pass the cleaned body, so the key covers
+    exactly what the LLM saw.
+    """
+    parts = [
+        normalized_sender(email_data),
+        _normalize(email_data.get('subject')),
+        _normalize(email_data.get('body')),
+        model,
+        prompt_version
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+class AnalysisCache:
+    """
+    SQLite-backed cache of email analyses keyed by a hash of the email content
+    
+    Entries expire after ttl seconds; beyond max_entries the least recently used
+    entries are evicted. Hits and misses are counted for get_stats.
+    """
+    
+    def __init__(self, db_path: str = "analysis_cache.db", ttl: float = 7 * 24 * 3600,
+                 max_entries: int = 10000):
+        """
+        Args:
+            db_path: SQLite file holding the cache
+            ttl: Seconds an entry stays valid
+            max_entries: Entries kept before the least recently used are evicted
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._initialize_database()
+    
+    def _initialize_database(self):
+        """Create the cache table"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS analysis_cache (
+                        key TEXT PRIMARY KEY,
+                        analysis TEXT,
+                        created_at REAL,
+                        last_used REAL
+                    )
+                """)
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache (last_used)")
+                
+                conn.commit()
+        
+        except Exception as e:
+            self.logger.error(f"Error initializing analysis cache: {str(e)}")
+            raise
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Get a cached analysis, or None when missing or expired"""
+        now = time.time()
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("SELECT analysis FROM analysis_cache WHERE key = ? AND created_at > ?",
+                               (key, now - self.ttl))
+                row = cursor.fetchone()
+                if row:
+                    cursor.execute("UPDATE analysis_cache SET last_used = ? WHERE key = ?", (now, key))
+                    conn.commit()
+        
+        except Exception as e:
+            self.logger.error(f"Error reading analysis cache: {str(e)}")
+            row = None
+        
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return json.loads(row[0]) if row else None
+    
+    def put(self, key: str, analysis: Dict) -> bool:
+        """Store an analysis, evicting expired and least recently used entries"""
+        now = time.time()
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    INSERT OR REPLACE INTO analysis_cache (key, analysis, created_at, last_used)
+                    VALUES (?, ?, ?, ?)
+                """, (key, json.dumps(analysis), now, now))
+                
+                cursor.execute("DELETE FROM analysis_cache WHERE created_at <= ?", (now - self.ttl,))
+                evicted = cursor.rowcount
+                cursor.execute("""
+                    DELETE FROM analysis_cache WHERE key IN (
+                        SELECT key FROM analysis_cache ORDER BY last_used
+                        LIMIT MAX(0, (SELECT COUNT(*) FROM analysis_cache) - ?)
+                    )
+                """, (self.max_entries,))
+                evicted += cursor.rowcount
+                
+                conn.commit()
+            
+            with self._lock:
+                self.evictions += evicted
+            return True
+        
+        except Exception as e:
+            self.logger.error(f"Error writing analysis cache: {str(e)}")
+            return False
+    
+    def get_stats(self) -> Dict:
+        """Get hit, miss and eviction counters since start"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
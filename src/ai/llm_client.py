@@ -0,0 +1,292 @@
+"""
+LLM client for the Personal Email Management Assistant
+Runs chat completions concurrently within requests-per-minute and tokens-per-minute budgets
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Coroutine, Dict, List, NamedTuple, Optional
+
+import openai
+
+class LLMRequestError(Exception):
+    """A chat completion failed for good: not retryable, or out of retries"""
+
+class Completion(NamedTuple):
+    """Text of a chat completion, the tokens it used (None where the server didn't report them) and the model that wrote it"""
+    text: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    model: Optional[str] = None
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute
+    
+    Callers reserve tokens up front and wait until the balance covers them, so
+    waiting requests are served in order and the long-run rate never exceeds the budget.
+    """
+    
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def reserve(self, amount: float = 1) -> float:
+        """Take amount tokens and return the seconds to wait before using them"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A request larger than the bucket would otherwise never fit
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+    
+    async def acquire(self, amount: float = 1):
+        """Wait until amount tokens are available"""
+        delay = self.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    def refund(self, amount: float):
+        """Return reserved tokens that were not used"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+    
+    def block(self, seconds: float):
+        """Hold back every reservation for the next seconds (e.g. after a 429 with Retry-After)"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Get the delay a server asked for in Retry-After (or retry-after-ms), in seconds"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed request is worth retrying (timeouts, rate limits, server errors)"""
+    if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+class BackgroundLoop:
+    """
+    An asyncio event loop on a daemon thread, started on first use
+    
+    Coroutines are submitted from any thread with run, so synchronous callers share
+    one loop and everything bound to it (HTTP connection pools, semaphores).
+    """
+    
+    _thread_name = "llm-client"
+    
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+    
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the background event loop on first use"""
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self._thread_name, daemon=True)
+                self._thread.start()
+            return self._loop
+    
+    def run(self, coroutine: Coroutine) -> Any:
+        """Run a coroutine on the background event loop from any thread and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+    
+    def close(self):
+        """Stop the background event loop"""
+        with self._start_lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+class AsyncLLMClient(BackgroundLoop):
+    """
+    Concurrent chat completions on a background event loop
+    
+    All callers, from any thread, share one event loop, one HTTP connection pool,
+    the concurrency limit and the rate budgets. Failed requests are retried with
+    exponential backoff and full jitter, waiting at least as long as Retry-After.
+    If the provider rejects a response_format, the request is sent again without
+    it, and so are all later requests to this provider.
+    
+    Usage:
+        client = AsyncLLMClient(openai.AsyncOpenAI(max_retries=0), "qwen-plus")
+        text = client.run(client.complete(messages, max_tokens=300)).text
+    """
+    
+    def __init__(self, client: Any, model: str, max_concurrent_requests: int = 4,
+                 requests_per_minute: Optional[float] = 60, tokens_per_minute: Optional[float] = 100000,
+                 request_timeout: float = 60, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0):
+        """
+        Args:
+            client: An openai.AsyncOpenAI compatible client, with its own retries disabled
+            model: Model name sent with every request
+            max_concurrent_requests: Requests in flight at once
+            requests_per_minute: Request budget, None for unlimited
+            tokens_per_minute: Token budget (prompt plus max_tokens), None for unlimited
+            request_timeout: Seconds before a single attempt is abandoned
+            max_retries: Retries of a failed request before giving up
+            backoff_base: Backoff before the first retry, doubled for every further one
+            backoff_max: Upper bound of the backoff
+        """
+        super().__init__()
+        self.client = client
+        self.model = model
+        self.max_concurrent_requests = max(1, max_concurrent_requests)
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.logger = logging.getLogger(__name__)
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'tokens': 0}
+        self.response_format_supported = True
+        self._semaphore: Optional[asyncio.Semaphore] = None
+    
+    async def complete(self, messages: List[Dict], max_tokens: int, temperature: float = 0.3,
+                       estimated_prompt_tokens: int = 0, **options) -> Completion:
+        """
+        Get one chat completion, retrying transient failures
+        
+        Args:
+            messages: Chat messages
+            max_tokens: Answer token limit
+            temperature: Sampling temperature
+            estimated_prompt_tokens: Prompt size charged to the token budget
+            options: Further arguments for chat.completions.create
+        
+        Raises:
+            LLMRequestError: The request failed and can't be retried, or ran out of retries
+        """
+        if self._semaphore is None:
+            # Created here so it belongs to the client's event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        
+        reserved = estimated_prompt_tokens + max_tokens
+        attempt = 0
+        while True:
+            if not self.response_format_supported:
+                options.pop('response_format', None)
+            held = 0
+            try:
+                if self.requests:
+                    await self.requests.acquire()
+                if self.tokens:
+                    # Reserved as soon as acquire starts, even if it is cancelled while waiting
+                    held = reserved
+                    await self.tokens.acquire(reserved)
+                
+                async with self._semaphore:
+                    self.stats['requests'] += 1
+                    response = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=self.model,
+                            messages=messages,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            **options
+                        ),
+                        timeout=self.request_timeout
+                    )
+            except asyncio.CancelledError:
+                # Abandoned, e.g. a hedged request that lost the race
+                self._refund(held)
+                raise
+            except Exception as e:
+                # A failed attempt reports no usage; rejected ones (429) cost nothing
+                self._refund(held)
+                if 'response_format' in options and isinstance(e, openai.BadRequestError):
+                    self.response_format_supported = False
+                    self.logger.warning(f"LLM provider of {self.model} rejected response format "
+                                        f"{options['response_format'].get('type')}, using plain text responses: {e}")
+                    continue
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self.stats['failures'] += 1
+                    raise LLMRequestError(f"{type(e).__name__}: {e} (after {attempt} retries)") from e
+                
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                server_delay = retry_after(e)
+                if server_delay is not None:
+                    delay = max(delay, server_delay)
+                    # Everyone waits, not just this request, or the next ones hit the limit too
+                    if self.requests:
+                        self.requests.block(server_delay)
+                
+                attempt += 1
+                self.stats['retries'] += 1
+                self.logger.warning(f"LLM request failed ({type(e).__name__}), retry {attempt}/{self.max_retries} "
+                                    f"in {delay:.1f} seconds")
+                await asyncio.sleep(delay)
+                continue
+            
+            # Give back the part of the reservation the request didn't use
+            usage = getattr(response, 'usage', None)
+            used = getattr(usage, 'total_tokens', None)
+            if isinstance(used, int):
+                self.stats['tokens'] += used
+                if self.tokens and used < reserved:
+                    self.tokens.refund(reserved - used)
+            
+            prompt_tokens = getattr(usage, 'prompt_tokens', None)
+            completion_tokens = getattr(usage, 'completion_tokens', None)
+            return Completion(
+                response.choices[0].message.content,
+                prompt_tokens if isinstance(prompt_tokens, int) else None,
+                completion_tokens if isinstance(completion_tokens, int) else None,
+                self.model
+            )
+    
+    def _refund(self, reserved: int):
+        """Return the token reservation of an attempt that didn't complete"""
+        if self.tokens and reserved:
+            self.tokens.refund(reserved)
+    
+    def close(self):
+        """Stop the background event loop"""
+        super().close()
+        self._semaphore = None
@@ -0,0 +1,109 @@
+"""
+Prompt building for the Personal Email Management Assistant
+Cleans email bodies and fits them into a token budget before they are sent to the LLM
+"""
+
+import logging
+import re
+from typing import Dict, Optional
+
+from src.utils.text import html_to_text, looks_like_html, strip_quoted_text
+
+try:
+    import tiktoken
+except ImportError:  # Optional dependency
+    tiktoken = None
+
+_encoding = None
+_PARAGRAPHS = re.compile(r'\n\s*\n')
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a text without a tokenizer
+    
+    About four ASCII characters make a token; other characters (CJK in particular)
+    are counted as one token each.
+    """
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text with tiktoken when it is installed, else estimate them"""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # The encoding is downloaded on first use, which fails offline
+            logging.getLogger(__name__).warning(f"tiktoken unavailable, estimating tokens: {str(e)}")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Shorten a text to at most max_tokens tokens
+    
+    Whole paragraphs are kept from the start while they fit; the first one that
+    doesn't is cut at a word boundary.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    
+    kept = []
+    used = 0
+    for paragraph in _PARAGRAPHS.split(text):
+        tokens = count_tokens(paragraph)
+        if used + tokens <= max_tokens:
+            kept.append(paragraph)
+            used += tokens
+            continue
+        
+        # Binary search for the longest prefix that fits the rest of the budget
+        low, high = 0, len(paragraph)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(paragraph[:middle]) <= max_tokens - used:
+                low = middle
+            else:
+                high = middle - 1
+        prefix = paragraph[:low]
+        if low < len(paragraph) and ' ' in prefix:
+            prefix = prefix.rsplit(' ', 1)[0]
+        if prefix.strip():
+            kept.append(prefix.rstrip() + " ...")
+        break
+    
+    return '\n\n'.join(kept)
+
+class PromptBuilder:
+    """
+    Renders emails for analysis prompts
+    
+    HTML is converted to text, quoted reply history, signatures and link-only lines
+    are removed, and what is left is cut to a token budget, so the prompt holds the
+    new content of an email rather than the first characters of its raw body.
+    """
+    
+    def __init__(self, body_tokens: int = 300):
+        """
+        Args:
+            body_tokens: Token budget of an email's body in a prompt
+        """
+        self.body_tokens = body_tokens
+    
+    def clean_body(self, body: Optional[str]) -> str:
+        """Get the informative text of a body within the token budget"""
+        text = str(body or '')
+        if looks_like_html(text):
+            text = html_to_text(text)
+        return truncate_to_tokens(strip_quoted_text(text), self.body_tokens)
+    
+    def format_email(self, email_data: Dict) -> str:
+        """Render the sender, subject and cleaned body of an email"""
+        return (
+            f"From: {email_data.get('from') or 'Unknown'}\n"
+            f"Subject: {email_data.get('subject') or 'No subject'}\n"
+            f"Body: {self.clean_body(email_data.get('body')) or 'No body'}\n"
+        )
@@ -0,0 +1,212 @@
+"""
+Response parsing for the Personal Email Management Assistant
+Pulls analyses out of LLM answers, even when fenced, wrapped in prose, streamed or cut off
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+CATEGORIES = ["work", "personal", "newsletter", "spam", "other"]
+ACTIONS = ["read", "archive", "delete"]
+
+# JSON Schema of one analysis, used for structured output and to validate answers
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "importance": {"type": "number", "description": "0 to 1, where 1 is very important"},
+        "summary": {"type": "string"},
+        "category": {"type": "string", "enum": CATEGORIES},
+        "action": {"type": "string", "enum": ACTIONS}
+    },
+    "required": ["importance", "summary", "category", "action"],
+    "additionalProperties": False
+}
+
+# JSON Schema of a batch answer: one analysis per email, tagged with the email's id
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analyses": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": dict({"id": {"type": "string"}}, **ANALYSIS_SCHEMA["properties"]),
+                "required": ["id"] + ANALYSIS_SCHEMA["required"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["analyses"],
+    "additionalProperties": False
+}
+
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+class IncrementalJSONParser:
+    """
+    Finds JSON objects in text fed piece by piece
+    
+    Every object that stands on its own or is an element of an array is returned
+    as soon as its closing brace arrives, so a streamed answer can be used before
+    it is complete and a cut-off answer still yields its finished objects. Prose
+    and code fences around the JSON are skipped, and trailing commas tolerated.
+    A brace in the prose that doesn't start valid JSON is scanned past, once it
+    closes or once finish is called, so the objects inside it are still found.
+    """
+    
+    def __init__(self):
+        self._buffer = ''
+        self._position = 0
+        self._stack = []  # (bracket, start of an object to return or None)
+        self._in_string = False
+        self._escaped = False
+        self._returned = set()  # starts of the objects returned, which a rescan must not repeat
+    
+    def feed(self, text: str) -> List[Dict]:
+        """Add text and get the objects completed by it"""
+        self._buffer += text
+        found = []
+        
+        while self._position < len(self._buffer):
+            char = self._buffer[self._position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._stack:
+                # Quotes only delimit strings inside JSON, not in the prose around it
+                self._in_string = True
+            elif char in '{[':
+                wanted = char == '{' and (not self._stack or self._stack[-1][0] == '[')
+                self._stack.append((char, self._position if wanted else None))
+            elif char in '}]' and self._stack:
+                bracket, start = self._stack.pop()
+                if start is not None and bracket == '{' and char == '}':
+                    value = self._load(self._buffer[start:self._position + 1])
+                    if value is None:
+                        # Not JSON, e.g. a brace in prose: look for objects inside it
+                        self._rescan_from(start)
+                    elif isinstance(value, dict) and start not in self._returned:
+                        self._returned.add(start)
+                        found.append(value)
+            self._position += 1
+        
+        if not self._stack:
+            # Nothing open refers back into the buffer
+            self._buffer = ''
+            self._position = 0
+            self._returned.clear()
+        return found
+    
+    def finish(self) -> List[Dict]:
+        """The text is complete: get the objects inside braces that were never closed"""
+        found = []
+        while True:
+            unclosed = [index for index, (_, start) in enumerate(self._stack) if start is not None]
+            if not unclosed:
+                return found
+            start = self._stack[unclosed[0]][1]
+            del self._stack[unclosed[0]:]
+            self._rescan_from(start)
+            self._position += 1
+            found.extend(self.feed(''))
+    
+    def _rescan_from(self, start: int):
+        """Scan again from just after the opening brace at start, as if it were prose"""
+        self._position = start
+        self._in_string = False
+        self._escaped = False
+    
+    def _load(self, text: str) -> Any:
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                return json.loads(_TRAILING_COMMA.sub(r'\1', text))
+            except json.JSONDecodeError:
+                return None
+
+def extract_objects(text: str) -> List[Dict]:
+    """Get the JSON objects in a complete answer (see IncrementalJSONParser)"""
+    parser = IncrementalJSONParser()
+    return parser.feed(text) + parser.finish()
+
+def _enum_value(value: Any, allowed: List[str], default: str) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower()
+    return value if value in allowed else default
+
+def validate_analysis(item: Any, require_id: bool = False) -> Optional[Dict]:
+    """
+    Check an answer object against ANALYSIS_SCHEMA and normalize it
+    
+    Types must match: importance a number (or numeric string, but not a boolean),
+    summary a string, category and action strings. Importance is clamped to 0-1; categories and
+    actions are matched case-insensitively, unknown ones become "other" and "read".
+    
+    Returns:
+        The analysis (with its id as a string when require_id), or None if invalid
+    """
+    if not isinstance(item, dict) or (require_id and 'id' not in item) or isinstance(item.get('importance'), bool):
+        return None
+    
+    try:
+        importance = float(item.get('importance'))
+    except (TypeError, ValueError):
+        return None
+    summary = item.get('summary')
+    category = _enum_value(item.get('category'), CATEGORIES, "other")
+    action = _enum_value(item.get('action'), ACTIONS, "read")
+    if not isinstance(summary, str) or category is None or action is None or importance != importance:
+        return None
+    
+    analysis = {
+        "importance": min(1.0, max(0.0, importance)),
+        "summary": summary.strip(),
+        "category": category,
+        "action": action
+    }
+    if require_id:
+        analysis['id'] = str(item['id'])
+    return analysis
+
+_FIELD_PATTERNS = {
+    'importance': re.compile(r'"?importance"?\s*[:=]\s*"?([0-9]*\.?[0-9]+)', re.IGNORECASE),
+    'summary': re.compile(r'"summary"\s*:\s*"((?:[^"\\]|\\.)*)', re.IGNORECASE | re.DOTALL),
+    'category': re.compile(r'"?category"?\s*[:=]\s*"?([a-z]+)', re.IGNORECASE),
+    'action': re.compile(r'"?action"?\s*[:=]\s*"?([a-z]+)', re.IGNORECASE)
+}
+
+def recover_fields(text: str) -> Dict:
+    """
+    Pull whatever analysis fields can be found out of an answer that isn't valid JSON
+    
+    Useful for answers cut off by the token limit: a summary missing its closing
+    quote is still recovered.
+    
+    Returns:
+        The fields found, normalized as in validate_analysis
+    """
+    fields = {}
+    for field, pattern in _FIELD_PATTERNS.items():
+        match = pattern.search(text)
+        if not match:
+            continue
+        value = match.group(1)
+        if field == 'importance':
+            fields[field] = min(1.0, max(0.0, float(value)))
+        elif field == 'summary':
+            try:
+                fields[field] = json.loads(f'"{value}"').strip()
+            except json.JSONDecodeError:
+                fields[field] = value.strip()
+        elif field == 'category':
+            fields[field] = _enum_value(value, CATEGORIES, "other")
+        else:
+            fields[field] = _enum_value(value, ACTIONS, "read")
+    return fields
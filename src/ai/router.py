@@ -0,0 +1,221 @@
+"""
+LLM provider routing for the Personal Email Management Assistant
+Sends each chat completion to the fastest healthy backend and hedges slow requests
+"""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from src.ai.llm_client import AsyncLLMClient, BackgroundLoop, Completion, LLMRequestError
+
+class Backend:
+    """
+    An LLM client with the rolling latency and error rate of its recent requests
+    
+    Samples older than window seconds are forgotten, so a backend that had a bad
+    minute is measured afresh, and tried again, once it has passed. A request that
+    was cancelled before it finished, e.g. the loser of a hedge race, is a censored
+    sample: it only says the request took at least that long, so it counts towards
+    the backend's score but not towards the latency its requests are hedged after.
+    """
+    
+    def __init__(self, name: str, client: AsyncLLMClient, window: float = 300, max_samples: int = 200):
+        """
+        Args:
+            name: Name used in logs and stats
+            client: Client sending the requests (its loop is not used, the router's is)
+            window: Seconds a latency or error sample counts
+            max_samples: Most recent samples kept within the window
+        """
+        self.name = name
+        self.client = client
+        self.window = window
+        self.samples = deque(maxlen=max_samples)  # (time, seconds, succeeded or None if censored)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float, succeeded: Optional[bool]):
+        with self._lock:
+            self.samples.append((time.monotonic(), seconds, succeeded))
+    
+    def _recent(self) -> List:
+        with self._lock:
+            cutoff = time.monotonic() - self.window
+            while self.samples and self.samples[0][0] < cutoff:
+                self.samples.popleft()
+            return list(self.samples)
+    
+    def latency(self, quantile: float = 0.5, include_censored: bool = False) -> Optional[float]:
+        """Get a quantile of the recent request durations, None without samples"""
+        durations = sorted(seconds for _, seconds, succeeded in self._recent()
+                           if include_censored or succeeded is not None)
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, int(quantile * len(durations)))]
+    
+    def error_rate(self) -> float:
+        """Get the share of recent requests that failed"""
+        recent = self._recent()
+        if not recent:
+            return 0.0
+        return sum(1 for _, _, succeeded in recent if succeeded is False) / len(recent)
+    
+    def score(self) -> float:
+        """
+        Get the expected seconds until a request succeeds; lower is better
+        
+        Unmeasured backends score 0, so they are tried (or tried again) first.
+        """
+        latency = self.latency(include_censored=True)
+        if latency is None:
+            return 0.0
+        success_rate = 1.0 - self.error_rate()
+        return latency / success_rate if success_rate > 0 else math.inf
+    
+    def sample_count(self) -> int:
+        """Get the number of recent requests that finished"""
+        return sum(1 for _, _, succeeded in self._recent() if succeeded is not None)
+
+class LLMRouter(BackgroundLoop):
+    """
+    Chat completions spread over several LLM backends
+    
+    Each request goes to the backend with the lowest expected latency, i.e. its
+    rolling median latency divided by its success rate; if that backend fails for
+    good (after its own retries) the next one is tried. With hedging, a request
+    that is still running after the backend's rolling p95 latency is also sent to
+    the next best backend, and whichever answers first is used, so one provider's
+    slow minute no longer sets the tail latency of the analysis.
+    
+    The router has the interface of AsyncLLMClient (run, complete, stats, close).
+    
+    Usage:
+        router = LLMRouter({"qwen": qwen_client, "openai": openai_client})
+        text = router.run(router.complete(messages, max_tokens=300)).text
+    """
+    
+    _thread_name = "llm-router"
+    
+    def __init__(self, clients: Dict[str, AsyncLLMClient], hedge_requests: bool = True,
+                 hedge_min_samples: int = 20, hedge_quantile: float = 0.95, window: float = 300):
+        """
+        Args:
+            clients: Backends by name, in order of preference while they are unmeasured
+            hedge_requests: Send requests still running after the hedge deadline to a second backend
+            hedge_min_samples: Samples a backend needs before its requests are hedged
+            hedge_quantile: Latency quantile of a backend after which its requests are hedged
+            window: Seconds a latency or error sample counts
+        """
+        if not clients:
+            raise ValueError("LLMRouter needs at least one backend")
+        super().__init__()
+        self.backends = [Backend(name, client, window) for name, client in clients.items()]
+        self.model = self.backends[0].client.model
+        self.hedge_requests = hedge_requests and len(self.backends) > 1
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_quantile = hedge_quantile
+        self.logger = logging.getLogger(__name__)
+        self.routing_stats = {'hedged': 0, 'hedge_wins': 0, 'failovers': 0}
+    
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Request counters of all backends added up, with the router's own counters"""
+        totals = {'requests': 0, 'retries': 0, 'failures': 0, 'tokens': 0}
+        for backend in self.backends:
+            for key in totals:
+                totals[key] += backend.client.stats.get(key, 0)
+        totals.update(self.routing_stats)
+        return totals
+    
+    def ranked(self) -> List[Backend]:
+        """Get the backends from best to worst score, keeping the configured order on ties"""
+        return sorted(self.backends, key=lambda backend: backend.score())
+    
+    def hedge_delay(self, backend: Backend) -> Optional[float]:
+        """Get the seconds after which a request to backend is hedged, None to not hedge"""
+        if not self.hedge_requests or backend.sample_count() < self.hedge_min_samples:
+            return None
+        return backend.latency(self.hedge_quantile)
+    
+    async def _attempt(self, backend: Backend, messages: List[Dict], max_tokens: int, temperature: float,
+                       estimated_prompt_tokens: int, options: Dict) -> Completion:
+        """Send a request to one backend, recording how long it took and whether it succeeded"""
+        start = time.monotonic()
+        try:
+            completion = await backend.client.complete(messages, max_tokens=max_tokens, temperature=temperature,
+                                                       estimated_prompt_tokens=estimated_prompt_tokens, **options)
+        except LLMRequestError:
+            backend.record(time.monotonic() - start, False)
+            raise
+        backend.record(time.monotonic() - start, True)
+        return completion
+    
+    async def complete(self, messages: List[Dict], max_tokens: int, temperature: float = 0.3,
+                       estimated_prompt_tokens: int = 0, **options) -> Completion:
+        """
+        Get one chat completion from the best backend (see AsyncLLMClient.complete)
+        
+        Raises:
+            LLMRequestError: Every backend failed; the last backend's error is raised
+        """
+        pending = {}  # task to (backend, start time)
+        candidates = deque(self.ranked())
+        error = None
+        
+        def start_next() -> bool:
+            if not candidates:
+                return False
+            backend = candidates.popleft()
+            task = asyncio.ensure_future(self._attempt(backend, messages, max_tokens, temperature,
+                                                       estimated_prompt_tokens, options))
+            pending[task] = (backend, time.monotonic())
+            return True
+        
+        start_next()
+        first = next(iter(pending.values()))[0]
+        try:
+            while pending:
+                # Hedge the request once the backend of the oldest attempt runs late
+                timeout = None
+                if len(pending) == 1 and candidates:
+                    timeout = self.hedge_delay(next(iter(pending.values()))[0])
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    self.routing_stats['hedged'] += 1
+                    self.logger.debug(f"LLM request to {next(iter(pending.values()))[0].name} exceeded "
+                                      f"{timeout:.2f} seconds, hedging to {candidates[0].name}")
+                    start_next()
+                    continue
+                
+                for task in done:
+                    backend = pending.pop(task)[0]
+                    try:
+                        completion = task.result()
+                    except LLMRequestError as e:
+                        error = e
+                        self.logger.warning(f"LLM backend {backend.name} failed: {str(e)}")
+                        continue
+                    if pending and backend is not first:
+                        self.routing_stats['hedge_wins'] += 1
+                    return completion
+                
+                if not pending and start_next():
+                    self.routing_stats['failovers'] += 1
+        finally:
+            for task, (backend, start) in pending.items():
+                task.cancel()
+                # Lost a hedge race: it took at least this long
+                backend.record(time.monotonic() - start, None)
+        
+        raise error
+    
+    def close(self):
+        """Stop the background event loop and close every backend"""
+        super().close()
+        for backend in self.backends:
+            backend.client.close()
@@ -0,0 +1,156 @@
+"""
+Rule engine for the Personal Email Management Assistant
+Keyword rules compiled into one case-insensitive matcher per email field
+"""
+
+import logging
+import re
+from typing import Dict, List, Optional, Set
+
+FIELDS = ('subject', 'sender', 'body')
+
+# The keyword analysis used when no LLM is available
+DEFAULT_RULES = {
+    "categories": {
+        "work": {"importance": 0.8, "action": "read"},
+        "personal": {"importance": 0.7, "action": "read"},
+        "newsletter": {"importance": 0.3, "action": "archive"},
+        "spam": {"importance": 0.1, "action": "delete"},
+        "other": {"importance": 0.5, "action": "read"}
+    },
+    "rules": [
+        {"fields": ["subject"], "keywords": ["meeting", "urgent", "asap", "deadline", "project", "task"],
+         "category": "work"},
+        {"fields": ["subject"], "keywords": ["offer", "deal", "discount", "sale", "newsletter"],
+         "category": "newsletter"},
+        {"fields": ["body"], "keywords": ["unsubscribe", "opt out"], "category": "spam"},
+        {"fields": ["sender"], "keywords": ["noreply"], "category": "spam"},
+        {"fields": ["subject"], "keywords": ["personal", "friend", "family"], "category": "personal"},
+        {"fields": ["sender"], "keywords": ["boss@", "manager@", "supervisor@"], "weight": 0.2}
+    ]
+}
+
+def _trie_pattern(node: Dict) -> str:
+    """
+    Build a regular expression matching the keywords of a trie, longest first
+    
+    Keywords sharing a prefix share its branch, so at each position the regex
+    engine follows one path instead of trying every keyword in turn.
+    """
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    # A keyword ending here: try the longer keywords first
+    return f'(?:{pattern})?' if '' in node else pattern
+
+class RuleEngine:
+    """
+    Keyword rules that set an email's category and adjust its importance
+    
+    Every rule lists keywords matched case-insensitively as substrings of some of
+    an email's fields (subject, sender, body). The first matching rule with a
+    category decides the category, which sets the base importance and the action;
+    the weights of all matching rules are added to the importance.
+    
+    The keywords of all rules are compiled into one trie-shaped regular expression
+    per field, so each field is lower-cased once and scanned once however many
+    keywords there are. The expression is a lookahead, so the longest keyword
+    starting at every position is found, and keywords that overlap each other are
+    all reported, as with a substring check per keyword.
+    """
+    
+    def __init__(self, config: Optional[Dict] = None):
+        """
+        Args:
+            config: Dictionary with "categories" (name to importance and action) and
+                    "rules" (fields, keywords and a category and/or weight), as in
+                    DEFAULT_RULES; None for DEFAULT_RULES
+        """
+        self.logger = logging.getLogger(__name__)
+        config = config or DEFAULT_RULES
+        self.categories = config.get('categories') or DEFAULT_RULES['categories']
+        self.default_category = 'other' if 'other' in self.categories else next(iter(self.categories))
+        self.rules = []
+        self._matchers = {}
+        self._compile(config.get('rules', []))
+    
+    def _compile(self, rules: List[Dict]):
+        """Build the per-field matchers and the rules each keyword fires"""
+        keyword_rules = {field: {} for field in FIELDS}
+        
+        for rule in rules:
+            category = rule.get('category')
+            if category is not None and category not in self.categories:
+                raise ValueError(f"Rule category {category!r} is not defined in categories")
+            fields = rule.get('fields', ['subject'])
+            unknown = set(fields) - set(FIELDS)
+            if unknown:
+                raise ValueError(f"Unknown rule fields: {', '.join(sorted(unknown))}")
+            
+            index = len(self.rules)
+            self.rules.append({'category': category, 'weight': float(rule.get('weight', 0.0))})
+            for field in fields:
+                for keyword in rule.get('keywords', []):
+                    if keyword:
+                        keyword_rules[field].setdefault(keyword.lower(), set()).add(index)
+        
+        for field, rules_by_keyword in keyword_rules.items():
+            if not rules_by_keyword:
+                continue
+            # A match of a keyword is also a match of every keyword inside it
+            fired = {
+                keyword: frozenset().union(*(indices for other, indices in rules_by_keyword.items()
+                                             if other in keyword))
+                for keyword in rules_by_keyword
+            }
+            trie = {}
+            for keyword in fired:
+                node = trie
+                for char in keyword:
+                    node = node.setdefault(char, {})
+                node[''] = {}
+            self._matchers[field] = (re.compile(f"(?=({_trie_pattern(trie)}))"), fired)
+    
+    def matching_rules(self, emails: List[Dict]) -> List[Set[int]]:
+        """Get the indices of the rules matching each email"""
+        matched = [set() for _ in emails]
+        for field, (pattern, fired) in self._matchers.items():
+            key = 'from' if field == 'sender' else field
+            for rules, email_data in zip(matched, emails):
+                text = email_data.get(key)
+                if text:
+                    for keyword in set(pattern.findall(str(text).lower())):
+                        rules |= fired[keyword]
+        return matched
+    
+    def evaluate(self, email_data: Dict) -> Dict:
+        """Get the category, action and importance of an email"""
+        return self.evaluate_batch([email_data])[0]
+    
+    def evaluate_batch(self, emails: List[Dict]) -> List[Dict]:
+        """Evaluate several emails (see evaluate)"""
+        return [self._evaluate(matched) for matched in self.matching_rules(emails)]
+    
+    def _evaluate(self, matched: Set[int]) -> Dict:
+        """Turn the rules matching an email into its category, action and importance"""
+        category = next((self.rules[index]['category'] for index in sorted(matched)
+                         if self.rules[index]['category'] is not None), self.default_category)
+        settings = self.categories[category]
+        importance = float(settings.get('importance', 0.5))
+        importance += sum(self.rules[index]['weight'] for index in matched)
+        
+        return {
+            "importance": min(1.0, max(0.0, importance)),
+            "category": category,
+            "action": settings.get('action', 'read')
+        }
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'RuleEngine':
+        """Build the engine from the analysis_rules setting, falling back to DEFAULT_RULES if it is invalid"""
+        try:
+            return cls(config)
+        except (AttributeError, TypeError, ValueError, re.error) as e:
+            logging.getLogger(__name__).error(f"Invalid analysis rules, using the default rules: {str(e)}")
+            return cls()
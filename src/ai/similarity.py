@@ -0,0 +1,204 @@
+"""
+Near-duplicate detection for the Personal Email Management Assistant
+SimHash fingerprints of shingled email text, banded in SQLite for fast lookup
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# Values that differ between copies of one template: links, addresses, numbers
+_VARIABLE = re.compile(r'https?://\S+|www\.\S+|[\w.+-]+@[\w-]+(?:\.[\w-]+)+|\d+(?:[.,:/-]\d+)*')
+# CJK characters count as words of their own, everything else splits on non-word characters
+_TOKENS = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|\w+')
+
+BITS = 64
+BANDS = 4
+BAND_BITS = BITS // BANDS
+_BAND_MASK = (1 << BAND_BITS) - 1
+
+def simhash(text: str, shingle_size: int = 3, min_shingles: int = 8) -> Optional[int]:
+    """
+    Compute the 64-bit SimHash of a text from its word shingles
+    
+    Links, email addresses and numbers are replaced by placeholders first, so copies
+    of a template that differ only in those get (nearly) the same fingerprint.
+    
+    Returns:
+        The fingerprint, or None when the text is too short to compare reliably
+    """
+    tokens = _TOKENS.findall(_VARIABLE.sub(' 0 ', text.lower()))
+    shingles = Counter(' '.join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1))
+    if sum(shingles.values()) < min_shingles:
+        return None
+    
+    weights = [0] * BITS
+    for shingle, count in shingles.items():
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+    
+    return sum(1 << bit for bit in range(BITS) if weights[bit] > 0)
+
+def hamming_distance(a: int, b: int) -> int:
+    """Count the bits in which two fingerprints differ"""
+    return bin(a ^ b).count('1')
+
+def _bands(fingerprint: int) -> list:
+    return [fingerprint >> (band * BAND_BITS) & _BAND_MASK for band in range(BANDS)]
+
+def _signed(fingerprint: int) -> int:
+    """Fit an unsigned 64-bit fingerprint into an SQLite INTEGER"""
+    return fingerprint - (1 << BITS) if fingerprint >= 1 << (BITS - 1) else fingerprint
+
+class SimHashIndex:
+    """
+    Persistent index of analyzed emails by SimHash fingerprint
+    
+    Fingerprints are split into four 16-bit bands, each indexed in SQLite. Two
+    fingerprints within Hamming distance 3 share at least one band, so a lookup only
+    compares the candidates that match a band. Lookups are limited to one scope
+    (sender, model and prompt version) so unrelated senders never share analyses.
+    """
+    
+    def __init__(self, db_path: str = "analysis_cache.db", max_distance: int = 3,
+                 ttl: float = 7 * 24 * 3600, max_entries: int = 10000):
+        """
+        Args:
+            db_path: SQLite file holding the index
+            max_distance: Largest Hamming distance (of 64 bits) treated as a near-duplicate;
+                          up to 3 every match is found, beyond that only those sharing a band
+            ttl: Seconds an entry stays valid
+            max_entries: Entries kept before the least recently used are evicted
+        """
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialize_database()
+    
+    def _initialize_database(self):
+        """Create the index table"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS simhash_index (
+                        key TEXT PRIMARY KEY,
+                        scope TEXT,
+                        fingerprint INTEGER,
+                        band0 INTEGER,
+                        band1 INTEGER,
+                        band2 INTEGER,
+                        band3 INTEGER,
+                        analysis TEXT,
+                        created_at REAL,
+                        last_used REAL
+                    )
+                """)
+                for band in range(BANDS):
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_simhash_band{band} "
+                                   f"ON simhash_index (scope, band{band})")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_simhash_last_used ON simhash_index (last_used)")
+                
+                conn.commit()
+        
+        except Exception as e:
+            self.logger.error(f"Error initializing near-duplicate index: {str(e)}")
+            raise
+    
+    def find(self, scope: str, text: str) -> Optional[Tuple[str, int, Dict]]:
+        """
+        Find the closest indexed near-duplicate of a text
+        
+        Returns:
+            (key, distance, analysis) of the closest entry within max_distance, or None
+        """
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return None
+        
+        now = time.time()
+        best = None
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT key, fingerprint, analysis FROM simhash_index
+                    WHERE scope = ? AND created_at > ?
+                      AND (band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?)
+                """, (scope, now - self.ttl, *_bands(fingerprint)))
+                
+                for key, candidate, analysis in cursor.fetchall():
+                    distance = hamming_distance(fingerprint, candidate % (1 << BITS))
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (key, distance, analysis)
+                
+                if best:
+                    cursor.execute("UPDATE simhash_index SET last_used = ? WHERE key = ?", (now, best[0]))
+                    conn.commit()
+        
+        except Exception as e:
+            self.logger.error(f"Error searching near-duplicate index: {str(e)}")
+            best = None
+        
+        with self._lock:
+            if best:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return (best[0], best[1], json.loads(best[2])) if best else None
+    
+    def add(self, key: str, scope: str, text: str, analysis: Dict) -> bool:
+        """Index the analysis of a text, evicting expired and least recently used entries"""
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return False
+        
+        now = time.time()
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    INSERT OR REPLACE INTO simhash_index
+                    (key, scope, fingerprint, band0, band1, band2, band3, analysis, created_at, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (key, scope, _signed(fingerprint), *_bands(fingerprint), json.dumps(analysis), now, now))
+                
+                cursor.execute("DELETE FROM simhash_index WHERE created_at <= ?", (now - self.ttl,))
+                cursor.execute("""
+                    DELETE FROM simhash_index WHERE key IN (
+                        SELECT key FROM simhash_index ORDER BY last_used
+                        LIMIT MAX(0, (SELECT COUNT(*) FROM simhash_index) - ?)
+                    )
+                """, (self.max_entries,))
+                
+                conn.commit()
+                return True
+        
+        except Exception as e:
+            self.logger.error(f"Error adding to near-duplicate index: {str(e)}")
+            return False
+    
+    def get_stats(self) -> Dict:
+        """Get hit and miss counters since start"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -4,10 +4,19 @@ Integrates all modules and handles the main application flow
 """
 
 import logging
+import queue
 import time
-from typing import List, Dict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from pathlib import Path
+from typing import List, Dict, Optional
 from src.email_handler.processor import EmailProcessor
+from src.email_handler.connection_pool import IMAPConnectionPool
+from src.email_handler.idle import IdleWatcher
 from src.ai.analyzer import EmailAnalyzer
+from src.ai.cache import AnalysisCache
+from src.ai.similarity import SimHashIndex
+from src.ai.local_model import LocalClassifier
+from src.ai.rules import RuleEngine
 from src.database.db import EmailDatabase
 from src.config.manager import ConfigManager
 
@@ -18,8 +27,54 @@ class EmailAssistant:
         # Initialize components
         self.config_manager = ConfigManager(config_path)
         self.email_processor = EmailProcessor()
-        self.email_analyzer = EmailAnalyzer()
-        self.database = EmailDatabase()
+        self.database = EmailDatabase(
+            self.config_manager.get("database_path", "emails.db"),
+            busy_timeout=self.config_manager.get("database_busy_timeout", 5),
+            cache_size_mb=self.config_manager.get("database_cache_size_mb", 16),
+            mmap_size_mb=self.config_manager.get("database_mmap_size_mb", 256),
+            pool_size=self.config_manager.get("database_pool_size", 8)
+        )
+        
+        # Cache LLM analyses next to the email database
+        analysis_cache = None
+        if self.config_manager.get("analysis_cache_enabled", True):
+            analysis_cache = AnalysisCache(
+                str(Path(self.database.db_path).with_name("analysis_cache.db")),
+                ttl=self.config_manager.get("analysis_cache_ttl", 604800),
+                max_entries=self.config_manager.get("analysis_cache_max_entries", 10000)
+            )
+        similarity_index = None
+        if self.config_manager.get("near_duplicate_enabled", True):
+            similarity_index = SimHashIndex(
+                str(Path(self.database.db_path).with_name("analysis_cache.db")),
+                max_distance=self.config_manager.get("near_duplicate_max_distance", 3),
+                ttl=self.config_manager.get("analysis_cache_ttl", 604800),
+                max_entries=self.config_manager.get("analysis_cache_max_entries", 10000)
+            )
+        # Local first tier, trained on the emails the LLM analyzed so far
+        local_model = None
+        if self.config_manager.get("local_model_enabled", True):
+            local_model = LocalClassifier()
+            local_model.train(self.database.get_training_examples(
+                self.config_manager.get("local_model_training_emails", 5000)))
+        self.email_analyzer = EmailAnalyzer(
+            max_concurrent_requests=self.config_manager.get("llm_max_concurrent_requests", 4),
+            requests_per_minute=self.config_manager.get("llm_requests_per_minute", 60),
+            tokens_per_minute=self.config_manager.get("llm_tokens_per_minute", 100000),
+            request_timeout=self.config_manager.get("llm_request_timeout", 60),
+            max_retries=self.config_manager.get("llm_max_retries", 5),
+            cache=analysis_cache,
+            similarity_index=similarity_index,
+            local_model=local_model,
+            local_confidence_threshold=self.config_manager.get("local_model_threshold", 0.9),
+            local_min_examples=self.config_manager.get("local_model_min_examples", 50),
+            rules=RuleEngine.from_config(self.config_manager.get("analysis_rules")),
+            body_tokens=self.config_manager.get("analysis_body_tokens", 300),
+            response_format=self.config_manager.get("llm_response_format", "json_object"),
+            providers=self.config_manager.get("llm_providers"),
+            hedge_requests=self.config_manager.get("llm_hedge_requests", True),
+            latency_window=self.config_manager.get("llm_latency_window", 300)
+        )
         
         # Setup logging
         log_level = getattr(logging, self.config_manager.get("log_level", "INFO"))
@@ -27,12 +82,22 @@ class EmailAssistant:
             level=log_level,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
             handlers=[
-                logging.FileHandler("email_assistant.log"),
+                logging.FileHandler(self.config_manager.get("log_file", "email_assistant.log")),
                 logging.StreamHandler()
             ]
         )
         self.logger = logging.getLogger(__name__)
         
+        # Keep authenticated IMAP sessions alive between cycles
+        self.connection_pool = IMAPConnectionPool(
+            self.email_processor.connect_account,
+            timeout=self.config_manager.get("account_timeout", 120),
+            keepalive_interval=self.config_manager.get("imap_keepalive_interval", 240)
+        )
+        self.idle_watchers: Dict[str, IdleWatcher] = {}
+        # Workers still running after their account timed out, by account
+        self.hung_accounts: Dict[str, Future] = {}
+        
         # Load email accounts
         self._load_accounts()
     
@@ -44,7 +109,9 @@ class EmailAssistant:
                 account["email"],
                 account["password"],
                 account["imap_server"],
-                account["imap_port"]
+                account["imap_port"],
+                account.get("use_ssl", True),
+                account.get("folders", self.config_manager.get("folders", ["INBOX"]))
             )
             self.database.add_account(
                 account["email"],
@@ -65,65 +132,202 @@ class EmailAssistant:
         print(f"Summary: {analysis.get('summary', 'No summary')}")
         print("---")
     
-    def process_emails(self):
-        """Main email processing function"""
+    def process_emails(self, accounts: Optional[List[Dict]] = None):
+        """
+        Main email processing function
+        
+        Args:
+            accounts: Accounts to process, all configured accounts when None
+        """
         self.logger.info("Starting email processing cycle")
         
-        # Process each account
-        for account in self.email_processor.accounts:
-            self.logger.info(f"Processing account: {account['email']}")
+        accounts = list(self.email_processor.accounts if accounts is None else accounts)
+        
+        # Threads can't be killed, so an account whose worker from an earlier cycle
+        # is still stuck is skipped until that worker finishes
+        for email, future in list(self.hung_accounts.items()):
+            if future.done():
+                del self.hung_accounts[email]
+                self.logger.info(f"Abandoned worker of account {email} finished")
+        skipped = [account for account in accounts if account['email'] in self.hung_accounts]
+        for account in skipped:
+            self.logger.warning(f"Skipping account {account['email']}, its previous check is still running")
+        accounts = [account for account in accounts if account['email'] not in self.hung_accounts]
+        if not accounts:
+            return
+        
+        # Process accounts concurrently so one slow server doesn't hold up the rest
+        max_workers = max(1, min(self.config_manager.get("max_concurrent_accounts", 4), len(accounts)))
+        account_timeout = self.config_manager.get("account_timeout", 120)
+        
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="account")
+        futures = {executor.submit(self._process_account, account): account for account in accounts}
+        
+        try:
+            # Accounts beyond max_workers queue behind the first batch, so scale the deadline
+            rounds = -(-len(accounts) // max_workers)
+            for future in as_completed(futures, timeout=account_timeout * rounds):
+                account = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error(f"Error processing account {account['email']}: {str(e)}")
+        except FuturesTimeoutError:
+            for future, account in futures.items():
+                # Accounts still queued are cancelled; running ones are left to their socket timeouts
+                if not future.cancel() and not future.done():
+                    self.hung_accounts[account['email']] = future
+                    self.logger.error(f"Timed out processing account {account['email']} after {account_timeout} "
+                                      f"seconds, abandoning its worker")
+        finally:
+            # Don't block the cycle on stuck workers
+            executor.shutdown(wait=False)
+        
+        self.logger.info(f"Finished email processing cycle, connection pool: {self.connection_pool.get_stats()}")
+        if self.email_analyzer.cache:
+            self.logger.info(f"Analysis cache: {self.email_analyzer.cache.get_stats()}")
+        if self.email_analyzer.similarity_index:
+            self.logger.info(f"Near-duplicate index: {self.email_analyzer.similarity_index.get_stats()}")
+    
+    def _process_account(self, account: Dict):
+        """Fetch, analyze and store new emails for every monitored folder of a single account"""
+        self.logger.info(f"Processing account: {account['email']}")
+        
+        # Get a pooled session for the account
+        mail = self.connection_pool.acquire(account)
+        if not mail:
+            self.logger.error(f"Failed to connect to {account['email']}")
+            return
+        
+        try:
+            for folder in account.get('folders') or ['INBOX']:
+                self._process_folder(account, mail, folder)
             
-            # Connect to the account
-            mail = self.email_processor.connect_account(account)
-            if not mail:
-                self.logger.error(f"Failed to connect to {account['email']}")
-                continue
+            # Update last checked time
+            self.database.update_account_last_checked(account['email'])
+        except Exception:
+            # The session may be mid-command, so don't hand it out again
+            self.connection_pool.discard(mail)
+            raise
+        
+        self.connection_pool.release(account, mail)
+    
+    def _process_folder(self, account: Dict, mail, folder: str):
+        """Apply changes made by other clients to one folder, then fetch, analyze and store its new emails"""
+        folder_state = self.email_processor.select_folder(mail, folder)
+        if folder_state is None:
+            return
+        
+        uidvalidity = folder_state['uidvalidity']
+        highestmodseq = folder_state['highestmodseq']
+        sync_state = self.database.get_folder_state(account['email'], folder)
+        in_sync = bool(sync_state) and uidvalidity is not None and sync_state.get('uidvalidity') == uidvalidity
+        
+        # With CONDSTORE an unchanged HIGHESTMODSEQ means nothing arrived, changed or vanished
+        if in_sync and highestmodseq is not None and highestmodseq == sync_state.get('highestmodseq'):
+            self.logger.info(f"No changes in {account['email']}/{folder}")
+            return
+        
+        if in_sync:
+            self._sync_changes(account, mail, folder, uidvalidity, sync_state)
+        
+        # Fetch emails
+        max_emails = self.config_manager.get("max_emails_per_check", 10)
+        batch_size = self.config_manager.get("fetch_batch_size", 50)
+        failed_uids = []
+        emails = self.email_processor.fetch_emails(
+            mail, folder=folder, limit=max_emails, batch_size=batch_size, sync_state=sync_state,
+            fetch_mode=self.config_manager.get("fetch_mode", "partial"),
+            max_body_bytes=self.config_manager.get("max_body_bytes", 32768),
+            max_message_bytes=self.config_manager.get("max_message_bytes", 1048576),
+            folder_state=folder_state,
+            failed_uids=failed_uids
+        )
+        
+        # Flag changes are collected and applied in bulk after the loop
+        read_ids = []
+        spam_emails = {}
+        auto_delete_spam = self.config_manager.get("auto_delete_spam", False)
+        mark_as_read = self.config_manager.get("mark_as_read", True)
+        
+        for email_data in emails:
+            email_data['account'] = account['email']
+        
+        # Analyze the emails, several per LLM request
+        analyses = self.email_analyzer.analyze_batch(
+            emails,
+            max_batch_tokens=self.config_manager.get("analysis_batch_tokens", 6000),
+            max_batch_size=self.config_manager.get("analysis_batch_size", 20)
+        )
+        
+        # Save the whole check in one transaction
+        if emails and not self.database.save_emails(list(zip(emails, analyses))):
+            # Leave them unread and the folder state as it was, so the next check fetches them again
+            self.logger.error(f"Failed to save emails of {account['email']}/{folder}")
+            return
+        
+        # Process each email
+        for email_data, analysis in zip(emails, analyses):
+            # Mark as read
+            if mark_as_read:
+                read_ids.append(email_data['id'])
             
-            try:
-                # Fetch emails
-                max_emails = self.config_manager.get("max_emails_per_check", 10)
-                emails = self.email_processor.fetch_emails(mail, limit=max_emails)
-                
-                # Update last checked time
-                self.database.update_account_last_checked(account['email'])
-                
-                # Process each email
-                for email_data in emails:
-                    # Analyze the email
-                    analysis = self.email_analyzer.analyze_email(email_data)
-                    
-                    # Save to database
-                    self.database.save_email(email_data, analysis)
-                    
-                    # Mark as read
-                    self.email_processor.mark_as_read(mail, email_data['id'])
-                    
-                    # Handle auto-deletion of spam if enabled
-                    auto_delete_spam = self.config_manager.get("auto_delete_spam", False)
-                    if auto_delete_spam and analysis.get('category') == 'spam':
-                        self.email_processor.delete_email(mail, email_data['id'])
-                        self.logger.info(f"Deleted spam email from {email_data['from']}: {email_data['subject']}")
-                        continue  # Skip notification for deleted emails
-                    
-                    # Log important emails
-                    if analysis.get('importance', 0) >= self.config_manager.get("importance_threshold", 0.7):
-                        self.logger.info(f"Important email from {email_data['from']}: {email_data['subject']}")
-                        
-                        # Send notification for important emails
-                        self._send_notification(email_data, analysis)
-                
-                # Close connection
-                mail.close()
-                mail.logout()
+            # Handle auto-deletion of spam if enabled
+            if auto_delete_spam and analysis.get('category') == 'spam':
+                spam_emails[email_data['id']] = email_data
+                continue  # Skip notification for deleted emails
+            
+            # Log important emails
+            if analysis.get('importance', 0) >= self.config_manager.get("importance_threshold", 0.7):
+                self.logger.info(f"Important email from {email_data['from']}: {email_data['subject']}")
                 
-            except Exception as e:
-                self.logger.error(f"Error processing account {account['email']}: {str(e)}")
-                if mail:
-                    try:
-                        mail.close()
-                        mail.logout()
-                    except:
-                        pass
+                # Send notification for important emails
+                self._send_notification(email_data, analysis)
+        
+        if read_ids or spam_emails:
+            results = self.email_processor.apply_flag_changes(
+                mail, read_ids=read_ids, delete_ids=list(spam_emails),
+                trash_folder=self.config_manager.get("trash_folder")
+            )
+            for email_id, deleted in results['deleted'].items():
+                email_data = spam_emails[email_id]
+                if deleted:
+                    self.logger.info(f"Deleted spam email from {email_data['from']}: {email_data['subject']}")
+                else:
+                    self.logger.warning(f"Failed to delete spam email from {email_data['from']}: {email_data['subject']}")
+        
+        # Advance the high-water mark past the saved emails, but not past one that
+        # failed to download, so the next sync retries it
+        if uidvalidity is None:
+            return
+        last_uid = (sync_state.get('last_uid') or 0) if in_sync else 0
+        stored_uids = [email_data['uid'] for email_data in emails
+                       if not failed_uids or email_data['uid'] < min(failed_uids)]
+        last_uid = max([last_uid] + stored_uids)
+        
+        # When the limit was reached more new mail may be waiting, and after a failed
+        # download some must be fetched again, so the folder must not look unchanged
+        # at the next check
+        if len(emails) >= max_emails or failed_uids:
+            highestmodseq = sync_state.get('highestmodseq') if in_sync else None
+        if emails or highestmodseq is not None:
+            self.database.update_folder_state(account['email'], folder, uidvalidity, last_uid, highestmodseq)
+    
+    def _sync_changes(self, account: Dict, mail, folder: str, uidvalidity: int, sync_state: Dict):
+        """Mark stored emails as processed when another client read or removed them"""
+        known_uids = self.database.get_unprocessed_uids(account['email'], folder, uidvalidity)
+        if not known_uids:
+            return
+        
+        changes = self.email_processor.fetch_changes(mail, known_uids, sync_state)
+        uids = changes['removed']
+        # Emails we flag as read ourselves can't be told apart from ones read elsewhere
+        if not self.config_manager.get("mark_as_read", True):
+            uids = uids + changes['seen']
+        
+        if uids:
+            updated = self.database.mark_uids_processed(account['email'], folder, uidvalidity, uids)
+            self.logger.info(f"{updated} emails in {account['email']}/{folder} were read or removed elsewhere")
     
     def review_emails(self):
         """Review unprocessed emails in the database"""
@@ -151,37 +355,83 @@ class EmailAssistant:
             
             if action == "delete":
                 # Actually delete the email from the server
-                # Parse the sender's email to find the corresponding account
-                sender_email = email['from'].split('<')[-1].split('>')[0] if '<' in email['from'] else email['from']
-                account = None
-                for acc in self.email_processor.accounts:
-                    if acc['email'] == sender_email or sender_email.endswith(acc['email'].split('@')[-1]):
-                        account = acc
-                        break
-                
-                if account:
-                    mail = self.email_processor.connect_account(account)
-                    if mail:
-                        try:
-                            self.email_processor.delete_email(mail, email['id'])
-                            self.logger.info(f"Deleted email from {email['from']}: {email['subject']}")
-                            mail.close()
-                            mail.logout()
-                        except Exception as e:
-                            self.logger.error(f"Failed to delete email: {str(e)}")
-                    else:
-                        self.logger.error(f"Failed to connect to account {account['email']} for deletion")
+                if self._delete_on_server(email, email_account_map):
+                    self.database.mark_email_processed(email['db_id'], reviewed_action="delete")
+                    self._learn_review(email, "delete")
+                    print("Email deleted.")
                 else:
-                    self.logger.warning(f"Could not find account for email sender {sender_email}")
-                
-                self.database.mark_email_processed(email['db_id'])
-                print("Email deleted.")
+                    print("Email could not be deleted, it stays unreviewed.")
             elif action in ["read", "archive", "skip"]:
-                self.database.mark_email_processed(email['db_id'])
+                # The chosen action teaches the local model, skipping says nothing about the email
+                self.database.mark_email_processed(email['db_id'], reviewed_action=None if action == "skip" else action)
+                if action != "skip":
+                    self._learn_review(email, action)
                 print(f"Email marked as {action}.")
             else:
                 print("Invalid action, skipping...")
     
+    def _delete_on_server(self, email: Dict, accounts: Dict[str, Dict]) -> bool:
+        """
+        Delete a reviewed email by UID from the folder it came from
+        
+        Older rows hold the IMAP sequence number of an email instead of its UID, and a
+        UID only names the same message while the folder's UIDVALIDITY is unchanged, so
+        those emails are left alone rather than risk deleting another message.
+        
+        Returns:
+            Whether the email was deleted
+        """
+        account = accounts.get(email.get('account'))
+        if account is None or email.get('uid') is None:
+            self.logger.warning(f"Not deleting email from {email['from']}: it was stored without its account "
+                                f"and UID, delete it in your mail client")
+            return False
+        
+        mail = self.connection_pool.acquire(account)
+        if not mail:
+            self.logger.error(f"Failed to connect to account {account['email']} for deletion")
+            return False
+        
+        try:
+            folder = email.get('folder') or 'INBOX'
+            state = self.email_processor.select_folder(mail, folder)
+            # The stored key ends with the UIDVALIDITY and UID the email was fetched with
+            uidvalidity = str(email['id']).rsplit(':', 2)[-2]
+            deleted = False
+            if state is None:
+                # The pooled connection may still have another folder selected
+                self.logger.error(f"Not deleting email from {email['from']}: {folder} could not be selected")
+            elif str(state['uidvalidity']) != uidvalidity:
+                self.logger.warning(f"Not deleting email from {email['from']}: UIDVALIDITY of {folder} changed "
+                                    f"from {uidvalidity or 'unknown'} to {state['uidvalidity']}")
+            elif self.email_processor.delete_email(mail, str(email['uid']), self.config_manager.get("trash_folder")):
+                self.logger.info(f"Deleted email from {email['from']}: {email['subject']}")
+                deleted = True
+            else:
+                self.logger.error(f"Server refused to delete email from {email['from']}: {email['subject']}")
+            self.connection_pool.release(account, mail)
+            return deleted
+        except Exception as e:
+            self.logger.error(f"Failed to delete email: {str(e)}")
+            self.connection_pool.discard(mail)
+            return False
+    
+    def _learn_review(self, email: Dict, action: str):
+        """Teach the local model the action the user chose for a reviewed email right away"""
+        local_model = self.email_analyzer.local_model
+        if not local_model or not email.get('category'):
+            return
+        
+        if email.get('analysis_source') == 'llm':
+            # Learned with the recommended action when the LLM analyzed it
+            local_model.correct_action(email['category'], email.get('action'), action)
+            return
+        
+        stored = self.database.get_email(email['db_id'])
+        if stored:
+            local_model.learn(stored, {'importance': email.get('importance'), 'category': email['category'],
+                                       'action': action})
+    
     def run(self):
         """Run the email assistant"""
         self.logger.info("Email Assistant started")
@@ -190,15 +440,93 @@ class EmailAssistant:
         check_interval = self.config_manager.get("email_check_interval", 300)
         
         try:
-            while True:
-                # Process emails
-                self.process_emails()
-                
-                # Wait before next check
-                self.logger.info(f"Waiting {check_interval} seconds before next check")
-                time.sleep(check_interval)
-                
+            if self.config_manager.get("use_idle", True):
+                self._run_push(check_interval)
+            else:
+                while True:
+                    # Process emails
+                    self.process_emails()
+                    
+                    # Wait before next check, keeping pooled sessions alive meanwhile
+                    self.logger.info(f"Waiting {check_interval} seconds before next check")
+                    self._wait(check_interval)
+        
         except KeyboardInterrupt:
             self.logger.info("Email Assistant stopped by user")
         except Exception as e:
-            self.logger.error(f"Error in main loop: {str(e)}")
\ No newline at end of file
+            self.logger.error(f"Error in main loop: {str(e)}")
+        finally:
+            self.shutdown()
+    
+    def _run_push(self, check_interval: float):
+        """
+        Process accounts as soon as their IDLE session reports new mail
+        
+        Accounts whose server doesn't support IDLE, or whose IDLE session is
+        currently down, are still polled every check_interval seconds.
+        """
+        notifications = queue.Queue()
+        for account in self.email_processor.accounts:
+            watcher = IdleWatcher(
+                account,
+                self.email_processor.connect_account,
+                notifications.put,
+                refresh_interval=self.config_manager.get("idle_refresh_interval", 1740),
+                timeout=self.config_manager.get("account_timeout", 120)
+            )
+            watcher.start()
+            self.idle_watchers[account['email']] = watcher
+        
+        # Catch up on everything that arrived while we were not running
+        self.process_emails()
+        
+        keepalive_interval = self.config_manager.get("imap_keepalive_interval", 240)
+        next_poll = time.monotonic() + check_interval
+        while True:
+            try:
+                account = notifications.get(timeout=max(0, min(next_poll - time.monotonic(), keepalive_interval)))
+                
+                # Coalesce bursts of notifications into one cycle
+                pending = {account['email']: account}
+                while True:
+                    try:
+                        account = notifications.get_nowait()
+                    except queue.Empty:
+                        break
+                    pending[account['email']] = account
+                
+                self.logger.info(f"New mail pushed for {', '.join(pending)}")
+                self.process_emails(list(pending.values()))
+            except queue.Empty:
+                pass
+            
+            if time.monotonic() >= next_poll:
+                # IDLE only watches INBOX, so accounts with more folders are polled too
+                polled = [account for account in self.email_processor.accounts
+                          if not self.idle_watchers[account['email']].active
+                          or account.get('folders', ['INBOX']) != ['INBOX']]
+                if polled:
+                    self.process_emails(polled)
+                next_poll = time.monotonic() + check_interval
+            
+            self.connection_pool.keepalive()
+    
+    def _wait(self, seconds: float):
+        """Sleep between cycles, sending keepalives on pooled sessions"""
+        keepalive_interval = self.config_manager.get("imap_keepalive_interval", 240)
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, keepalive_interval))
+            self.connection_pool.keepalive()
+    
+    def shutdown(self):
+        """Stop IDLE sessions, log out of all pooled IMAP sessions, stop the LLM client and close the database"""
+        for watcher in self.idle_watchers.values():
+            watcher.stop()
+        self.idle_watchers = {}
+        self.connection_pool.close_all()
+        self.email_analyzer.close()
+        self.database.close()
\ No newline at end of file
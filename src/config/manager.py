@@ -63,8 +63,48 @@ class ConfigManager:
             "log_level": "INFO",
             "email_check_interval": 300,  # 5 minutes
             "max_emails_per_check": 10,
+            "fetch_batch_size": 50,  # Messages requested per IMAP FETCH round trip
+            "fetch_mode": "partial",  # "partial" downloads only the text part, "full" the whole message
+            "max_body_bytes": 32768,  # Byte cap on the downloaded text part in partial mode
+            "max_message_bytes": 1048576,  # Byte cap on whole messages downloaded and parsed
+            "analysis_batch_size": 20,  # Emails analyzed per LLM request
+            "analysis_batch_tokens": 6000,  # Estimated token budget of one batched LLM request
+            "analysis_body_tokens": 300,  # Token budget of an email's cleaned body in a prompt
+            "llm_max_concurrent_requests": 4,  # LLM requests in flight at once
+            "llm_requests_per_minute": 60,  # Request quota of the LLM provider, null for unlimited
+            "llm_tokens_per_minute": 100000,  # Token quota of the LLM provider, null for unlimited
+            "llm_request_timeout": 60,  # Seconds before a single LLM request is abandoned
+            "llm_max_retries": 5,  # Retries of rate-limited, timed out or failed LLM requests
+            "llm_response_format": "json_object",  # Structured output: json_schema, json_object or text
+            "llm_providers": None,  # OpenAI-compatible providers to route between, None for the environment's
+            "llm_hedge_requests": True,  # Also send requests running late to a second provider
+            "llm_latency_window": 300,  # Seconds of requests provider latency and error rates are measured over
+            "analysis_cache_enabled": True,  # Reuse LLM analyses of identical emails
+            "analysis_cache_ttl": 604800,  # Seconds a cached analysis stays valid (7 days)
+            "analysis_cache_max_entries": 10000,  # Cached analyses kept before the least recently used are evicted
+            "near_duplicate_enabled": True,  # Reuse LLM analyses of near-identical emails from the same sender
+            "near_duplicate_max_distance": 3,  # Largest SimHash distance (of 64 bits) treated as a near-duplicate
+            "local_model_enabled": True,  # Classify emails with a local model before asking the LLM
+            "local_model_threshold": 0.9,  # Confidence the local model needs to skip the LLM
+            "local_model_min_examples": 50,  # LLM-analyzed emails the local model learns from before it is used
+            "local_model_training_emails": 5000,  # Most recent analyzed emails the local model is trained on at startup
+            "analysis_rules": None,  # Keyword rules of the heuristic analysis, None for the built-in rules
+            "database_path": "emails.db",  # SQLite file of the emails; the analysis cache is stored next to it
+            "log_file": "email_assistant.log",  # Log written besides the console
+            "database_busy_timeout": 5,  # Seconds a database write waits for another writer
+            "database_cache_size_mb": 16,  # SQLite page cache of each pooled connection
+            "database_mmap_size_mb": 256,  # Part of the database file read through memory mapping, 0 to disable
+            "database_pool_size": 8,  # Idle database connections kept open and shared by all threads
             "importance_threshold": 0.7,  # Emails with importance >= this are considered important
             "auto_delete_spam": False,
+            "mark_as_read": True,  # Flag fetched emails as read on the server
+            "folders": ["INBOX"],  # Folders monitored for accounts that don't list their own
+            "trash_folder": None,  # Folder deleted emails are moved to, None deletes them permanently
+            "max_concurrent_accounts": 4,  # Accounts processed in parallel per cycle
+            "account_timeout": 120,  # Seconds before a single account's processing is abandoned
+            "imap_keepalive_interval": 240,  # Seconds between NOOPs on idle pooled IMAP sessions
+            "use_idle": True,  # Push new mail with IMAP IDLE where the server supports it
+            "idle_refresh_interval": 1740,  # Re-issue IDLE every 29 minutes
             "accounts": []
         }
     
@@ -0,0 +1,103 @@
+"""
+SQLite connection management for the Personal Email Management Assistant
+Keeps a small pool of tuned connections open instead of connecting for every query
+"""
+
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List
+
+class ConnectionManager:
+    """
+    Pool of long-lived SQLite connections in WAL mode, shared by all threads
+    
+    A query borrows an idle connection and hands it back when it is done, so neither
+    a new web request thread nor a new account worker pays for opening the file,
+    tuning it, reading the schema and warming the page cache again. At most
+    pool_size idle connections are kept; connections opened beyond that while many
+    threads query at once are closed when they are handed back. A connection is only
+    used by one thread at a time.
+    
+    In WAL mode readers see the last committed state while a writer appends to the
+    log, so the dashboard's reads never wait for the processing loop's writes (or
+    the other way round); writers wait up to busy_timeout for each other instead of
+    failing with "database is locked". With WAL, synchronous=NORMAL only syncs at
+    checkpoints, which keeps commits cheap without risking corruption.
+    
+    Usage:
+        connections = ConnectionManager("emails.db")
+        with connections.connection() as conn:  # commits, or rolls back on error
+            conn.execute(...)
+    """
+    
+    def __init__(self, db_path: str, busy_timeout: float = 5.0, cache_size_mb: int = 16,
+                 mmap_size_mb: int = 256, pool_size: int = 8):
+        """
+        Args:
+            db_path: SQLite file
+            busy_timeout: Seconds a write waits for another writer before failing
+            cache_size_mb: Page cache of each connection
+            mmap_size_mb: Part of the file read through memory mapping, 0 to disable
+            pool_size: Idle connections kept open for the next queries
+        """
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.cache_size_mb = cache_size_mb
+        self.mmap_size_mb = mmap_size_mb
+        self.pool_size = pool_size
+        self.logger = logging.getLogger(__name__)
+        self._idle: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for one transaction, which commits, or rolls back on error"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open()
+        
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._give_back(conn)
+    
+    def _give_back(self, conn: sqlite3.Connection):
+        """Return a borrowed connection to the pool, or close it when the pool is full"""
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+    
+    def _open(self) -> sqlite3.Connection:
+        """Open and tune a connection"""
+        # Borrowed by one thread at a time, but not always the one that opened it
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False)
+        journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if journal_mode.lower() != 'wal':
+            self.logger.warning(f"SQLite database {self.db_path} can't use WAL, using {journal_mode} journal")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size={-int(self.cache_size_mb * 1024)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size_mb * 1024 * 1024)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        return conn
+    
+    def open_connections(self) -> int:
+        """Get the number of idle connections kept in the pool"""
+        with self._lock:
+            return len(self._idle)
+    
+    def close(self):
+        """Close the idle connections; the next query opens a new one"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error as e:
+                self.logger.warning(f"Error closing SQLite connection: {str(e)}")
@@ -3,23 +3,88 @@ Database module for the Personal Email Management Assistant
 Handles data storage and retrieval using SQLite
 """
 
-import sqlite3
 import logging
-from typing import List, Dict, Optional
+import re
+import time
+import zlib
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 
+from src.database.connection import ConnectionManager
+
+def received_timestamp(date: Optional[str]) -> Optional[int]:
+    """Parse an email's Date header into a Unix timestamp, None if it can't be parsed"""
+    if not date:
+        return None
+    try:
+        parsed = parsedate_to_datetime(str(date))
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed.tzinfo is None:
+        # RFC 2822 "-0000": the sender's zone is unknown, take it as UTC
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+def compress_body(body: Optional[str]) -> Optional[bytes]:
+    """Compress an email body for storage"""
+    return None if body is None else zlib.compress(str(body).encode('utf-8'))
+
+def decompress_body(data: Optional[bytes]) -> Optional[str]:
+    """Restore a body stored by compress_body"""
+    return None if data is None else zlib.decompress(data).decode('utf-8')
+
+# Relevance of a match in each indexed column (sender, subject, summary, body) for bm25
+SEARCH_WEIGHTS = (2.0, 3.0, 2.0, 1.0)
+
+# Shortest last word of a query matched as a prefix; emails_fts indexes prefixes of this length
+SEARCH_PREFIX_LENGTH = 3
+
+_SEARCH_TERM = re.compile(r'\w+')
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Turn what a user typed into an FTS5 query matching emails containing every word
+    
+    Words are quoted, so operators and punctuation can't make the query invalid,
+    and the last one also matches as a prefix for search as you type, unless it is
+    too short to narrow the search down. Returns None if the text has no words.
+    """
+    terms = _SEARCH_TERM.findall(text or '')
+    if not terms:
+        return None
+    query = ' '.join(f'"{term}"' for term in terms)
+    return query + '*' if len(terms[-1]) >= SEARCH_PREFIX_LENGTH else query
+
+# Columns of the email list; bodies are loaded one at a time with get_email
+EMAIL_COLUMNS = """
+    id, email_id, sender, subject, date, importance, summary, category, action, account, folder, uid,
+    analysis_source, reused_from, prompt_tokens, completion_tokens, received_ts
+"""
+
 class EmailDatabase:
     """Handles database operations for email storage and retrieval"""
     
-    def __init__(self, db_path: str = "emails.db"):
+    def __init__(self, db_path: str = "emails.db", busy_timeout: float = 5.0, cache_size_mb: int = 16,
+                 mmap_size_mb: int = 256, pool_size: int = 8):
+        """
+        Args:
+            db_path: SQLite file
+            busy_timeout: Seconds a write waits for another writer before failing
+            cache_size_mb: Page cache of each pooled connection
+            mmap_size_mb: Part of the file read through memory mapping, 0 to disable
+            pool_size: Idle connections kept open and shared by all threads
+        """
         self.db_path = db_path
         self.logger = logging.getLogger(__name__)
+        self.connections = ConnectionManager(db_path, busy_timeout, cache_size_mb, mmap_size_mb, pool_size)
         self._initialize_database()
     
     def _initialize_database(self):
         """Initialize the database with required tables"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connections.connection() as conn:
                 cursor = conn.cursor()
                 
                 # Create emails table
@@ -29,14 +94,31 @@ class EmailDatabase:
                         email_id TEXT UNIQUE,
                         sender TEXT,
                         subject TEXT,
-                        body TEXT,
+                        body TEXT,  -- Unused, bodies are stored compressed in email_bodies
                         date TEXT,
                         importance REAL,
                         summary TEXT,
                         category TEXT,
                         action TEXT,
                         processed BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        account TEXT,
+                        folder TEXT,
+                        uid INTEGER,
+                        analysis_source TEXT,
+                        reused_from TEXT,
+                        reviewed_action TEXT,
+                        prompt_tokens INTEGER,
+                        completion_tokens INTEGER,
+                        received_ts INTEGER
+                    )
+                """)
+                
+                # Create compressed body table, kept apart so list queries scan narrow rows
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS email_bodies (
+                        id INTEGER PRIMARY KEY,
+                        body BLOB
                     )
                 """)
                 
@@ -50,115 +132,564 @@ class EmailDatabase:
                     )
                 """)
                 
-                conn.commit()
-                self.logger.info("Database initialized successfully")
+                # Create per-folder sync state table (UID high-water marks)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS account_folders (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        email_address TEXT,
+                        folder TEXT,
+                        uidvalidity INTEGER,
+                        last_uid INTEGER DEFAULT 0,
+                        highestmodseq INTEGER,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE (email_address, folder)
+                    )
+                """)
+                
+                self._migrate_database(cursor)
+                moved = self._move_bodies(cursor)
+                
+                # Create the full-text index. It is contentless, so bodies aren't stored a
+                # second time uncompressed; save_emails keeps it in sync
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'emails_fts'")
+                index_exists = cursor.fetchone() is not None
+                cursor.execute(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5 (
+                        sender, subject, summary, body,
+                        content = '',
+                        tokenize = 'unicode61 remove_diacritics 2',
+                        prefix = '{SEARCH_PREFIX_LENGTH}'
+                    )
+                """)
+                if not index_exists:
+                    self._index_stored_emails(cursor)
                 
+                # Indexes of the dashboard's queries: newest important emails overall,
+                # per account and per category, and the sync and training lookups
+                cursor.executescript("""
+                    CREATE INDEX IF NOT EXISTS idx_emails_processed_importance
+                        ON emails (processed, importance DESC, received_ts DESC);
+                    CREATE INDEX IF NOT EXISTS idx_emails_account
+                        ON emails (account, processed, importance DESC, received_ts DESC);
+                    CREATE INDEX IF NOT EXISTS idx_emails_category
+                        ON emails (category, processed, importance DESC, received_ts DESC);
+                    CREATE INDEX IF NOT EXISTS idx_emails_folder_uid
+                        ON emails (account, folder, processed, uid);
+                    CREATE INDEX IF NOT EXISTS idx_emails_analysis_source
+                        ON emails (analysis_source);
+                """)
+            
+            if moved:
+                # Give the space of the moved bodies back to the file system
+                with self.connections.connection() as conn:
+                    conn.execute("VACUUM")
+            self.logger.info("Database initialized successfully")
+        
         except Exception as e:
             self.logger.error(f"Error initializing database: {str(e)}")
             raise
     
+    def _migrate_database(self, cursor):
+        """Add columns introduced after a database file was first created"""
+        cursor.execute("PRAGMA table_info(emails)")
+        email_columns = {row[1] for row in cursor.fetchall()}
+        
+        for column, column_type in [('account', 'TEXT'), ('folder', 'TEXT'), ('uid', 'INTEGER'),
+                                    ('analysis_source', 'TEXT'), ('reused_from', 'TEXT'),
+                                    ('reviewed_action', 'TEXT'), ('prompt_tokens', 'INTEGER'),
+                                    ('completion_tokens', 'INTEGER'), ('received_ts', 'INTEGER')]:
+            if column not in email_columns:
+                cursor.execute(f"ALTER TABLE emails ADD COLUMN {column} {column_type}")
+                self.logger.info(f"Added column {column} to emails table")
+        
+        if 'received_ts' not in email_columns:
+            self._backfill_received_ts(cursor)
+        
+        cursor.execute("PRAGMA table_info(account_folders)")
+        folder_columns = {row[1] for row in cursor.fetchall()}
+        
+        if 'highestmodseq' not in folder_columns:
+            cursor.execute("ALTER TABLE account_folders ADD COLUMN highestmodseq INTEGER")
+            self.logger.info("Added column highestmodseq to account_folders table")
+    
+    def _move_bodies(self, cursor) -> int:
+        """Move bodies stored inline in emails by older versions into email_bodies, compressed"""
+        moved = 0
+        while True:
+            cursor.execute("SELECT id, body FROM emails WHERE body IS NOT NULL LIMIT 1000")
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany("INSERT OR REPLACE INTO email_bodies (id, body) VALUES (?, ?)",
+                               [(db_id, compress_body(body)) for db_id, body in rows])
+            cursor.executemany("UPDATE emails SET body = NULL WHERE id = ?", [(db_id,) for db_id, _ in rows])
+            moved += len(rows)
+        
+        if moved:
+            self.logger.info(f"Moved the bodies of {moved} emails to email_bodies")
+        return moved
+    
+    def _index_stored_emails(self, cursor):
+        """Add the emails stored before the full-text index existed to it"""
+        indexed = 0
+        last_id = 0
+        while True:
+            cursor.execute("""
+                SELECT emails.id, sender, subject, summary, email_bodies.body
+                FROM emails LEFT JOIN email_bodies ON email_bodies.id = emails.id
+                WHERE emails.id > ?
+                ORDER BY emails.id
+                LIMIT 1000
+            """, (last_id,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany("INSERT INTO emails_fts (rowid, sender, subject, summary, body) VALUES (?, ?, ?, ?, ?)",
+                               [row[:4] + (decompress_body(row[4]),) for row in rows])
+            last_id = rows[-1][0]
+            indexed += len(rows)
+        
+        if indexed:
+            self.logger.info(f"Added {indexed} emails to the full-text index")
+    
+    def _unindex(self, cursor, texts: Dict[str, Tuple]) -> set:
+        """
+        Remove stored emails from the full-text index before they are saved again
+        
+        Args:
+            texts: Indexed columns (sender, subject, summary, body) of the emails about to be saved, by key
+        
+        Returns:
+            Keys of the stored emails left in the index because their text doesn't change
+        """
+        unchanged = set()
+        keys = list(texts)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            cursor.execute(f"""
+                SELECT email_id, emails.id, sender, subject, summary, email_bodies.body
+                FROM emails LEFT JOIN email_bodies ON email_bodies.id = emails.id
+                WHERE email_id IN ({', '.join('?' * len(chunk))})
+            """, chunk)
+            
+            deleted = []
+            for key, db_id, sender, subject, summary, body in cursor.fetchall():
+                indexed = (sender, subject, summary, decompress_body(body))
+                if indexed == texts[key]:
+                    unchanged.add(key)
+                else:
+                    deleted.append((db_id,) + indexed)
+            
+            # A contentless index forgets a row given the values it indexed
+            cursor.executemany("""
+                INSERT INTO emails_fts (emails_fts, rowid, sender, subject, summary, body)
+                VALUES ('delete', ?, ?, ?, ?, ?)
+            """, deleted)
+        return unchanged
+    
+    def _row_ids(self, cursor, keys: List[str]) -> Dict[str, int]:
+        """Get the row ids of stored emails by key"""
+        ids = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            cursor.execute(f"SELECT email_id, id FROM emails WHERE email_id IN ({', '.join('?' * len(chunk))})", chunk)
+            ids.update(cursor.fetchall())
+        return ids
+    
+    def _backfill_received_ts(self, cursor):
+        """Fill received_ts of stored emails from their Date header, or from when they were stored"""
+        cursor.execute("SELECT id, date, CAST(strftime('%s', created_at) AS INTEGER) FROM emails")
+        rows = [(received_timestamp(date) or created, db_id) for db_id, date, created in cursor.fetchall()]
+        cursor.executemany("UPDATE emails SET received_ts = ? WHERE id = ?", rows)
+        self.logger.info(f"Filled received_ts of {len(rows)} emails")
+    
+    def _email_key(self, email_data: Dict) -> str:
+        """
+        Build the stored email_id for an email
+        
+        UIDs are only unique within one folder of one account and one UIDVALIDITY,
+        so the key combines all of them when they are known.
+        """
+        if email_data.get('account') and email_data.get('uid') is not None:
+            return "{}:{}:{}:{}".format(
+                email_data['account'],
+                email_data.get('folder', 'INBOX'),
+                email_data.get('uidvalidity', ''),
+                email_data['uid']
+            )
+        return email_data.get('id')
+    
     def save_email(self, email_data: Dict, analysis: Dict) -> bool:
         """Save an email and its analysis to the database"""
+        return self.save_emails([(email_data, analysis)]) == 1
+    
+    def save_emails(self, batch: List[Tuple[Dict, Dict]]) -> int:
+        """
+        Save emails and their analyses in one transaction
+        
+        An email that is already stored is updated in place, keeping its row id and
+        whether it was processed and how it was reviewed. The full-text index is
+        updated in the same transaction.
+        
+        Args:
+            batch: (email, analysis) pairs
+        
+        Returns:
+            Number of distinct emails saved (repeats of an email within the batch count
+            once), or 0 if the transaction failed
+        """
+        if not batch:
+            return 0
+        
+        # The last save of an email wins, as if the batch were saved one by one
+        latest = {}
+        for email_data, analysis in batch:
+            key = self._email_key(email_data)
+            latest[key if key is not None else object()] = (email_data, analysis)
+        unique = list(latest.values())
+        
+        now = int(time.time())
+        rows = [
+            (
+                self._email_key(email_data),
+                email_data.get('from'),
+                email_data.get('subject'),
+                email_data.get('date'),
+                analysis.get('importance'),
+                analysis.get('summary'),
+                analysis.get('category'),
+                analysis.get('action'),
+                email_data.get('account'),
+                email_data.get('folder'),
+                email_data.get('uid'),
+                analysis.get('source'),
+                analysis.get('reused_from'),
+                analysis.get('prompt_tokens'),
+                analysis.get('completion_tokens'),
+                received_timestamp(email_data.get('date')) or now
+            )
+            for email_data, analysis in unique
+        ]
+        bodies = [None if email_data.get('body') is None else str(email_data['body']) for email_data, _ in unique]
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connections.connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    INSERT OR REPLACE INTO emails 
-                    (email_id, sender, subject, body, date, importance, summary, category, action)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    email_data.get('id'),
-                    email_data.get('from'),
-                    email_data.get('subject'),
-                    email_data.get('body'),
-                    email_data.get('date'),
-                    analysis.get('importance'),
-                    analysis.get('summary'),
-                    analysis.get('category'),
-                    analysis.get('action')
-                ))
-                
-                conn.commit()
-                self.logger.info(f"Saved email {email_data.get('id')} to database")
-                return True
+                unchanged = self._unindex(cursor, {row[0]: (row[1], row[2], row[5], body)
+                                                   for row, body in zip(rows, bodies) if row[0] is not None})
+                
+                upsert = """
+                    INSERT INTO emails 
+                    (email_id, sender, subject, date, importance, summary, category, action,
+                     account, folder, uid, analysis_source, reused_from, prompt_tokens, completion_tokens,
+                     received_ts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (email_id) DO UPDATE SET
+                        sender = excluded.sender,
+                        subject = excluded.subject,
+                        date = excluded.date,
+                        importance = excluded.importance,
+                        summary = excluded.summary,
+                        category = excluded.category,
+                        action = excluded.action,
+                        account = excluded.account,
+                        folder = excluded.folder,
+                        uid = excluded.uid,
+                        analysis_source = excluded.analysis_source,
+                        reused_from = excluded.reused_from,
+                        prompt_tokens = excluded.prompt_tokens,
+                        completion_tokens = excluded.completion_tokens,
+                        received_ts = excluded.received_ts
+                """
+                cursor.executemany(upsert, [row for row in rows if row[0] is not None])
+                keyed = self._row_ids(cursor, [row[0] for row in rows if row[0] is not None])
+                ids = []
+                for row in rows:
+                    if row[0] is None:
+                        # An email without a key can only be found again by the row id it was given
+                        cursor.execute(upsert, row)
+                        ids.append(cursor.lastrowid)
+                    else:
+                        ids.append(keyed[row[0]])
+                
+                cursor.executemany("""
+                    INSERT INTO email_bodies (id, body) VALUES (?, ?)
+                    ON CONFLICT (id) DO UPDATE SET body = excluded.body
+                """, [(row_id, compress_body(body)) for row_id, body in zip(ids, bodies)])
+                
+                cursor.executemany("""
+                    INSERT INTO emails_fts (rowid, sender, subject, summary, body) VALUES (?, ?, ?, ?, ?)
+                """, [(row_id, row[1], row[2], row[5], body) for row_id, row, body in zip(ids, rows, bodies)
+                      if row[0] not in unchanged])
                 
+                self.logger.info(f"Saved {len(unique)} emails to database")
+                return len(unique)
+        
         except Exception as e:
-            self.logger.error(f"Error saving email to database: {str(e)}")
-            return False
+            self.logger.error(f"Error saving emails to database: {str(e)}")
+            return 0
     
-    def get_unprocessed_emails(self, limit: int = 10) -> List[Dict]:
-        """Get unprocessed emails from the database"""
-        return self._get_emails(limit, processed=False)
+    def get_unprocessed_emails(self, limit: int = 10, account: Optional[str] = None,
+                               category: Optional[str] = None) -> List[Dict]:
+        """Get unprocessed emails from the database, optionally of one account or category"""
+        return self._get_emails(limit, processed=False, account=account, category=category)
     
-    def get_processed_emails(self, limit: int = 10) -> List[Dict]:
-        """Get processed emails from the database"""
-        return self._get_emails(limit, processed=True)
+    def get_processed_emails(self, limit: int = 10, account: Optional[str] = None,
+                             category: Optional[str] = None) -> List[Dict]:
+        """Get processed emails from the database, optionally of one account or category"""
+        return self._get_emails(limit, processed=True, account=account, category=category)
     
-    def _get_emails(self, limit: int = 10, processed: bool = False) -> List[Dict]:
-        """Get emails from the database"""
+    def _get_emails(self, limit: int = 10, processed: bool = False, account: Optional[str] = None,
+                    category: Optional[str] = None) -> List[Dict]:
+        """Get the most important, then newest, emails from the database"""
+        conditions = ["processed = ?"]
+        params = [processed]
+        if account is not None:
+            conditions.append("account = ?")
+            params.append(account)
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connections.connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT id, email_id, sender, subject, body, date, importance, summary, category, action
+                cursor.execute(f"""
+                    SELECT {EMAIL_COLUMNS}
                     FROM emails 
-                    WHERE processed = ?
-                    ORDER BY importance DESC, date DESC
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY importance DESC, received_ts DESC
                     LIMIT ?
-                """, (processed, limit))
+                """, (*params, limit))
                 
-                rows = cursor.fetchall()
-                emails = []
-                
-                for row in rows:
-                    email = {
-                        'db_id': row[0],
-                        'id': row[1],
-                        'from': row[2],
-                        'subject': row[3],
-                        'body': row[4],
-                        'date': row[5],
-                        'importance': row[6],
-                        'summary': row[7],
-                        'category': row[8],
-                        'action': row[9]
-                    }
-                    emails.append(email)
+                emails = [self._row_to_email(row) for row in cursor.fetchall()]
                 
                 status = "processed" if processed else "unprocessed"
                 self.logger.info(f"Retrieved {len(emails)} {status} emails")
                 return emails
-                
+        
         except Exception as e:
             self.logger.error(f"Error retrieving emails: {str(e)}")
             return []
     
-    def mark_email_processed(self, db_id: int) -> bool:
-        """Mark an email as processed"""
+    def search_emails(self, query: str, limit: int = 20, account: Optional[str] = None,
+                      category: Optional[str] = None, since: Optional[int] = None, until: Optional[int] = None,
+                      min_importance: Optional[float] = None, max_importance: Optional[float] = None,
+                      processed: Optional[bool] = None) -> List[Dict]:
+        """
+        Find emails whose sender, subject, summary or body contain every word of a query
+        
+        A query without words only applies the filters, returning the most important,
+        then newest, emails that pass them.
+        
+        Args:
+            query: Words to look for; the last one also matches as a prefix (see fts_query)
+            limit: Maximum number of results
+            account, category: Only emails of this account or category
+            since, until: Only emails received in this range (Unix timestamps, until excluded)
+            min_importance, max_importance: Only emails in this importance range (inclusive)
+            processed: Only processed (True) or unprocessed (False) emails, None for both
+        
+        Returns:
+            Emails as in get_unprocessed_emails, best match first, each with its bm25
+            rank (lower is better, None without query words)
+        """
+        match = fts_query(query)
+        
+        conditions = []
+        params = []
+        for condition, value in [("account = ?", account), ("category = ?", category),
+                                 ("received_ts >= ?", since), ("received_ts < ?", until),
+                                 ("importance >= ?", min_importance), ("importance <= ?", max_importance),
+                                 ("processed = ?", processed)]:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        
+        try:
+            with self.connections.connection() as conn:
+                cursor = conn.cursor()
+                
+                where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+                if match is None:
+                    cursor.execute(f"""
+                        SELECT {EMAIL_COLUMNS}, NULL
+                        FROM emails
+                        {where}
+                        ORDER BY importance DESC, received_ts DESC
+                        LIMIT ?
+                    """, (*params, limit))
+                else:
+                    cursor.execute(f"""
+                        SELECT {EMAIL_COLUMNS}, rank
+                        FROM emails JOIN (
+                            SELECT rowid AS match_id, bm25(emails_fts, {', '.join(map(str, SEARCH_WEIGHTS))}) AS rank
+                            FROM emails_fts
+                            WHERE emails_fts MATCH ?
+                        ) ON match_id = emails.id
+                        {where}
+                        ORDER BY rank
+                        LIMIT ?
+                    """, (match, *params, limit))
+                
+                emails = []
+                for row in cursor.fetchall():
+                    email = self._row_to_email(row)
+                    email['rank'] = row[-1]
+                    emails.append(email)
+                
+                self.logger.info(f"Found {len(emails)} emails matching {query!r}")
+                return emails
+        
+        except Exception as e:
+            self.logger.error(f"Error searching emails: {str(e)}")
+            return []
+    
+    def get_email(self, db_id: int) -> Optional[Dict]:
+        """Get one email with its body, or None if there is no such email"""
+        try:
+            with self.connections.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(f"""
+                    SELECT {EMAIL_COLUMNS}, (SELECT body FROM email_bodies WHERE email_bodies.id = emails.id)
+                    FROM emails
+                    WHERE id = ?
+                """, (db_id,))
+                
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                
+                email = self._row_to_email(row)
+                email['body'] = decompress_body(row[-1])
+                return email
+        
+        except Exception as e:
+            self.logger.error(f"Error retrieving email {db_id}: {str(e)}")
+            return None
+    
+    def _row_to_email(self, row: Tuple) -> Dict:
+        """Build an email dictionary from a row starting with EMAIL_COLUMNS"""
+        return {
+            'db_id': row[0],
+            'id': row[1],
+            'from': row[2],
+            'subject': row[3],
+            'date': row[4],
+            'importance': row[5],
+            'summary': row[6],
+            'category': row[7],
+            'action': row[8],
+            'account': row[9],
+            'folder': row[10],
+            'uid': row[11],
+            'analysis_source': row[12],
+            'reused_from': row[13],
+            'prompt_tokens': row[14],
+            'completion_tokens': row[15],
+            'received_ts': row[16]
+        }
+    
+    def mark_email_processed(self, db_id: int, reviewed_action: Optional[str] = None) -> bool:
+        """Mark an email as processed, recording the action the user chose when reviewing it"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connections.connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
                     UPDATE emails 
-                    SET processed = TRUE
+                    SET processed = TRUE, reviewed_action = COALESCE(?, reviewed_action)
                     WHERE id = ?
-                """, (db_id,))
+                """, (reviewed_action, db_id))
                 
-                conn.commit()
                 self.logger.info(f"Marked email {db_id} as processed")
                 return True
-                
+        
         except Exception as e:
             self.logger.error(f"Error marking email as processed: {str(e)}")
             return False
     
+    def get_training_examples(self, limit: int = 5000) -> List[Tuple[Dict, Dict]]:
+        """
+        Get the most recent emails analyzed by the LLM or reviewed by the user as (email, analysis) pairs
+        
+        The action the user chose when reviewing an email replaces the recommended one.
+        """
+        try:
+            with self.connections.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT sender, subject, email_bodies.body, importance, category,
+                           COALESCE(reviewed_action, action)
+                    FROM emails LEFT JOIN email_bodies ON email_bodies.id = emails.id
+                    WHERE analysis_source = 'llm' OR reviewed_action IS NOT NULL
+                    ORDER BY emails.id DESC
+                    LIMIT ?
+                """, (limit,))
+                
+                return [
+                    ({'from': row[0], 'subject': row[1], 'body': decompress_body(row[2])},
+                     {'importance': row[3], 'category': row[4], 'action': row[5]})
+                    for row in cursor.fetchall()
+                ]
+        
+        except Exception as e:
+            self.logger.error(f"Error retrieving training examples: {str(e)}")
+            return []
+    
+    def get_unprocessed_uids(self, email_address: str, folder: str, uidvalidity: int) -> List[int]:
+        """Get the UIDs of the unprocessed emails stored for an account folder"""
+        prefix = self._email_key({'account': email_address, 'folder': folder,
+                                  'uidvalidity': uidvalidity, 'uid': ''})
+        try:
+            with self.connections.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT uid
+                    FROM emails
+                    WHERE account = ? AND folder = ? AND processed = FALSE AND uid IS NOT NULL
+                      AND substr(email_id, 1, ?) = ?
+                """, (email_address, folder, len(prefix), prefix))
+                
+                return [row[0] for row in cursor.fetchall()]
+        
+        except Exception as e:
+            self.logger.error(f"Error retrieving unprocessed UIDs: {str(e)}")
+            return []
+    
+    def mark_uids_processed(self, email_address: str, folder: str, uidvalidity: int, uids: List[int]) -> int:
+        """Mark the emails stored for some UIDs of an account folder as processed, returning how many changed"""
+        keys = [(self._email_key({'account': email_address, 'folder': folder,
+                                  'uidvalidity': uidvalidity, 'uid': uid}),) for uid in uids]
+        if not keys:
+            return 0
+        
+        try:
+            with self.connections.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.executemany("""
+                    UPDATE emails 
+                    SET processed = TRUE
+                    WHERE email_id = ? AND processed = FALSE
+                """, keys)
+                
+                self.logger.info(f"Marked {cursor.rowcount} emails in {email_address}/{folder} as processed")
+                return cursor.rowcount
+        
+        except Exception as e:
+            self.logger.error(f"Error marking emails as processed: {str(e)}")
+            return 0
+    
     def add_account(self, email_address: str, imap_server: str) -> bool:
         """Add an email account to track"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connections.connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -167,10 +698,9 @@ class EmailDatabase:
                     VALUES (?, ?)
                 """, (email_address, imap_server))
                 
-                conn.commit()
                 self.logger.info(f"Added account {email_address} to database")
                 return True
-                
+        
         except Exception as e:
             self.logger.error(f"Error adding account to database: {str(e)}")
             return False
@@ -178,7 +708,7 @@ class EmailDatabase:
     def update_account_last_checked(self, email_address: str) -> bool:
         """Update the last checked timestamp for an account"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connections.connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -187,10 +717,9 @@ class EmailDatabase:
                     WHERE email_address = ?
                 """, (email_address,))
                 
-                conn.commit()
                 self.logger.info(f"Updated last checked time for account {email_address}")
                 return True
-                
+        
         except Exception as e:
             self.logger.error(f"Error updating account last checked time: {str(e)}")
             return False
@@ -198,7 +727,7 @@ class EmailDatabase:
     def get_accounts(self) -> List[Dict]:
         """Get all email accounts"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connections.connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -220,7 +749,61 @@ class EmailDatabase:
                 
                 self.logger.info(f"Retrieved {len(accounts)} accounts")
                 return accounts
-                
+        
         except Exception as e:
             self.logger.error(f"Error retrieving accounts: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+    
+    def get_folder_state(self, email_address: str, folder: str = 'INBOX') -> Optional[Dict]:
+        """Get the UIDVALIDITY, last seen UID and HIGHESTMODSEQ recorded for an account folder"""
+        try:
+            with self.connections.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT uidvalidity, last_uid, highestmodseq
+                    FROM account_folders
+                    WHERE email_address = ? AND folder = ?
+                """, (email_address, folder))
+                
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                
+                return {
+                    'uidvalidity': row[0],
+                    'last_uid': row[1],
+                    'highestmodseq': row[2]
+                }
+        
+        except Exception as e:
+            self.logger.error(f"Error retrieving folder state: {str(e)}")
+            return None
+    
+    def update_folder_state(self, email_address: str, folder: str, uidvalidity: int, last_uid: int,
+                            highestmodseq: Optional[int] = None) -> bool:
+        """Record the UIDVALIDITY, last seen UID and HIGHESTMODSEQ (CONDSTORE) for an account folder"""
+        try:
+            with self.connections.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    INSERT INTO account_folders (email_address, folder, uidvalidity, last_uid, highestmodseq)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (email_address, folder) DO UPDATE SET
+                        uidvalidity = excluded.uidvalidity,
+                        last_uid = excluded.last_uid,
+                        highestmodseq = excluded.highestmodseq,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (email_address, folder, uidvalidity, last_uid, highestmodseq))
+                
+                self.logger.info(f"Updated sync state for {email_address}/{folder}: UID {last_uid}")
+                return True
+        
+        except Exception as e:
+            self.logger.error(f"Error updating folder state: {str(e)}")
+            return False
+    
+    def close(self):
+        """Close the pooled database connections"""
+        self.connections.close()
@@ -0,0 +1,129 @@
+"""
+IMAP connection pool for the Personal Email Management Assistant
+Keeps authenticated IMAP sessions alive across processing cycles
+"""
+
+import imaplib
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+class IMAPConnectionPool:
+    """Reuses authenticated IMAP sessions instead of logging in on every use"""
+    
+    def __init__(self, connect: Callable[..., Optional[imaplib.IMAP4]], timeout: Optional[float] = None,
+                 keepalive_interval: float = 240, max_idle_time: float = 1500):
+        """
+        Args:
+            connect: Function opening a new authenticated session for an account,
+                     called as connect(account, timeout=timeout)
+            timeout: Socket timeout passed to connect
+            keepalive_interval: Idle seconds after which a session is checked with NOOP
+                                before it is handed out again
+            max_idle_time: Idle seconds after which a session is dropped instead of reused;
+                           servers may log out idle clients after 30 minutes
+        """
+        self.logger = logging.getLogger(__name__)
+        self._connect = connect
+        self.timeout = timeout
+        self.keepalive_interval = keepalive_interval
+        self.max_idle_time = max_idle_time
+        
+        self._idle: Dict[str, List[Tuple[imaplib.IMAP4, float]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'reconnects': 0, 'keepalives': 0}
+    
+    def acquire(self, account: Dict) -> Optional[imaplib.IMAP4]:
+        """Get a live session for an account, reconnecting when the pooled one is dead"""
+        key = account['email']
+        
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key)
+                if not sessions:
+                    break
+                mail, last_used = sessions.pop()
+            
+            idle_time = time.monotonic() - last_used
+            if idle_time >= self.max_idle_time:
+                self.logger.info(f"Dropping session for {key} after {idle_time:.0f} seconds idle")
+                self._close(mail)
+                self._count('reconnects')
+                continue
+            
+            if idle_time >= self.keepalive_interval and not self._is_alive(mail):
+                self.logger.info(f"Pooled session for {key} is dead, reconnecting")
+                self._close(mail)
+                self._count('reconnects')
+                continue
+            
+            self._count('hits')
+            return mail
+        
+        self._count('misses')
+        return self._connect(account, timeout=self.timeout)
+    
+    def release(self, account: Dict, mail: imaplib.IMAP4):
+        """Return a healthy session to the pool for later reuse"""
+        with self._lock:
+            self._idle.setdefault(account['email'], []).append((mail, time.monotonic()))
+    
+    def discard(self, mail: Optional[imaplib.IMAP4]):
+        """Close a session that may be in a broken state instead of pooling it"""
+        if mail is not None:
+            self._close(mail)
+    
+    def keepalive(self):
+        """Send NOOP on sessions idle for keepalive_interval and drop the dead ones"""
+        now = time.monotonic()
+        with self._lock:
+            due = []
+            for key, sessions in self._idle.items():
+                for entry in list(sessions):
+                    if now - entry[1] >= self.keepalive_interval:
+                        sessions.remove(entry)
+                        due.append((key, entry[0]))
+        
+        for key, mail in due:
+            if self._is_alive(mail):
+                self._count('keepalives')
+                with self._lock:
+                    self._idle.setdefault(key, []).append((mail, time.monotonic()))
+            else:
+                self.logger.info(f"Pooled session for {key} died while idle")
+                self._close(mail)
+    
+    def close_all(self):
+        """Log out of every pooled session"""
+        with self._lock:
+            sessions = [mail for entries in self._idle.values() for mail, _ in entries]
+            self._idle = {}
+        
+        for mail in sessions:
+            self._close(mail)
+    
+    def get_stats(self) -> Dict:
+        """Get pool hit/miss counters and the number of idle sessions"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = sum(len(sessions) for sessions in self._idle.values())
+        return stats
+    
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+    
+    def _is_alive(self, mail: imaplib.IMAP4) -> bool:
+        """Check a session with NOOP"""
+        try:
+            status, _ = mail.noop()
+            return status == 'OK'
+        except Exception:
+            return False
+    
+    def _close(self, mail: imaplib.IMAP4):
+        try:
+            mail.logout()
+        except Exception:
+            pass
@@ -0,0 +1,197 @@
+"""
+FETCH response parser for the Personal Email Management Assistant
+Turns the raw data imaplib returns for multi-message FETCH commands into
+one dictionary per message
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Markers for parenthesised lists, kept distinct from literal payloads like b'('
+_OPEN = object()
+_CLOSE = object()
+
+_LITERAL_SUFFIX = re.compile(rb'\{\d+\}\s*$')
+
+def _tokenize_text(text: bytes) -> List[Any]:
+    """Split the non-literal part of a FETCH response into tokens"""
+    tokens = []
+    i = 0
+    length = len(text)
+    
+    while i < length:
+        char = text[i:i + 1]
+        
+        if char in (b' ', b'\r', b'\n'):
+            i += 1
+        elif char == b'(':
+            tokens.append(_OPEN)
+            i += 1
+        elif char == b')':
+            tokens.append(_CLOSE)
+            i += 1
+        elif char == b'"':
+            # Quoted string with backslash escapes
+            i += 1
+            value = bytearray()
+            while i < length and text[i:i + 1] != b'"':
+                if text[i:i + 1] == b'\\' and i + 1 < length:
+                    i += 1
+                value += text[i:i + 1]
+                i += 1
+            tokens.append(bytes(value).decode('utf-8', errors='replace'))
+            i += 1
+        else:
+            # Atom; section specs like BODY[HEADER.FIELDS (FROM)] may contain spaces and parens
+            start = i
+            depth = 0
+            while i < length:
+                char = text[i:i + 1]
+                if char == b'[':
+                    depth += 1
+                elif char == b']':
+                    depth -= 1
+                elif depth <= 0 and char in (b' ', b'(', b')', b'\r', b'\n'):
+                    break
+                i += 1
+            atom = text[start:i].decode('utf-8', errors='replace')
+            tokens.append(None if atom.upper() == 'NIL' else atom)
+    
+    return tokens
+
+def _tokenize(data: List) -> List[Any]:
+    """Tokenize imaplib FETCH data, where literals arrive as (prefix, payload) tuples"""
+    tokens = []
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            prefix, literal = item[0], item[1]
+            tokens.extend(_tokenize_text(_LITERAL_SUFFIX.sub(b'', prefix)))
+            tokens.append(literal)
+        else:
+            tokens.extend(_tokenize_text(item))
+    return tokens
+
+def _parse_value(tokens: List[Any], pos: int) -> Tuple[Any, int]:
+    """Parse one value (atom, string, literal or nested list) starting at pos"""
+    token = tokens[pos]
+    if token is _OPEN:
+        values = []
+        pos += 1
+        while pos < len(tokens) and tokens[pos] is not _CLOSE:
+            value, pos = _parse_value(tokens, pos)
+            values.append(value)
+        return values, pos + 1
+    if token is _CLOSE:
+        # Stray closing paren, treat as an empty value
+        return None, pos + 1
+    return token, pos + 1
+
+def parse_sexp(text: bytes) -> Any:
+    """Parse a single parenthesised IMAP expression such as a BODYSTRUCTURE"""
+    tokens = _tokenize_text(text)
+    if not tokens:
+        return None
+    value, _ = _parse_value(tokens, 0)
+    return value
+
+def parse_fetch_response(data: List) -> List[Dict[str, Any]]:
+    """
+    Parse the data returned by imaplib's fetch/uid('FETCH') calls
+    
+    Args:
+        data: Raw response data, a mix of bytes lines and (prefix, literal) tuples
+    
+    Returns:
+        List of dictionaries, one per message, mapping upper-cased item names
+        (e.g. 'UID', 'FLAGS', 'RFC822', 'BODY[]<0>') to their values; the message
+        sequence number is stored under 'SEQ'
+    """
+    tokens = _tokenize(data)
+    messages = []
+    pos = 0
+    
+    while pos < len(tokens):
+        seq = tokens[pos]
+        if not isinstance(seq, str) or pos + 1 >= len(tokens) or tokens[pos + 1] is not _OPEN:
+            pos += 1
+            continue
+        
+        values, pos = _parse_value(tokens, pos + 1)
+        message = {'SEQ': seq}
+        for i in range(0, len(values) - 1, 2):
+            name = values[i]
+            if isinstance(name, str):
+                message[name.upper()] = values[i + 1]
+        messages.append(message)
+    
+    return messages
+
+def get_section(message: Dict[str, Any], prefix: str) -> Optional[Any]:
+    """Get the first item whose name starts with prefix, e.g. 'BODY[HEADER' or 'BODY[1]'"""
+    prefix = prefix.upper()
+    for name, value in message.items():
+        if name.startswith(prefix):
+            return value
+    return None
+
+def _param(params: Any, name: str) -> Optional[str]:
+    """Look up a value in a BODYSTRUCTURE parameter list like ['CHARSET', 'utf-8']"""
+    if not isinstance(params, list):
+        return None
+    for i in range(0, len(params) - 1, 2):
+        if isinstance(params[i], str) and params[i].upper() == name.upper():
+            value = params[i + 1]
+            return value.decode('utf-8', errors='replace') if isinstance(value, bytes) else value
+    return None
+
+def _text_parts(structure: Any, section: str) -> List[Dict[str, Any]]:
+    """List the non-attachment text parts of a BODYSTRUCTURE in document order"""
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        # Multipart: child parts first, then the subtype and extension data
+        parts = []
+        for index, child in enumerate(structure, 1):
+            if not isinstance(child, list):
+                break
+            child_section = f"{section}.{index}" if section else str(index)
+            parts.extend(_text_parts(child, child_section))
+        return parts
+
+    body_type = structure[0] if isinstance(structure[0], str) else ''
+    subtype = structure[1] if len(structure) > 1 and isinstance(structure[1], str) else ''
+    if body_type.upper() != 'TEXT' or subtype.upper() not in ('PLAIN', 'HTML'):
+        return []
+
+    # Text parts carry body fields, line count, MD5 and then the disposition
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and disposition and isinstance(disposition[0], str) \
+            and disposition[0].upper() == 'ATTACHMENT':
+        return []
+
+    size = structure[6] if len(structure) > 6 else None
+    return [{
+        'section': section or '1',
+        'subtype': subtype.lower(),
+        'charset': _param(structure[2] if len(structure) > 2 else None, 'CHARSET'),
+        'encoding': (structure[5] or '7BIT').upper() if len(structure) > 5 and isinstance(structure[5], str) else '7BIT',
+        'size': int(size) if isinstance(size, str) and size.isdigit() else None
+    }]
+
+def find_text_part(bodystructure: Any) -> Optional[Dict[str, Any]]:
+    """
+    Pick the body section to download from a parsed BODYSTRUCTURE
+
+    Returns:
+        Dictionary with 'section' (e.g. '1.1'), 'subtype' ('plain' or 'html'),
+        'charset', 'encoding' and 'size' of the first text/plain part, falling back
+        to the first text/html part; None if the message has no text body
+    """
+    parts = _text_parts(bodystructure, '')
+    for part in parts:
+        if part['subtype'] == 'plain':
+            return part
+    return parts[0] if parts else None
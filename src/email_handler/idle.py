@@ -0,0 +1,181 @@
+"""
+IMAP IDLE support for the Personal Email Management Assistant
+Holds push sessions so new mail is noticed within seconds instead of on the next poll
+"""
+
+import imaplib
+import logging
+import re
+import select
+import ssl
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Untagged responses that mean a message was added to the selected folder
+_NEW_MAIL = re.compile(rb'^\* \d+ (EXISTS|RECENT)', re.IGNORECASE)
+
+def supports_idle(mail: imaplib.IMAP4) -> bool:
+    """Check whether the server advertises the IDLE extension"""
+    return 'IDLE' in mail.capabilities
+
+def _buffered(mail: imaplib.IMAP4) -> bool:
+    """Check without blocking whether a response can be read right away"""
+    sock = mail.socket()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        # imaplib reads through a buffered file, which may already hold lines that
+        # arrived with the previous response (and TLS decrypted bytes), neither of
+        # which select() sees
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+def _readable(mail: imaplib.IMAP4, timeout: float) -> bool:
+    """Wait until the session has data to read"""
+    if _buffered(mail):
+        return True
+    readable, _, _ = select.select([mail.socket()], [], [], timeout)
+    return bool(readable)
+
+def idle_wait(mail: imaplib.IMAP4, timeout: float, stop_event: Optional[threading.Event] = None) -> bool:
+    """
+    Run one IDLE command on the selected folder
+    
+    Args:
+        mail: Session with a folder selected
+        timeout: Seconds to stay in IDLE before returning
+        stop_event: Optional event that ends the IDLE early when set
+    
+    Returns:
+        True if the server reported new messages, False if the timeout expired
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    
+    response = mail.readline()
+    if not response.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"IDLE rejected: {response.decode(errors='replace').strip()}")
+    
+    new_mail = False
+    deadline = time.monotonic() + timeout
+    try:
+        while not new_mail:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (stop_event is not None and stop_event.is_set()):
+                break
+            
+            # Wake up regularly so a stop request is noticed quickly
+            if not _readable(mail, min(remaining, 1.0)):
+                continue
+            
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            if _NEW_MAIL.match(line):
+                new_mail = True
+    finally:
+        mail.send(b'DONE\r\n')
+    
+    # Drain everything up to the tagged completion of the IDLE command
+    while True:
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed while ending IDLE")
+        if line.startswith(tag + b' '):
+            if not line[len(tag):].upper().lstrip().startswith(b'OK'):
+                raise imaplib.IMAP4.error(f"IDLE failed: {line.decode(errors='replace').strip()}")
+            break
+        if _NEW_MAIL.match(line):
+            new_mail = True
+    
+    return new_mail
+
+class IdleWatcher:
+    """Keeps one IDLE session open for an account and reports when new mail arrives"""
+    
+    def __init__(self, account: Dict, connect: Callable[..., Optional[imaplib.IMAP4]],
+                 on_new_mail: Callable[[Dict], None], folder: str = 'INBOX',
+                 refresh_interval: float = 29 * 60, timeout: Optional[float] = None,
+                 retry_delay: float = 30):
+        """
+        Args:
+            account: Account dictionary as created by EmailProcessor.add_account
+            connect: Function opening a new authenticated session, called as connect(account, timeout=timeout)
+            on_new_mail: Called with the account from the watcher thread whenever new mail arrives
+            folder: Folder to watch
+            refresh_interval: Seconds after which IDLE is re-issued; servers may drop
+                              clients idling for 30 minutes
+            timeout: Socket timeout for the session
+            retry_delay: Seconds to wait before reconnecting after an error
+        """
+        self.logger = logging.getLogger(__name__)
+        self.account = account
+        self.folder = folder
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self._connect = connect
+        self._on_new_mail = on_new_mail
+        
+        # None until the server's capabilities are known
+        self.supported: Optional[bool] = None
+        self.active = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        """Start watching in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"idle-{self.account['email']}", daemon=True
+        )
+        self._thread.start()
+    
+    def stop(self):
+        """Stop watching; the current IDLE is ended within about a second"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+    
+    def _run(self):
+        connected_before = False
+        
+        while not self._stop.is_set():
+            mail = self._connect(self.account, timeout=self.timeout)
+            if not mail:
+                self._stop.wait(self.retry_delay)
+                continue
+            
+            try:
+                if not supports_idle(mail):
+                    self.logger.info(f"{self.account['email']} does not support IDLE, falling back to polling")
+                    self.supported = False
+                    return
+                self.supported = True
+                
+                mail.select(self.folder, readonly=True)
+                self.active = True
+                self.logger.info(f"IDLE session open for {self.account['email']}/{self.folder}")
+                
+                # Mail may have arrived while the previous session was down
+                if connected_before:
+                    self._on_new_mail(self.account)
+                connected_before = True
+                
+                while not self._stop.is_set():
+                    if idle_wait(mail, self.refresh_interval, self._stop):
+                        self._on_new_mail(self.account)
+            
+            except Exception as e:
+                self.logger.warning(f"IDLE session for {self.account['email']} failed: {str(e)}")
+                self._stop.wait(self.retry_delay)
+            finally:
+                self.active = False
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
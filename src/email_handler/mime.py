@@ -0,0 +1,151 @@
+"""
+MIME parsing for the Personal Email Management Assistant
+Incremental, size-bounded message parsing and body extraction
+"""
+
+import codecs
+import re
+from email.feedparser import BytesFeedParser
+from email.message import Message
+from email.policy import compat32
+from functools import partial
+from typing import Iterable, Optional, Union
+
+from src.utils.text import html_to_text
+
+try:
+    from charset_normalizer import from_bytes as detect_charset
+except ImportError:  # Optional dependency
+    detect_charset = None
+
+# Declared charsets that mail clients routinely use for their supersets
+_CHARSET_SUPERSETS = {
+    'iso-8859-1': 'cp1252',
+    'latin1': 'cp1252',
+    'us-ascii': 'cp1252',
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'ks_c_5601-1987': 'cp949',
+    'euc-kr': 'cp949',
+    'shift_jis': 'cp932',
+}
+
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+class _TrackingMessage(Message):
+    """Message part that reports when the feed parser completes a readable text part"""
+    
+    def __init__(self, policy=compat32, on_text_part=None):
+        super().__init__(policy=policy)
+        self._on_text_part = on_text_part
+    
+    def set_payload(self, payload, charset=None):
+        super().set_payload(payload, charset)
+        # The feed parser sets a leaf part's payload once the part has been read completely
+        if self._on_text_part is not None and self.get_content_type() == 'text/plain' \
+                and not _is_attachment(self):
+            self._on_text_part(self)
+
+def _is_attachment(part: Message) -> bool:
+    return 'attachment' in str(part.get('Content-Disposition', '')).lower()
+
+def parse_message(source: Union[bytes, Iterable[bytes]], max_bytes: Optional[int] = None,
+                  chunk_size: int = 65536, stop_at_text: bool = True) -> Message:
+    """
+    Parse a message incrementally with the feed parser
+    
+    Args:
+        source: Raw message bytes or an iterable of byte chunks
+        max_bytes: Stop feeding after this many bytes; the rest of the message is ignored
+        chunk_size: Size of the pieces raw bytes are fed in
+        stop_at_text: Stop feeding as soon as a text/plain part has been read completely
+    
+    Returns:
+        The parsed message, possibly truncated (check msg.defects for missing boundaries)
+    """
+    text_parts = []
+    factory = partial(_TrackingMessage, on_text_part=text_parts.append if stop_at_text else None)
+    parser = BytesFeedParser(_factory=factory, policy=compat32)
+    
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = memoryview(source)
+        source = (data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size))
+    
+    fed = 0
+    for chunk in source:
+        if max_bytes is not None and fed + len(chunk) > max_bytes:
+            chunk = chunk[:max(0, max_bytes - fed)]
+        parser.feed(bytes(chunk))
+        fed += len(chunk)
+        if text_parts or (max_bytes is not None and fed >= max_bytes):
+            break
+    
+    return parser.close()
+
+def decode_text(payload: bytes, declared_charset: Optional[str] = None, is_html: bool = False) -> str:
+    """
+    Decode a text payload, detecting the charset when the declared one is missing or wrong
+    
+    Tries, in order: a byte order mark, the declared charset (or its common superset),
+    a <meta> charset for HTML, strict UTF-8, charset-normalizer when installed, and
+    finally cp1252 with replacement characters.
+    """
+    for bom, encoding in _BOMS:
+        if payload.startswith(bom):
+            return payload.decode(encoding, errors='replace')
+    
+    candidates = []
+    if declared_charset:
+        charset = declared_charset.strip().strip('"').lower()
+        candidates.extend([_CHARSET_SUPERSETS.get(charset, charset), charset])
+    if is_html:
+        match = _META_CHARSET.search(payload[:4096])
+        if match:
+            candidates.append(match.group(1).decode('ascii', errors='ignore').lower())
+    candidates.append('utf-8')
+    
+    for charset in candidates:
+        try:
+            return payload.decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    
+    if detect_charset is not None:
+        best = detect_charset(payload).best()
+        if best is not None:
+            return str(best)
+    
+    return payload.decode('cp1252', errors='replace')
+
+def find_body_part(message: Message) -> Optional[Message]:
+    """Find the part holding the body: the first text/plain part, else the first text/html part"""
+    html_part = None
+    for part in message.walk():
+        if part.is_multipart() or _is_attachment(part):
+            continue
+        content_type = part.get_content_type()
+        if content_type == 'text/plain':
+            return part
+        if content_type == 'text/html' and html_part is None:
+            html_part = part
+    return html_part
+
+def extract_body(message: Message) -> str:
+    """Extract the body text of a message, decoding only the part that is used"""
+    part = find_body_part(message)
+    if part is None:
+        return ""
+    
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return ""
+    
+    is_html = part.get_content_type() == 'text/html'
+    text = decode_text(payload, part.get_content_charset(), is_html=is_html)
+    return html_to_text(text) if is_html else text
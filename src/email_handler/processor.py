@@ -4,9 +4,14 @@ Handles email account connections and email processing
 """
 
 import imaplib
-import email
-from typing import List, Dict, Optional
+import base64
+import binascii
+import quopri
+from typing import List, Dict, Optional, Set
 import logging
+from src.email_handler.fetch_parser import parse_fetch_response, get_section, find_text_part
+from src.email_handler.mime import parse_message, extract_body, decode_text
+from src.utils.text import html_to_text
 
 class EmailProcessor:
     """Handles email account connections and email processing"""
@@ -15,22 +20,40 @@ class EmailProcessor:
         self.accounts = []
         self.logger = logging.getLogger(__name__)
     
-    def add_account(self, email_address: str, password: str, imap_server: str, imap_port: int = 993):
-        """Add an email account to monitor"""
+    def add_account(self, email_address: str, password: str, imap_server: str, imap_port: int = 993,
+                    use_ssl: bool = True, folders: Optional[List[str]] = None):
+        """
+        Add an email account to monitor
+        
+        Args:
+            use_ssl: False for local plaintext servers such as bridges
+            folders: Folders to monitor, INBOX when not given
+        """
         account = {
             'email': email_address,
             'password': password,
             'imap_server': imap_server,
-            'imap_port': imap_port
+            'imap_port': imap_port,
+            'use_ssl': use_ssl,
+            'folders': list(folders or ['INBOX'])
         }
         self.accounts.append(account)
         self.logger.info(f"Added account: {email_address}")
     
-    def connect_account(self, account: Dict) -> Optional[imaplib.IMAP4_SSL]:
-        """Connect to an email account via IMAP"""
+    def connect_account(self, account: Dict, timeout: Optional[float] = None) -> Optional[imaplib.IMAP4_SSL]:
+        """Connect to an email account via IMAP
+        
+        Args:
+            account: Account dictionary as created by add_account
+            timeout: Socket timeout in seconds for the connection, None to block indefinitely
+        """
         try:
-            mail = imaplib.IMAP4_SSL(account['imap_server'], account['imap_port'])
+            if account.get('use_ssl', True):
+                mail = imaplib.IMAP4_SSL(account['imap_server'], account['imap_port'], timeout=timeout)
+            else:
+                mail = imaplib.IMAP4(account['imap_server'], account['imap_port'], timeout=timeout)
             mail.login(account['email'], account['password'])
+            self._enable_change_tracking(mail)
             self.logger.info(f"Connected to {account['email']}")
             return mail
         except imaplib.IMAP4.error as e:
@@ -40,42 +63,130 @@ class EmailProcessor:
             self.logger.error(f"Failed to connect to {account['email']}: {str(e)}")
             return None
     
+    def _enable_change_tracking(self, mail: imaplib.IMAP4_SSL):
+        """Enable QRESYNC, or else CONDSTORE, so selected folders report MODSEQ changes"""
+        # Many servers only advertise their extensions once the client is logged in
+        _, data = mail.response('CAPABILITY')
+        if data and data[-1]:
+            mail.capabilities = tuple(data[-1].decode('ascii', errors='ignore').upper().split())
+        
+        if 'ENABLE' not in mail.capabilities:
+            return
+        for extension in ('QRESYNC', 'CONDSTORE'):
+            if extension not in mail.capabilities:
+                continue
+            try:
+                status, _ = mail.enable(extension)
+                if status == 'OK':
+                    return
+            except imaplib.IMAP4.error as e:
+                self.logger.warning(f"Failed to enable {extension}: {str(e)}")
+    
+    def select_folder(self, mail: imaplib.IMAP4_SSL, folder: str = 'INBOX') -> Optional[Dict]:
+        """
+        Select a folder and report the state needed for incremental syncs
+        
+        Returns:
+            Dictionary with 'uidvalidity' and 'highestmodseq' (None when the server
+            doesn't support CONDSTORE), or None if the folder can't be selected
+        """
+        status, data = mail.select(self._quote_folder(folder))
+        if status != 'OK':
+            self.logger.error(f"Failed to select {folder}: {data}")
+            return None
+        
+        return {
+            'uidvalidity': self._get_uidvalidity(mail),
+            'highestmodseq': self._get_highestmodseq(mail)
+        }
+    
     def fetch_emails(self, mail: imaplib.IMAP4_SSL, folder: str = 'INBOX', 
-                     limit: int = 10) -> List[Dict]:
-        """Fetch emails from a folder"""
+                     limit: int = 10, batch_size: int = 50,
+                     sync_state: Optional[Dict] = None, fetch_mode: str = 'full',
+                     max_body_bytes: Optional[int] = None,
+                     max_message_bytes: Optional[int] = None,
+                     folder_state: Optional[Dict] = None,
+                     failed_uids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Fetch unread emails from a folder
+        
+        Messages are addressed by UID and requested in chunks of batch_size with a
+        single UID FETCH over a UID set, so each chunk costs one round trip.
+        
+        Args:
+            mail: Connected IMAP session
+            folder: Folder to fetch from
+            limit: Maximum number of emails to return
+            batch_size: Number of messages per FETCH command
+            sync_state: Previously stored {'uidvalidity', 'last_uid'} for this folder;
+                        when it is still valid only messages above last_uid are searched
+            fetch_mode: 'full' downloads whole messages; 'partial' reads BODYSTRUCTURE and
+                        headers first and then downloads only the text part
+            max_body_bytes: In partial mode, download at most this many bytes of the text part
+            max_message_bytes: When whole messages are downloaded, fetch and parse at most
+                               this many bytes of each
+            folder_state: State returned by select_folder when the folder is already
+                          selected; otherwise the folder is selected here
+            failed_uids: List the UIDs of messages that couldn't be fetched are added to
+        
+        Returns:
+            List of email dictionaries; 'id' is the message UID as a string and
+            'uid', 'uidvalidity' and 'folder' identify the message for the next sync
+        """
         try:
-            mail.select(folder)
-            status, messages = mail.search(None, 'UNSEEN')  # Only unread emails
+            if folder_state is None:
+                folder_state = self.select_folder(mail, folder)
+                if folder_state is None:
+                    return []
+            uidvalidity = folder_state['uidvalidity']
+            
+            incremental = bool(sync_state) and uidvalidity is not None \
+                and sync_state.get('uidvalidity') == uidvalidity
+            if sync_state and not incremental:
+                self.logger.warning(f"UIDVALIDITY of {folder} changed, resynchronizing from scratch")
+            
+            last_uid = (sync_state.get('last_uid') or 0) if incremental else 0
+            if incremental:
+                # Only unread messages that arrived since the last sync
+                status, messages = mail.uid('SEARCH', 'UID', f'{last_uid + 1}:*', 'UNSEEN')
+            else:
+                status, messages = mail.uid('SEARCH', None, 'UNSEEN')  # Only unread emails
             
             if status != 'OK':
                 self.logger.error(f"Failed to search emails in {folder}")
                 return []
             
-            email_ids = messages[0].split()
+            # "n:*" always matches the highest UID, even when it is below n
+            uids = sorted(int(uid) for uid in messages[0].split() if int(uid) > last_uid)
+            
+            # Take the oldest messages, so when more than limit are waiting the rest
+            # are fetched by the next syncs instead of being skipped
+            uids = uids[:limit] if limit > 0 else uids
+            batch_size = max(1, batch_size)
             emails = []
             
-            # Process emails (up to limit)
-            for email_id in email_ids[-limit:]:
-                status, msg_data = mail.fetch(email_id, '(RFC822)')
-                
-                if status != 'OK':
-                    self.logger.warning(f"Failed to fetch email {email_id}")
-                    continue
+            # Process emails (up to limit) in batches
+            for start in range(0, len(uids), batch_size):
+                chunk = uids[start:start + batch_size]
+                if fetch_mode == 'partial':
+                    fetched = self._fetch_partial(mail, chunk, max_body_bytes, max_message_bytes)
+                else:
+                    fetched = self._fetch_full(mail, chunk, max_message_bytes)
                 
-                # Parse email
-                raw_email = msg_data[0][1]
-                # Use the correct method to parse email
-                parsed_email = email.message_from_bytes(raw_email) if isinstance(raw_email, bytes) else email.message_from_string(raw_email.decode('utf-8'))
-                
-                email_dict = {
-                    'id': email_id.decode(),
-                    'subject': parsed_email.get('Subject', ''),
-                    'from': parsed_email.get('From', ''),
-                    'date': parsed_email.get('Date', ''),
-                    'body': self._get_email_body(parsed_email)
-                }
-                
-                emails.append(email_dict)
+                for uid in chunk:
+                    email_dict = fetched.get(uid)
+                    if email_dict is None:
+                        self.logger.warning(f"Failed to fetch email {uid}")
+                        if failed_uids is not None:
+                            failed_uids.append(uid)
+                        continue
+                    
+                    email_dict.update({
+                        'uid': uid,
+                        'uidvalidity': uidvalidity,
+                        'folder': folder
+                    })
+                    emails.append(email_dict)
             
             self.logger.info(f"Fetched {len(emails)} emails from {folder}")
             return emails
@@ -84,58 +195,364 @@ class EmailProcessor:
             self.logger.error(f"Error fetching emails: {str(e)}")
             return []
     
+    def _fetch_full(self, mail: imaplib.IMAP4_SSL, uids: List[int],
+                    max_message_bytes: Optional[int] = None) -> Dict[int, Dict]:
+        """
+        Download complete messages for a set of UIDs with one FETCH
+        
+        With max_message_bytes only the first bytes of each message are requested,
+        so a huge message never has to be held in memory in full.
+        """
+        uid_set = ','.join(str(uid) for uid in uids)
+        query = f'(UID BODY.PEEK[]<0.{max_message_bytes}>)' if max_message_bytes else '(RFC822)'
+        status, msg_data = mail.uid('FETCH', uid_set, query)
+        
+        if status != 'OK':
+            self.logger.warning(f"Failed to fetch emails {uids[0]}-{uids[-1]}")
+            return {}
+        
+        emails = {}
+        for item in parse_fetch_response(msg_data):
+            raw_email = item.get('RFC822')
+            if raw_email is None:
+                raw_email = get_section(item, 'BODY[]')
+            if item.get('UID') and isinstance(raw_email, bytes):
+                uid = int(item['UID'])
+                emails[uid] = self._parse_email(str(uid), raw_email, max_message_bytes)
+        return emails
+    
+    def _fetch_partial(self, mail: imaplib.IMAP4_SSL, uids: List[int],
+                       max_body_bytes: Optional[int] = None,
+                       max_message_bytes: Optional[int] = None) -> Dict[int, Dict]:
+        """
+        Download headers and only the text part of each message
+        
+        One FETCH gets BODYSTRUCTURE and the headers for the whole set, then one FETCH
+        per distinct text section gets the bodies, so attachments are never transferred.
+        Messages whose structure can't be used are downloaded in full.
+        """
+        uid_set = ','.join(str(uid) for uid in uids)
+        status, msg_data = mail.uid(
+            'FETCH', uid_set, '(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)])'
+        )
+        
+        if status != 'OK':
+            self.logger.warning(f"Failed to fetch structure of emails {uids[0]}-{uids[-1]}")
+            return {}
+        
+        emails = {}
+        text_parts = {}
+        for item in parse_fetch_response(msg_data):
+            if not item.get('UID'):
+                continue
+            uid = int(item['UID'])
+            headers = get_section(item, 'BODY[HEADER')
+            if not isinstance(headers, bytes):
+                continue
+            
+            parsed_headers = parse_message(headers, stop_at_text=False)
+            emails[uid] = {
+                'id': str(uid),
+                'subject': parsed_headers.get('Subject', ''),
+                'from': parsed_headers.get('From', ''),
+                'date': parsed_headers.get('Date', ''),
+                'body': ''
+            }
+            text_part = find_text_part(item.get('BODYSTRUCTURE'))
+            if text_part:
+                text_parts[uid] = text_part
+        
+        # Structure-less messages (no usable BODYSTRUCTURE) are downloaded whole
+        missing = [uid for uid in uids if uid not in emails]
+        if missing:
+            emails.update(self._fetch_full(mail, missing, max_message_bytes))
+        
+        # Request each distinct section once for all messages sharing it
+        sections = {}
+        for uid, text_part in text_parts.items():
+            sections.setdefault(text_part['section'], []).append(uid)
+        
+        for section, section_uids in sections.items():
+            partial = f"<0.{max_body_bytes}>" if max_body_bytes else ""
+            status, msg_data = mail.uid(
+                'FETCH', ','.join(str(uid) for uid in section_uids), f'(UID BODY.PEEK[{section}]{partial})'
+            )
+            if status != 'OK':
+                self.logger.warning(f"Failed to fetch section {section} of {len(section_uids)} emails")
+                continue
+            
+            for item in parse_fetch_response(msg_data):
+                payload = get_section(item, f'BODY[{section}]')
+                if not item.get('UID') or not isinstance(payload, bytes) or int(item['UID']) not in text_parts:
+                    continue
+                uid = int(item['UID'])
+                truncated = bool(max_body_bytes) and len(payload) >= max_body_bytes
+                emails[uid]['body'] = self._decode_section(payload, text_parts[uid], truncated)
+        
+        return emails
+    
+    def _decode_section(self, payload: bytes, text_part: Dict, truncated: bool = False) -> str:
+        """Undo the transfer encoding and charset of a downloaded body section"""
+        encoding = text_part.get('encoding', '7BIT')
+        try:
+            if encoding == 'BASE64':
+                data = b''.join(payload.split())
+                if truncated:
+                    # A byte-range cut can end mid-quantum
+                    data = data[:len(data) - len(data) % 4]
+                payload = base64.b64decode(data)
+            elif encoding == 'QUOTED-PRINTABLE':
+                payload = quopri.decodestring(payload)
+        except (binascii.Error, ValueError) as e:
+            self.logger.warning(f"Failed to decode {encoding} body: {str(e)}")
+        
+        is_html = text_part.get('subtype') == 'html'
+        text = decode_text(payload, text_part.get('charset'), is_html=is_html)
+        return html_to_text(text) if is_html else text
+    
+    def fetch_changes(self, mail: imaplib.IMAP4_SSL, known_uids: List[int],
+                      sync_state: Optional[Dict] = None) -> Dict[str, List[int]]:
+        """
+        Find which of the known messages were read or removed by other clients
+        
+        With QRESYNC a single UID FETCH ... (CHANGEDSINCE modseq VANISHED) returns only the
+        messages changed since sync_state['highestmodseq'] together with the UIDs expunged
+        meanwhile. Otherwise the flags of known_uids are fetched in one command and UIDs
+        missing from the response have been expunged.
+        
+        Args:
+            mail: Session with the folder selected
+            known_uids: UIDs to check, e.g. the emails of the folder still unprocessed locally
+            sync_state: State stored at the previous sync of this folder, with the same
+                        UIDVALIDITY as the selected folder
+        
+        Returns:
+            Dictionary with 'seen' (now flagged \\Seen) and 'removed' (expunged or flagged
+            \\Deleted) lists of UIDs from known_uids
+        """
+        changes = {'seen': [], 'removed': []}
+        if not known_uids:
+            return changes
+        
+        known = set(known_uids)
+        modseq = (sync_state or {}).get('highestmodseq')
+        flags = None
+        
+        if modseq and 'QRESYNC' in mail.capabilities:
+            mail.response('VANISHED')  # Drop expunges reported earlier in this session
+            flags = self._fetch_flags(mail, '1:*', f'(CHANGEDSINCE {modseq} VANISHED)')
+            if flags is not None:
+                _, vanished = mail.response('VANISHED')
+                removed = set()
+                for data in vanished or []:
+                    if data:
+                        text = data.decode('ascii', errors='ignore') if isinstance(data, bytes) else data
+                        removed |= self._expand_uid_set(text.replace('(EARLIER)', '').strip(), known)
+        
+        if flags is None:
+            flags = self._fetch_flags(mail, self._uid_set(known_uids))
+            if flags is None:
+                return changes
+            removed = known - set(flags)
+        
+        for uid, message_flags in flags.items():
+            if uid not in known:
+                continue
+            if '\\DELETED' in message_flags:
+                removed.add(uid)
+            elif '\\SEEN' in message_flags:
+                changes['seen'].append(uid)
+        
+        changes['removed'] = sorted(removed)
+        changes['seen'].sort()
+        return changes
+    
+    def _fetch_flags(self, mail: imaplib.IMAP4_SSL, uid_set: str,
+                     modifier: Optional[str] = None) -> Optional[Dict[int, Set[str]]]:
+        """Fetch the flags of a UID set in one command, mapping each UID to its upper-cased flags"""
+        args = [uid_set, '(UID FLAGS)'] + ([modifier] if modifier else [])
+        try:
+            status, data = mail.uid('FETCH', *args)
+        except imaplib.IMAP4.error as e:
+            self.logger.warning(f"Failed to fetch flags for {uid_set}: {str(e)}")
+            return None
+        
+        if status != 'OK':
+            self.logger.warning(f"Failed to fetch flags for {uid_set}: {data}")
+            return None
+        
+        flags = {}
+        for item in parse_fetch_response(data):
+            uid = item.get('UID')
+            if uid and uid.isdigit():
+                flags[int(uid)] = {flag.upper() for flag in item.get('FLAGS') or [] if isinstance(flag, str)}
+        return flags
+    
+    def _get_uidvalidity(self, mail: imaplib.IMAP4_SSL) -> Optional[int]:
+        """Get the UIDVALIDITY reported when the current folder was selected"""
+        _, data = mail.response('UIDVALIDITY')
+        try:
+            return int(data[-1]) if data and data[-1] else None
+        except (TypeError, ValueError):
+            return None
+    
+    def _get_highestmodseq(self, mail: imaplib.IMAP4_SSL) -> Optional[int]:
+        """Get the HIGHESTMODSEQ reported when the current folder was selected (CONDSTORE)"""
+        _, data = mail.response('HIGHESTMODSEQ')
+        try:
+            return int(data[-1]) if data and data[-1] else None
+        except (TypeError, ValueError):
+            return None
+    
+    def _quote_folder(self, folder: str) -> str:
+        """Quote a folder name for IMAP when it contains spaces or special characters"""
+        if folder.startswith('"') or not any(char in folder for char in ' (){%*"\\'):
+            return folder
+        return '"' + folder.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    
+    def _parse_email(self, email_id: str, raw_email: bytes, max_message_bytes: Optional[int] = None) -> Dict:
+        """Build the email dictionary for a raw RFC822 message"""
+        parsed_email = parse_message(raw_email, max_bytes=max_message_bytes)
+        
+        return {
+            'id': email_id,
+            'subject': parsed_email.get('Subject', ''),
+            'from': parsed_email.get('From', ''),
+            'date': parsed_email.get('Date', ''),
+            'body': self._get_email_body(parsed_email)
+        }
+    
     def _get_email_body(self, parsed_email) -> str:
         """Extract email body from parsed email"""
-        body = ""
+        return extract_body(parsed_email)
+    
+    def mark_as_read(self, mail: imaplib.IMAP4_SSL, email_id: str) -> bool:
+        """Mark an email as read (email_id is the message UID), returning whether the server did"""
+        return self.apply_flag_changes(mail, read_ids=[email_id])['read'][email_id]
+    
+    def delete_email(self, mail: imaplib.IMAP4_SSL, email_id: str, trash_folder: Optional[str] = None) -> bool:
+        """
+        Delete an email (moves to trash_folder when given); email_id is the message UID
         
-        if parsed_email.is_multipart():
-            for part in parsed_email.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-                
-                # Skip attachments
-                if "attachment" in content_disposition:
-                    continue
-                
-                # Extract text/plain or text/html
-                if content_type == "text/plain":
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        try:
-                            body = payload.decode('utf-8')
-                        except UnicodeDecodeError:
-                            body = payload.decode('latin1')
-                    break
-                elif content_type == "text/html":
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        try:
-                            body = payload.decode('utf-8')
-                        except UnicodeDecodeError:
-                            body = payload.decode('latin1')
-        else:
-            payload = parsed_email.get_payload(decode=True)
-            if payload:
-                try:
-                    body = payload.decode('utf-8')
-                except UnicodeDecodeError:
-                    body = payload.decode('latin1')
-        
-        return body
-    
-    def mark_as_read(self, mail: imaplib.IMAP4_SSL, email_id: str):
-        """Mark an email as read"""
+        Returns:
+            Whether the server deleted (or moved) the email
+        """
+        return self.apply_flag_changes(mail, delete_ids=[email_id], trash_folder=trash_folder)['deleted'][email_id]
+    
+    def apply_flag_changes(self, mail: imaplib.IMAP4_SSL, read_ids: Optional[List[str]] = None,
+                           delete_ids: Optional[List[str]] = None,
+                           trash_folder: Optional[str] = None) -> Dict[str, Dict[str, bool]]:
+        """
+        Apply the flag changes collected during a cycle in bulk
+        
+        All reads are sent as one UID STORE over the UID set. Deletions use one UID MOVE
+        to trash_folder when the server supports MOVE, and otherwise one UID STORE of
+        \\Deleted followed by a single UID EXPUNGE (plain EXPUNGE without UIDPLUS).
+        
+        Args:
+            mail: Session with the folder of the messages selected
+            read_ids: UIDs to mark as read
+            delete_ids: UIDs to delete
+            trash_folder: Folder deleted messages are moved to; None deletes them permanently
+        
+        Returns:
+            Dictionary with 'read' and 'deleted' entries mapping each UID to whether
+            the change was applied
+        """
+        results = {'read': {}, 'deleted': {}}
+        
+        if read_ids:
+            results['read'] = self._store_flags(mail, read_ids, '\\Seen')
+            succeeded = sum(results['read'].values())
+            self.logger.info(f"Marked {succeeded}/{len(read_ids)} emails as read")
+        
+        if delete_ids:
+            results['deleted'] = self._delete_messages(mail, delete_ids, trash_folder)
+            succeeded = sum(results['deleted'].values())
+            self.logger.info(f"Deleted {succeeded}/{len(delete_ids)} emails")
+        
+        return results
+    
+    def _store_flags(self, mail: imaplib.IMAP4_SSL, email_ids: List[str], flag: str) -> Dict[str, bool]:
+        """Add a flag to a set of UIDs with one UID STORE, reporting per-message success"""
         try:
-            mail.store(email_id, '+FLAGS', '\\Seen')
-            self.logger.info(f"Marked email {email_id} as read")
+            status, data = mail.uid('STORE', self._uid_set(email_ids), '+FLAGS', f'({flag})')
         except Exception as e:
-            self.logger.error(f"Failed to mark email {email_id} as read: {str(e)}")
+            self.logger.error(f"Failed to set {flag} on {len(email_ids)} emails: {str(e)}")
+            return {email_id: False for email_id in email_ids}
+        
+        if status != 'OK':
+            self.logger.error(f"Failed to set {flag} on {len(email_ids)} emails: {data}")
+            return {email_id: False for email_id in email_ids}
+        
+        # The server echoes the new flags of every message it changed
+        updated = {item['UID'] for item in parse_fetch_response(data) if item.get('UID')}
+        if not updated:
+            return {email_id: True for email_id in email_ids}
+        return {email_id: str(email_id) in updated for email_id in email_ids}
     
-    def delete_email(self, mail: imaplib.IMAP4_SSL, email_id: str):
-        """Delete an email (moves to trash)"""
+    def _delete_messages(self, mail: imaplib.IMAP4_SSL, email_ids: List[str],
+                         trash_folder: Optional[str] = None) -> Dict[str, bool]:
+        """Move a set of UIDs to the trash, or flag and expunge them, in as few commands as possible"""
+        uid_set = self._uid_set(email_ids)
+        capabilities = mail.capabilities
+        
         try:
-            mail.store(email_id, '+FLAGS', '\\Deleted')
-            mail.expunge()
-            self.logger.info(f"Deleted email {email_id}")
+            if trash_folder and 'MOVE' in capabilities:
+                status, data = mail.uid('MOVE', uid_set, trash_folder)
+                if status == 'OK':
+                    return {email_id: True for email_id in email_ids}
+                # Deleting in place would lose mail that was meant to go to the trash
+                self.logger.error(f"Failed to move emails to {trash_folder}: {data}")
+                return {email_id: False for email_id in email_ids}
+            elif trash_folder:
+                status, data = mail.uid('COPY', uid_set, trash_folder)
+                if status != 'OK':
+                    self.logger.error(f"Failed to copy emails to {trash_folder}: {data}")
+                    return {email_id: False for email_id in email_ids}
+            
+            results = self._store_flags(mail, email_ids, '\\Deleted')
+            flagged = [email_id for email_id, ok in results.items() if ok]
+            if not flagged:
+                return results
+            
+            # Expunge once for the whole set; UIDPLUS limits it to our messages
+            if 'UIDPLUS' in capabilities:
+                status, data = mail.uid('EXPUNGE', self._uid_set(flagged))
+            else:
+                status, data = mail.expunge()
+            
+            if status != 'OK':
+                self.logger.error(f"Failed to expunge deleted emails: {data}")
+                return {email_id: False for email_id in email_ids}
+            return results
+            
         except Exception as e:
-            self.logger.error(f"Failed to delete email {email_id}: {str(e)}")
\ No newline at end of file
+            self.logger.error(f"Failed to delete {len(email_ids)} emails: {str(e)}")
+            return {email_id: False for email_id in email_ids}
+    
+    def _uid_set(self, email_ids: List[str]) -> str:
+        """Compress UIDs into an IMAP sequence set such as 1:5,9"""
+        uids = sorted({int(email_id) for email_id in email_ids})
+        ranges = []
+        start = previous = uids[0]
+        for uid in uids[1:]:
+            if uid != previous + 1:
+                ranges.append(f"{start}:{previous}" if start != previous else str(start))
+                start = uid
+            previous = uid
+        ranges.append(f"{start}:{previous}" if start != previous else str(start))
+        return ','.join(ranges)
+    
+    def _expand_uid_set(self, uid_set: str, within: Set[int]) -> Set[int]:
+        """Return the UIDs of within that are covered by an IMAP UID set such as 1:5,9"""
+        found = set()
+        for part in uid_set.split(','):
+            low, _, high = part.strip().partition(':')
+            if not low.isdigit() or (high and not high.isdigit()):
+                continue
+            low, high = int(low), int(high or low)
+            if low > high:
+                low, high = high, low
+            found |= {uid for uid in within if low <= uid <= high}
+        return found
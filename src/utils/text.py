@@ -0,0 +1,68 @@
+"""
+Text helpers for the Personal Email Management Assistant
+Fast conversions used when preparing email content for analysis
+"""
+
+import html
+import re
+
+_DROP_BLOCKS = re.compile(r'<(script|style|head|title)\b[^>]*>.*?</\1\s*>|<!--.*?-->', re.IGNORECASE | re.DOTALL)
+_LINE_BREAKS = re.compile(r'<br\s*/?>|</?(p|div|tr|li|ul|ol|table|h[1-6]|blockquote|pre)\b[^>]*>', re.IGNORECASE)
+_TAGS = re.compile(r'<[^>]+>')
+_SPACES = re.compile(r'[ \t\r\f\v\u00a0]+')
+_BLANK_LINES = re.compile(r'\n\s*\n\s*\n+')
+
+def html_to_text(markup: str) -> str:
+    """
+    Convert HTML to readable plain text
+    
+    A handful of precompiled regular expressions rather than a full HTML parse;
+    good enough for email bodies and linear in the size of the input.
+    """
+    text = _DROP_BLOCKS.sub(' ', markup)
+    text = _LINE_BREAKS.sub('\n', text)
+    text = _TAGS.sub(' ', text)
+    text = html.unescape(text)
+    text = _SPACES.sub(' ', text)
+    text = '\n'.join(line.strip() for line in text.split('\n'))
+    text = _BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
+# Lines introducing quoted history in replies, in the formats of common mail clients
+_REPLY_HEADER = re.compile(
+    r'^(?:On\b.{0,300}\bwrote:'
+    r'|\u5728.{0,300}\u5199\u9053[:\uff1a]'
+    r'|-{2,}\s*(?:Original Message|\u539f\u59cb\u90ae\u4ef6)\s*-{2,}'
+    r'|(?:From|\u53d1\u4ef6\u4eba)[:\uff1a].*\n(?:.*\n)?(?:Sent|Date|\u53d1\u9001\u65f6\u95f4|\u65e5\u671f)[:\uff1a].*)\s*$',
+    re.MULTILINE | re.IGNORECASE
+)
+_SIGNATURE = re.compile(
+    r'^(?:--|__+)\s*$'
+    r'|^(?:Sent from my|Get Outlook for|\u53d1\u81ea\u6211\u7684).*$',
+    re.MULTILINE | re.IGNORECASE
+)
+_QUOTED_LINE = re.compile(r'^[ \t]*>.*(?:\n|$)', re.MULTILINE)
+_LINK_ONLY_LINE = re.compile(r'^[ \t]*(?:<?https?://\S+>?[ \t]*)+$', re.MULTILINE)
+
+def looks_like_html(text: str) -> bool:
+    """Check whether a text is HTML markup rather than plain text"""
+    return bool(re.search(r'<(?:html|body|div|p|br|table|span|a)\b[^>]*>', text[:2000], re.IGNORECASE))
+
+def strip_quoted_text(text: str) -> str:
+    """
+    Remove quoted reply history, signatures and link-only lines from a plain text body
+    
+    Everything after the first reply header ("On ... wrote:", "-----Original
+    Message-----", an Outlook "From:/Sent:" block) or signature delimiter is
+    dropped, as are lines quoted with ">". Forwarded messages are kept. If nothing
+    would be left, the text is returned unchanged.
+    """
+    stripped = text
+    for pattern in (_REPLY_HEADER, _SIGNATURE):
+        match = pattern.search(stripped)
+        if match and stripped[:match.start()].strip():
+            stripped = stripped[:match.start()]
+    stripped = _QUOTED_LINE.sub('', stripped)
+    stripped = _LINK_ONLY_LINE.sub('', stripped)
+    stripped = _BLANK_LINES.sub('\n\n', stripped).strip()
+    return stripped or text.strip()
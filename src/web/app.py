@@ -5,6 +5,7 @@ Provides a simple dashboard to view email analysis results
 
 import os
 import sys
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from flask import Flask, render_template, jsonify, request
 from src.database.db import EmailDatabase
@@ -26,8 +27,14 @@ app = Flask(__name__,
             static_folder=str(static_dir))
 
 # Initialize components
-database = EmailDatabase()
 config_manager = ConfigManager()
+database = EmailDatabase(
+    config_manager.get("database_path", "emails.db"),
+    busy_timeout=config_manager.get("database_busy_timeout", 5),
+    cache_size_mb=config_manager.get("database_cache_size_mb", 16),
+    mmap_size_mb=config_manager.get("database_mmap_size_mb", 256),
+    pool_size=config_manager.get("database_pool_size", 8)
+)
 
 @app.route('/')
 def index():
@@ -41,12 +48,14 @@ def get_emails():
         # Get parameters
         limit = int(request.args.get('limit', 20))
         processed = request.args.get('processed', 'false').lower() == 'true'
+        account = request.args.get('account') or None
+        category = request.args.get('category') or None
         
         # Get emails from database
         if processed:
-            emails = database.get_processed_emails(limit)
+            emails = database.get_processed_emails(limit, account=account, category=category)
         else:
-            emails = database.get_unprocessed_emails(limit)
+            emails = database.get_unprocessed_emails(limit, account=account, category=category)
         
         return jsonify({
             'success': True,
@@ -58,6 +67,78 @@ def get_emails():
             'error': str(e)
         }), 500
 
+@app.route('/api/emails/<int:db_id>')
+def get_email(db_id):
+    """API endpoint to get one email with its body"""
+    try:
+        email = database.get_email(db_id)
+        if email is None:
+            return jsonify({
+                'success': False,
+                'error': f"Email {db_id} not found"
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'email': email
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def _timestamp(value, end_of_day=False):
+    """
+    Parse an ISO date (YYYY-MM-DD) or date and time from a query parameter into a
+    Unix timestamp, in UTC unless it has an offset; with end_of_day a date means
+    the end of that day, so a date range includes its last day
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    if end_of_day and len(value) == 10:
+        moment += timedelta(days=1)
+    return int(moment.timestamp())
+
+@app.route('/api/search')
+def search_emails():
+    """API endpoint to search emails by sender, subject, summary and body"""
+    try:
+        query = request.args.get('q', '')
+        limit = int(request.args.get('limit', 20))
+        since = request.args.get('since')
+        until = request.args.get('until')
+        min_importance = request.args.get('min_importance')
+        max_importance = request.args.get('max_importance')
+        processed = request.args.get('processed')
+        filters = {
+            'account': request.args.get('account') or None,
+            'category': request.args.get('category') or None,
+            'since': _timestamp(since) if since else None,
+            'until': _timestamp(until, end_of_day=True) if until else None,
+            'min_importance': float(min_importance) if min_importance else None,
+            'max_importance': float(max_importance) if max_importance else None,
+            'processed': processed.lower() == 'true' if processed else None
+        }
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f"Invalid search parameter: {str(e)}"
+        }), 400
+    
+    try:
+        emails = database.search_emails(query, limit, **filters)
+        return jsonify({
+            'success': True,
+            'emails': emails
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/accounts')
 def get_accounts():
     """API endpoint to get email accounts"""
@@ -0,0 +1,568 @@
+"""
+In-process IMAP stand-in server for tests and benchmarks of the Personal Email Management Assistant
+Serves synthetic mailboxes over plaintext IMAP with configurable injected latency
+"""
+
+import re
+import socket
+import socketserver
+import threading
+import time
+from collections import Counter
+from email.header import Header
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.parser import BytesParser
+from email.policy import compat32
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+# (charset, greeting) pairs used to build messages in mixed charsets
+CHARSETS = [
+    ('utf-8', "Hello from the team"),
+    ('iso-8859-1', "Grüße aus Köln"),
+    ('gb2312', "你好，这是一封测试邮件"),
+    ('koi8-r', "Привет из Москвы"),
+    ('shift_jis', "こんにちは、テストです"),
+]
+
+FILLER = ("This paragraph is filler text for the stand-in mailbox. It repeats so that messages have "
+          "a realistic size without carrying any meaning.\n")
+
+@lru_cache(maxsize=4096)
+def make_message(index: int, attachment_every: int = 5, attachment_size: int = 200000,
+                 body_paragraphs: int = 8) -> bytes:
+    """
+    Build the raw bytes of synthetic message number index (deterministic)
+
+    Every third message is HTML+text alternative, every attachment_every-th message
+    carries a binary attachment of attachment_size bytes, and the charset cycles
+    through CHARSETS.
+    """
+    charset, greeting = CHARSETS[index % len(CHARSETS)]
+    text = f"{greeting} #{index}\n\n" + FILLER * body_paragraphs
+
+    body = MIMEText(text, 'plain', charset)
+    if index % 3 == 0:
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(body)
+        alternative.attach(MIMEText(f"<html><body><p>{greeting} #{index}</p></body></html>", 'html', charset))
+        body = alternative
+
+    if attachment_every and index % attachment_every == 0:
+        message = MIMEMultipart('mixed')
+        message.attach(body)
+        attachment = MIMEApplication(bytes(range(256)) * (attachment_size // 256), Name=f"report-{index}.pdf")
+        attachment['Content-Disposition'] = f'attachment; filename="report-{index}.pdf"'
+        message.attach(attachment)
+    else:
+        message = body
+
+    message['From'] = f"sender{index % 17}@example.com"
+    message['To'] = "user@example.com"
+    message['Subject'] = Header(f"{greeting} - message {index}", charset).encode()
+    message['Date'] = time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(1700000000 + index * 60))
+    message['Message-ID'] = f"<{index}@stand-in.example.com>"
+    return message.as_bytes()
+
+class StoredMessage:
+    """A message in a stand-in folder"""
+
+    def __init__(self, uid: int, raw: Optional[bytes] = None, index: Optional[int] = None,
+                 flags: Optional[set] = None, generator_options: Optional[Dict] = None):
+        self.uid = uid
+        self.flags = set(flags or ())
+        self.modseq = 0
+        self._raw = raw
+        self._index = index
+        self._generator_options = generator_options or {}
+
+    @property
+    def raw(self) -> bytes:
+        if self._raw is not None:
+            return self._raw
+        return make_message(self._index, **self._generator_options)
+
+    @property
+    def message(self):
+        return BytesParser(policy=compat32).parsebytes(self.raw)
+
+class Folder:
+    """A stand-in IMAP folder"""
+
+    def __init__(self, name: str, uidvalidity: int = 1):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.highestmodseq = 1
+        self.messages: List[StoredMessage] = []
+        # UID -> MODSEQ of its expunge, for VANISHED (EARLIER) responses
+        self.vanished: Dict[int, int] = {}
+
+    def append(self, raw: Optional[bytes] = None, index: Optional[int] = None, flags: Optional[set] = None,
+               generator_options: Optional[Dict] = None) -> StoredMessage:
+        message = StoredMessage(self.uidnext, raw=raw, index=index, flags=flags,
+                                generator_options=generator_options)
+        self.uidnext += 1
+        self.messages.append(message)
+        self.touch(message)
+        return message
+
+    def touch(self, message: StoredMessage):
+        """Give a message a new MODSEQ after it was added or its flags changed"""
+        self.highestmodseq += 1
+        message.modseq = self.highestmodseq
+
+    def remove(self, message: StoredMessage):
+        """Expunge a message, remembering when for QRESYNC clients"""
+        self.messages.remove(message)
+        self.highestmodseq += 1
+        self.vanished[message.uid] = self.highestmodseq
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _params(part, names) -> str:
+    params = []
+    for name in names:
+        value = part.get_param(name)
+        if value:
+            params.extend([_quote(name.upper()), _quote(str(value))])
+    return '(' + ' '.join(params) + ')' if params else 'NIL'
+
+def bodystructure(part) -> str:
+    """Build the BODYSTRUCTURE of a parsed message"""
+    if part.is_multipart():
+        children = ''.join(bodystructure(child) for child in part.get_payload())
+        return f'({children} {_quote(part.get_content_subtype().upper())})'
+
+    payload = part.get_payload()
+    if isinstance(payload, str):
+        payload = payload.encode('ascii', errors='replace')
+    encoding = str(part.get('Content-Transfer-Encoding', '7BIT')).upper()
+    params = _params(part, ['charset', 'name'])
+    fields = (f'{_quote(part.get_content_maintype().upper())} {_quote(part.get_content_subtype().upper())} '
+              f'{params} NIL NIL {_quote(encoding)} {len(payload)}')
+
+    disposition = 'NIL'
+    if part.get('Content-Disposition'):
+        filename = part.get_filename()
+        disposition_params = f'({_quote("FILENAME")} {_quote(filename)})' if filename else 'NIL'
+        disposition = f'({_quote(part.get_content_disposition().upper())} {disposition_params})'
+
+    if part.get_content_maintype() == 'text':
+        lines = payload.count(b'\n') + 1
+        return f'({fields} {lines} NIL {disposition} NIL)'
+    return f'({fields} NIL {disposition} NIL)'
+
+def _section_part(message, section: str):
+    """Find the part for a section number such as 1.2"""
+    part = message
+    for number in section.split('.'):
+        index = int(number) - 1
+        if part.is_multipart():
+            part = part.get_payload()[index]
+        elif index != 0:
+            return None
+    return part
+
+def _section_bytes(stored: StoredMessage, section: str) -> bytes:
+    """Get the bytes of a BODY[section]"""
+    if section == '':
+        return stored.raw
+
+    raw = stored.raw
+    header_end = raw.find(b'\n\n')
+    separator = 2
+    if raw.find(b'\r\n\r\n') != -1 and (header_end == -1 or raw.find(b'\r\n\r\n') < header_end):
+        header_end = raw.find(b'\r\n\r\n')
+        separator = 4
+
+    upper = section.upper()
+    if upper == 'HEADER':
+        return raw[:header_end + separator]
+    if upper == 'TEXT':
+        return raw[header_end + separator:]
+    if upper.startswith('HEADER.FIELDS'):
+        names = re.findall(r'[\w-]+', upper[len('HEADER.FIELDS'):])
+        message = stored.message
+        lines = [f"{name}: {value}" for name, value in message.items() if name.upper() in names]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8', errors='replace')
+
+    part = _section_part(stored.message, section)
+    if part is None or part.is_multipart():
+        return b''
+    payload = part.get_payload()
+    return payload.encode('ascii', errors='replace') if isinstance(payload, str) else payload
+
+def _parse_set(text: str, maximum: int) -> List[int]:
+    """Expand an IMAP sequence set like 1:5,9,12:* into numbers"""
+    numbers = []
+    for part in text.split(','):
+        low, _, high = part.partition(':')
+        low_value = maximum if low == '*' else int(low)
+        high_value = low_value if not high else (maximum if high == '*' else int(high))
+        if low_value > high_value:
+            low_value, high_value = high_value, low_value
+        numbers.extend(range(low_value, high_value + 1))
+    return numbers
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Speaks the subset of IMAP4rev1 used by EmailProcessor"""
+
+    def setup(self):
+        self.buffer = b''
+        self.folder: Optional[Folder] = None
+        self.known_exists = 0
+
+    def readline(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        self.request.settimeout(timeout)
+        while b'\r\n' not in self.buffer:
+            try:
+                data = self.request.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                raise ConnectionError("client closed the connection")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\r\n', 1)
+        return line
+
+    def send(self, data: bytes):
+        bandwidth = self.server.bandwidth
+        if bandwidth:
+            time.sleep(len(data) / bandwidth)
+        self.request.sendall(data)
+
+    def untagged(self, text: str):
+        self.send(f"* {text}\r\n".encode())
+
+    def handle(self):
+        self.untagged(f"OK [CAPABILITY {' '.join(self.server.capabilities)}] stand-in ready")
+        try:
+            while True:
+                line = self.readline()
+                if not line:
+                    continue
+                tag, _, rest = line.decode('utf-8', errors='replace').partition(' ')
+                command, _, args = rest.partition(' ')
+                command = command.upper()
+                uid = False
+                if command == 'UID':
+                    uid = True
+                    command, _, args = args.partition(' ')
+                    command = command.upper()
+
+                self.server.count(('UID ' if uid else '') + command)
+                try:
+                    status = self.dispatch(tag, command, args, uid)
+                except (ConnectionError, OSError):
+                    raise
+                except Exception as e:
+                    status = f"BAD {type(e).__name__}: {e}"
+                if status is None:
+                    return
+
+                # Injected latency models the network round trip of every command
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                self.send(f"{tag} {status}\r\n".encode())
+        except (ConnectionError, OSError):
+            pass
+
+    def dispatch(self, tag: str, command: str, args: str, uid: bool) -> Optional[str]:
+        server = self.server
+        with server.lock:
+            if command == 'CAPABILITY':
+                self.untagged(f"CAPABILITY {' '.join(server.capabilities)}")
+                return "OK CAPABILITY completed"
+            if command == 'LOGIN':
+                return "OK LOGIN completed"
+            if command == 'NOOP':
+                self.report_new_messages()
+                return "OK NOOP completed"
+            if command == 'LOGOUT':
+                self.untagged("BYE logging out")
+                self.send(f"{tag} OK LOGOUT completed\r\n".encode())
+                return None
+            if command == 'ENABLE':
+                self.untagged(f"ENABLED {args}")
+                return "OK ENABLE completed"
+            if command in ('SELECT', 'EXAMINE'):
+                return self.select(args.strip('"'))
+            if command in ('CLOSE', 'UNSELECT'):
+                self.folder = None
+                return f"OK {command} completed"
+
+        if command == 'IDLE':
+            return self.idle()
+
+        with server.lock:
+            if self.folder is None:
+                return "BAD no folder selected"
+            if command == 'SEARCH':
+                return self.search(args, uid)
+            if command == 'FETCH':
+                return self.fetch(args, uid)
+            if command == 'STORE':
+                return self.store(args, uid)
+            if command == 'EXPUNGE':
+                return self.expunge(args if uid else None)
+            if command in ('COPY', 'MOVE'):
+                return self.copy(args, uid, move=command == 'MOVE')
+        return f"BAD unknown command {command}"
+
+    def select(self, name: str) -> str:
+        folder = self.server.folders.get(name)
+        if folder is None:
+            return "NO no such folder"
+        self.folder = folder
+        self.known_exists = len(folder.messages)
+        unseen = sum(1 for message in folder.messages if '\\Seen' not in message.flags)
+        self.untagged("FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)")
+        self.untagged(f"{len(folder.messages)} EXISTS")
+        self.untagged("0 RECENT")
+        self.untagged(f"OK [UNSEEN {unseen}]")
+        self.untagged(f"OK [UIDVALIDITY {folder.uidvalidity}] UIDs valid")
+        self.untagged(f"OK [UIDNEXT {folder.uidnext}] Predicted next UID")
+        if 'CONDSTORE' in self.server.capabilities:
+            self.untagged(f"OK [HIGHESTMODSEQ {folder.highestmodseq}] Highest")
+        return "OK [READ-WRITE] SELECT completed"
+
+    def new_messages(self) -> bytes:
+        """Get the EXISTS response for messages the client wasn't told about yet"""
+        if self.folder is None or len(self.folder.messages) == self.known_exists:
+            return b''
+        self.known_exists = len(self.folder.messages)
+        return f"* {self.known_exists} EXISTS\r\n".encode()
+
+    def report_new_messages(self):
+        report = self.new_messages()
+        if report:
+            self.send(report)
+
+    def resolve(self, message_set: str, uid: bool) -> List[tuple]:
+        """Resolve a sequence or UID set to (sequence number, message) pairs"""
+        messages = self.folder.messages
+        if not messages:
+            return []
+        if uid:
+            wanted = set(_parse_set(message_set, messages[-1].uid))
+            return [(seq, message) for seq, message in enumerate(messages, 1) if message.uid in wanted]
+        wanted = set(_parse_set(message_set, len(messages)))
+        return [(seq, message) for seq, message in enumerate(messages, 1) if seq in wanted]
+
+    def search(self, args: str, uid: bool) -> str:
+        tokens = args.upper().split()
+        if tokens and tokens[0] == 'CHARSET':
+            tokens = tokens[2:]
+        candidates = list(enumerate(self.folder.messages, 1))
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token == 'UNSEEN':
+                candidates = [(seq, m) for seq, m in candidates if '\\Seen' not in m.flags]
+            elif token == 'SEEN':
+                candidates = [(seq, m) for seq, m in candidates if '\\Seen' in m.flags]
+            elif token == 'UID':
+                i += 1
+                keep = {m.uid for _, m in self.resolve(tokens[i], True)}
+                candidates = [(seq, m) for seq, m in candidates if m.uid in keep]
+            elif token != 'ALL':
+                keep = {m.uid for _, m in self.resolve(token, False)}
+                candidates = [(seq, m) for seq, m in candidates if m.uid in keep]
+            i += 1
+        numbers = [str(m.uid if uid else seq) for seq, m in candidates]
+        self.untagged("SEARCH" + ''.join(' ' + number for number in numbers))
+        return "OK SEARCH completed"
+
+    def fetch(self, args: str, uid: bool) -> str:
+        message_set, _, items = args.partition(' ')
+        items, _, modifiers = items.upper().partition(') (')
+        names = re.findall(r'BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.]+', items)
+        if uid and 'UID' not in names:
+            names.insert(0, 'UID')
+
+        # CONDSTORE/QRESYNC modifiers: (CHANGEDSINCE modseq [VANISHED])
+        changed_since = re.search(r'CHANGEDSINCE (\d+)', modifiers)
+        selected = self.resolve(message_set, uid)
+        if changed_since:
+            modseq = int(changed_since.group(1))
+            selected = [(seq, message) for seq, message in selected if message.modseq > modseq]
+            if 'MODSEQ' not in names:
+                names.append('MODSEQ')
+            if uid and 'VANISHED' in modifiers:
+                maximum = max([self.folder.uidnext - 1] + list(self.folder.vanished))
+                wanted = set(_parse_set(message_set, maximum))
+                vanished = sorted(uid for uid, when in self.folder.vanished.items()
+                                  if when > modseq and uid in wanted)
+                if vanished:
+                    self.untagged("VANISHED (EARLIER) " + ','.join(str(uid) for uid in vanished))
+
+        for seq, message in selected:
+            parts = []
+            for name in names:
+                if name == 'UID':
+                    parts.append(f"UID {message.uid}".encode())
+                elif name == 'FLAGS':
+                    parts.append(f"FLAGS ({' '.join(sorted(message.flags))})".encode())
+                elif name == 'MODSEQ':
+                    parts.append(f"MODSEQ ({message.modseq})".encode())
+                elif name == 'RFC822.SIZE':
+                    parts.append(f"RFC822.SIZE {len(message.raw)}".encode())
+                elif name == 'BODYSTRUCTURE':
+                    parts.append(f"BODYSTRUCTURE {bodystructure(message.message)}".encode())
+                elif name == 'RFC822' or name.startswith('BODY'):
+                    if name == 'RFC822':
+                        label, data = 'RFC822', message.raw
+                    else:
+                        match = re.match(r'BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?', name)
+                        section, start, length = match.group(1), match.group(2), match.group(3)
+                        data = _section_bytes(message, section)
+                        label = f"BODY[{section}]"
+                        if start is not None:
+                            data = data[int(start):int(start) + int(length)]
+                            label += f"<{start}>"
+                    if not name.startswith('BODY.PEEK') and '\\Seen' not in message.flags:
+                        message.flags.add('\\Seen')
+                        self.folder.touch(message)
+                    parts.append(f"{label} {{{len(data)}}}\r\n".encode() + data)
+            self.send(f"* {seq} FETCH (".encode() + b' '.join(parts) + b")\r\n")
+        return "OK FETCH completed"
+
+    def store(self, args: str, uid: bool) -> str:
+        message_set, operation, flags = args.split(' ', 2)
+        flags = set(flags.strip('()').split())
+        operation = operation.upper()
+        for seq, message in self.resolve(message_set, uid):
+            if operation.startswith('+'):
+                message.flags |= flags
+            elif operation.startswith('-'):
+                message.flags -= flags
+            else:
+                message.flags = set(flags)
+            self.folder.touch(message)
+            if not operation.endswith('.SILENT'):
+                uid_item = f"UID {message.uid} " if uid else ""
+                self.untagged(f"{seq} FETCH ({uid_item}FLAGS ({' '.join(sorted(message.flags))}))")
+        return "OK STORE completed"
+
+    def expunge(self, uid_set: Optional[str]) -> str:
+        allowed = None if uid_set is None else {m.uid for _, m in self.resolve(uid_set, True)}
+        seq = 1
+        for message in list(self.folder.messages):
+            if '\\Deleted' in message.flags and (allowed is None or message.uid in allowed):
+                self.folder.remove(message)
+                self.untagged(f"{seq} EXPUNGE")
+            else:
+                seq += 1
+        self.known_exists = len(self.folder.messages)
+        return "OK EXPUNGE completed"
+
+    def copy(self, args: str, uid: bool, move: bool) -> str:
+        message_set, _, target_name = args.partition(' ')
+        target = self.server.folders.setdefault(target_name.strip('"'), Folder(target_name.strip('"')))
+        selected = self.resolve(message_set, uid)
+        for _, message in selected:
+            target.append(raw=message.raw, flags=message.flags)
+        if move:
+            for seq, message in reversed(selected):
+                self.folder.remove(message)
+                self.untagged(f"{seq} EXPUNGE")
+            self.known_exists = len(self.folder.messages)
+        return f"OK {'MOVE' if move else 'COPY'} completed"
+
+    def idle(self) -> str:
+        # Like real servers, report mail that is already waiting in the same packet as the continuation
+        with self.server.lock:
+            self.send(b"+ idling\r\n" + self.new_messages())
+        while True:
+            with self.server.lock:
+                self.report_new_messages()
+            line = self.readline(timeout=0.05)
+            if line is not None:
+                if line.strip().upper() == b'DONE':
+                    return "OK IDLE terminated"
+                return "BAD expected DONE"
+
+class IMAPStandInServer(socketserver.ThreadingTCPServer):
+    """
+    Plaintext IMAP server holding synthetic folders in memory
+
+    Usage:
+        server = IMAPStandInServer(latency=0.01)
+        server.populate(10000)
+        server.start()
+        ... connect to ('127.0.0.1', server.port) with use_ssl=False ...
+        server.stop()
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 bandwidth: Optional[float] = None,
+                 capabilities: tuple = ('IMAP4rev1', 'IDLE', 'UIDPLUS', 'MOVE', 'ENABLE', 'CONDSTORE', 'QRESYNC')):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+            latency: Seconds added before every tagged response
+            bandwidth: Bytes per second the server sends at, None for unlimited
+            capabilities: Capabilities to advertise
+        """
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.capabilities = capabilities
+        self.lock = threading.RLock()
+        self.folders: Dict[str, Folder] = {'INBOX': Folder('INBOX')}
+        self.commands = Counter()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def count(self, command: str):
+        with self.lock:
+            self.commands[command] += 1
+
+    def populate(self, count: int, folder: str = 'INBOX', seen_every: int = 0, **generator_options):
+        """Add count synthetic messages (see make_message for the options)"""
+        with self.lock:
+            target = self.folders.setdefault(folder, Folder(folder))
+            start = len(target.messages)
+            for index in range(start, start + count):
+                flags = {'\\Seen'} if seen_every and index % seen_every == 0 else set()
+                target.append(index=index, flags=flags, generator_options=generator_options)
+
+    def deliver(self, raw: bytes, folder: str = 'INBOX') -> StoredMessage:
+        """Add a new message, as if it had just been delivered"""
+        with self.lock:
+            return self.folders.setdefault(folder, Folder(folder)).append(raw=raw)
+
+    def set_flags(self, uid: int, flags: set, folder: str = 'INBOX'):
+        """Replace the flags of a message, as another client would"""
+        with self.lock:
+            target = self.folders[folder]
+            for message in target.messages:
+                if message.uid == uid:
+                    message.flags = set(flags)
+                    target.touch(message)
+
+    def expunge_uids(self, uids: List[int], folder: str = 'INBOX'):
+        """Remove messages, as another client would"""
+        with self.lock:
+            target = self.folders[folder]
+            for message in [message for message in target.messages if message.uid in uids]:
+                target.remove(message)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
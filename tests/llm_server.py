@@ -0,0 +1,248 @@
+"""
+OpenAI-compatible stand-in server and record/replay cassettes for tests and benchmarks
+of the Personal Email Management Assistant
+Answers chat completions locally with configurable latency, errors and responses
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from src.ai.prompt import count_tokens
+from src.ai.rules import RuleEngine
+
+_EMAIL_BLOCK = re.compile(r'^(?:--- id: (?P<id>\S+)\n)?From: (?P<sender>.*)\nSubject: (?P<subject>.*)\nBody: ',
+                          re.MULTILINE)
+
+def parse_prompt_emails(prompt: str) -> List[Dict]:
+    """Split an analysis prompt back into its emails (id, from, subject, body)"""
+    matches = list(_EMAIL_BLOCK.finditer(prompt))
+    emails = []
+    for match, following in zip(matches, matches[1:] + [None]):
+        body = prompt[match.end():following.start() if following else len(prompt)]
+        emails.append({'id': match.group('id'), 'from': match.group('sender'),
+                       'subject': match.group('subject'), 'body': body.strip()})
+    return emails
+
+def rule_based_responder(request: Dict) -> str:
+    """
+    Answer an analysis request the way the real model is asked to
+    
+    Emails are classified with the default keyword rules; batch prompts get a
+    {"analyses": [...]} object, single-email prompts one analysis object.
+    """
+    prompt = request['messages'][-1]['content']
+    emails = parse_prompt_emails(prompt)
+    engine = RuleEngine()
+    
+    analyses = []
+    for email_data in emails:
+        analysis = engine.evaluate(email_data)
+        analysis['summary'] = f"{email_data['from']} wrote about {email_data['subject']}."
+        if email_data['id']:
+            analysis = dict({'id': email_data['id']}, **analysis)
+        analyses.append(analysis)
+    
+    if emails and emails[0]['id']:
+        return json.dumps({"analyses": analyses})
+    return json.dumps(analyses[0] if analyses else {})
+
+def canned_responder(contents: List[str]) -> Callable[[Dict], str]:
+    """Answer requests with the given contents in turn, repeating the last one"""
+    remaining = list(contents)
+    lock = threading.Lock()
+    
+    def respond(request: Dict) -> str:
+        with lock:
+            return remaining.pop(0) if len(remaining) > 1 else remaining[0]
+    return respond
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_POST(self):
+        server: LLMStandInServer = self.server
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        
+        server.record(request)
+        delay = server.latency + (server.random.uniform(0, server.jitter) if server.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        
+        if server.error_rate and server.random.random() < server.error_rate:
+            headers = {'Retry-After': str(server.retry_after)} if server.error_status == 429 else {}
+            self.send_json(server.error_status, {"error": {"message": "Injected error", "type": "server_error"}},
+                           headers)
+            return
+        
+        content = server.responder(request)
+        prompt_tokens = sum(count_tokens(message.get('content') or '') for message in request.get('messages', []))
+        completion_tokens = count_tokens(content)
+        self.send_json(200, {
+            "id": f"chatcmpl-{server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+class LLMStandInServer(ThreadingHTTPServer):
+    """
+    OpenAI-compatible chat completions endpoint answering from a local responder
+    
+    Usage:
+        server = LLMStandInServer(latency=0.2, error_rate=0.05)
+        server.start()
+        client = openai.AsyncOpenAI(api_key="test", base_url=server.base_url)
+        ...
+        server.stop()
+    """
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 429, retry_after: float = 0.1,
+                 responder: Optional[Callable[[Dict], str]] = None, seed: Optional[int] = None):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+            latency: Seconds before every response
+            jitter: Up to this many seconds added at random to the latency
+            error_rate: Share of requests (0-1) answered with error_status instead
+            error_status: HTTP status of injected errors (429 comes with Retry-After)
+            retry_after: Seconds sent in Retry-After with injected 429s
+            responder: Function from the request body to the answer's content,
+                       rule_based_responder by default
+            seed: Seed of the jitter and error randomness
+        """
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.responder = responder or rule_based_responder
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.received: List[Dict] = []
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+    
+    def record(self, request: Dict):
+        with self.lock:
+            self.requests += 1
+            self.received.append(request)
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class CassetteMiss(Exception):
+    """A replayed request has no recorded response"""
+
+def request_key(request: httpx.Request) -> str:
+    """Identify a request by its method, path and JSON body, ignoring key order and credentials"""
+    try:
+        body = json.dumps(json.loads(request.content or b'null'), sort_keys=True)
+    except ValueError:
+        body = request.content.decode('utf-8', 'replace')
+    return hashlib.sha256(f"{request.method} {request.url.path}\n{body}".encode('utf-8')).hexdigest()
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that records responses of a real endpoint to a JSON file and replays them
+    
+    Usage:
+        transport = CassetteTransport("analyzer.json", mode="record")  # talks to the real API
+        transport = CassetteTransport("analyzer.json")                 # offline replay
+        client = openai.AsyncOpenAI(api_key=..., base_url=..., http_client=httpx.AsyncClient(transport=transport))
+    
+    Identical requests recorded several times are replayed in the recorded order.
+    """
+    
+    # Dropped when recording: bodies are stored decoded, and credentials stay out of the file
+    _SKIPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'set-cookie'}
+    
+    def __init__(self, path: str, mode: str = "replay", transport: Optional[httpx.AsyncBaseTransport] = None):
+        """
+        Args:
+            path: Cassette file
+            mode: "record" to forward requests and store the responses, "replay" to answer from the file
+            transport: Transport requests are forwarded to when recording
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode!r}")
+        self.path = Path(path)
+        self.mode = mode
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.entries: Dict[str, List[Dict]] = {}
+        self._played: Dict[str, int] = {}
+        if self.path.exists():
+            self.entries = json.loads(self.path.read_text(encoding='utf-8'))
+        elif mode == "replay":
+            raise FileNotFoundError(f"Cassette {self.path} does not exist, record it first")
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        key = request_key(request)
+        
+        if self.mode == "replay":
+            recorded = self.entries.get(key)
+            if not recorded:
+                raise CassetteMiss(f"No recorded response for {request.method} {request.url.path} ({key[:12]})")
+            played = self._played.get(key, 0)
+            self._played[key] = played + 1
+            entry = recorded[min(played, len(recorded) - 1)]
+            return httpx.Response(entry['status'], headers=entry['headers'],
+                                  content=entry['body'].encode('utf-8'), request=request)
+        
+        response = await self.transport.handle_async_request(request)
+        body = await response.aread()
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in self._SKIPPED_HEADERS}
+        self.entries.setdefault(key, []).append({
+            'status': response.status_code,
+            'headers': headers,
+            'body': body.decode('utf-8', 'replace')
+        })
+        self.path.write_text(json.dumps(self.entries, indent=2, ensure_ascii=False), encoding='utf-8')
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+    
+    async def aclose(self):
+        await self.transport.aclose()
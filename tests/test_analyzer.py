@@ -0,0 +1,783 @@
+"""
+Tests for the AI analyzer of the Personal Email Management Assistant
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+import httpx
+import openai
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / ".." / "src"))
+
+from src.ai.analyzer import EmailAnalyzer, TOKEN_FIELDS
+from src.ai.cache import AnalysisCache, content_key
+from src.ai.llm_client import AsyncLLMClient, LLMRequestError, TokenBucket
+from src.ai.router import LLMRouter
+from src.ai.similarity import SimHashIndex, hamming_distance, simhash
+from src.ai.local_model import LocalClassifier
+from src.ai.rules import RuleEngine
+from src.ai.prompt import PromptBuilder, count_tokens
+from src.ai.response_parser import IncrementalJSONParser, extract_objects, recover_fields, validate_analysis
+
+def _email(index):
+    """Build an email dictionary as produced by EmailProcessor.fetch_emails"""
+    return {
+        'id': str(index),
+        'from': f"sender{index}@example.com",
+        'subject': f"Project update {index}",
+        'body': "Status of the project. " * 20
+    }
+
+def _order_email(order_number):
+    """Build a templated order confirmation that only differs in its order number and link"""
+    return {
+        'id': order_number,
+        'from': "Shop <orders@shop.example.com>",
+        'subject': f"Your order {order_number} has shipped",
+        'body': (f"Hello, your order {order_number} has shipped and is on its way. "
+                 f"Track your parcel at https://shop.example.com/track/{order_number} at any time. "
+                 "Thank you for shopping with us, we hope to see you again soon.")
+    }
+
+def _newsletter(index):
+    """Build a newsletter email"""
+    return {
+        'id': f"n{index}",
+        'from': "News <news@deals.example.com>",
+        'subject': f"Weekly deals {index}: discount on shoes",
+        'body': "Big sale this week, huge discount on all shoes. Unsubscribe here. " * 3
+    }
+
+def _trained_classifier():
+    """Build a classifier that has learned work mail and newsletters"""
+    classifier = LocalClassifier()
+    for index in range(10):
+        classifier.learn(_email(index), {"importance": 0.8, "category": "work", "action": "read"})
+        classifier.learn(_newsletter(index), {"importance": 0.2, "category": "newsletter", "action": "archive"})
+    return classifier
+
+def _completion(content):
+    """Build a chat completion response holding content"""
+    return mock.Mock(choices=[mock.Mock(message=mock.Mock(content=content))])
+
+def _answer(ids, **overrides):
+    """Build a batch answer with one valid analysis per email ID"""
+    items = []
+    for email_id in ids:
+        item = {"id": email_id, "importance": 0.9, "summary": f"Summary of {email_id}",
+                "category": "work", "action": "read"}
+        item.update(overrides.get(email_id, {}))
+        items.append(item)
+    return json.dumps(items)
+
+class TestEmailAnalyzer(unittest.TestCase):
+    """Test cases for batched analysis in the EmailAnalyzer class"""
+    
+    def setUp(self):
+        """Set up an analyzer whose LLM client talks to a mocked API"""
+        with mock.patch.dict('os.environ', {}, clear=True):
+            self.analyzer = EmailAnalyzer()
+        self.create = mock.AsyncMock()
+        api = mock.MagicMock()
+        api.chat.completions.create = self.create
+        self.analyzer.llm_client = AsyncLLMClient(api, "test-model", max_concurrent_requests=3,
+                                                  requests_per_minute=None, tokens_per_minute=None,
+                                                  backoff_base=0.01)
+        self.analyzer.model = "test-model"
+    
+    def tearDown(self):
+        self.analyzer.close()
+    
+    def _requested_ids(self, call):
+        prompt = call.kwargs['messages'][1]['content']
+        return [line.split('id: ')[1] for line in prompt.splitlines() if line.startswith('--- id: ')]
+    
+    def test_emails_share_one_request(self):
+        """Test that a batch is analyzed with a single request and answers are matched by ID"""
+        self.create.side_effect = lambda **kwargs: _completion(
+            "```json\n" + _answer(['e2', 'e0', 'e1']) + "\n```")
+        
+        results = self.analyzer.analyze_batch([_email(i) for i in range(3)])
+        
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual([r['summary'] for r in results], ["Summary of e0", "Summary of e1", "Summary of e2"])
+    
+    def test_token_budget_splits_batches(self):
+        """Test that the token budget caps how many emails share a request"""
+        self.create.side_effect = lambda **kwargs: _completion(_answer(self._requested_ids(mock.Mock(kwargs=kwargs))))
+        
+        results = self.analyzer.analyze_batch([_email(i) for i in range(6)], max_batch_tokens=1000)
+        
+        sizes = [len(self._requested_ids(call)) for call in self.create.call_args_list]
+        self.assertGreater(len(sizes), 1)
+        self.assertEqual(sum(sizes), 6)
+        self.assertTrue(all(r['category'] == "work" for r in results))
+    
+    def test_only_failed_items_are_requeued(self):
+        """Test that emails with malformed answers are retried without the others"""
+        answers = [
+            _answer(['e0', 'e1', 'e2'], e1={"importance": "high"}),
+            _answer(['e1'])
+        ]
+        self.create.side_effect = lambda **kwargs: _completion(answers.pop(0))
+        
+        results = self.analyzer.analyze_batch([_email(i) for i in range(3)])
+        
+        self.assertEqual([self._requested_ids(call) for call in self.create.call_args_list],
+                         [['e0', 'e1', 'e2'], ['e1']])
+        self.assertEqual(results[1]['summary'], "Summary of e1")
+    
+    def test_failed_request_falls_back_to_default(self):
+        """Test that emails of a failed request get the default analysis"""
+        self.create.side_effect = RuntimeError("connection reset")
+        
+        results = self.analyzer.analyze_batch([_email(i) for i in range(2)])
+        
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual([r['category'] for r in results], ["work", "work"])
+        self.assertEqual([r['source'] for r in results], ["heuristic", "heuristic"])
+        self.assertTrue(results[0]['summary'].startswith("Email from sender0@example.com"))
+    
+    def test_rate_limited_request_is_retried(self):
+        """Test that a 429 is retried after the server's Retry-After instead of degrading"""
+        rate_limited = openai.RateLimitError(
+            "rate limited",
+            response=httpx.Response(429, headers={'retry-after': '0.2'},
+                                    request=httpx.Request('POST', "https://llm.example.com")),
+            body=None
+        )
+        answers = [rate_limited, _completion(_answer(['e0']))]
+        
+        def raise_or_return(**kwargs):
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        self.create.side_effect = raise_or_return
+        
+        start = time.monotonic()
+        results = self.analyzer.analyze_batch([_email(0)])
+        
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(self.create.call_count, 2)
+        self.assertEqual(results[0]['source'], "llm")
+    
+    def test_batches_run_concurrently(self):
+        """Test that batch requests overlap up to the concurrency limit"""
+        in_flight = []
+        peak = []
+        
+        async def slow_answer(**kwargs):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.1)
+            in_flight.pop()
+            return _completion(_answer(self._requested_ids(mock.Mock(kwargs=kwargs))))
+        self.create.side_effect = slow_answer
+        
+        results = self.analyzer.analyze_batch([_email(i) for i in range(6)], max_batch_size=1)
+        
+        self.assertEqual(self.create.call_count, 6)
+        self.assertEqual(max(peak), 3)
+        self.assertTrue(all(r['source'] == "llm" for r in results))
+    
+    def test_token_usage_is_recorded_per_email(self):
+        """Test that reported usage is shared by the emails of a request, or counted locally"""
+        def answer(**kwargs):
+            completion = _completion(_answer(self._requested_ids(mock.Mock(kwargs=kwargs))))
+            completion.usage = mock.Mock(prompt_tokens=900, completion_tokens=60, total_tokens=960)
+            return completion
+        self.create.side_effect = answer
+        
+        results = self.analyzer.analyze_batch([_email(0), dict(_email(1), body="Short"), _email(2)])
+        
+        self.assertEqual(sum(r['completion_tokens'] for r in results), 60)
+        self.assertAlmostEqual(sum(r['prompt_tokens'] for r in results), 900, delta=2)
+        self.assertGreater(results[0]['prompt_tokens'], results[1]['prompt_tokens'])
+        
+        self.create.side_effect = lambda **kwargs: _completion('{"importance": 0.4, "summary": "Hi", '
+                                                               '"category": "other", "action": "read"}')
+        analysis = self.analyzer.analyze_email(_email(3))
+        self.assertGreater(analysis['prompt_tokens'], 50)
+        self.assertGreater(analysis['completion_tokens'], 0)
+    
+    def test_structured_output_is_requested(self):
+        """Test that the response format is sent, and dropped when the provider rejects it"""
+        rejected = openai.BadRequestError(
+            "response_format is not supported",
+            response=httpx.Response(400, request=httpx.Request('POST', "https://llm.example.com")),
+            body=None
+        )
+        answers = [rejected, _completion(_answer(['e0'])), _completion(_answer(['e0']))]
+        
+        def raise_or_return(**kwargs):
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        self.create.side_effect = raise_or_return
+        
+        first = self.analyzer.analyze_batch([_email(0)])
+        second = self.analyzer.analyze_batch([_email(1)])
+        
+        formats = [call.kwargs.get('response_format') for call in self.create.call_args_list]
+        self.assertEqual(formats, [{"type": "json_object"}, None, None])
+        self.assertFalse(self.analyzer.llm_client.response_format_supported)
+        self.assertEqual(self.analyzer.llm_client.stats['failures'], 0)
+        self.assertEqual((first[0]['source'], second[0]['source']), ("llm", "llm"))
+    
+    def test_single_response_in_prose_keeps_all_fields(self):
+        """Test that a fenced answer with prose and a cut-off answer both keep their fields"""
+        self.create.side_effect = lambda **kwargs: _completion(
+            'Here is the analysis:\n```json\n{"importance": "0.7", "summary": "Quarterly numbers", '
+            '"category": "Work", "action": "read",}\n```\nLet me know if you need more.')
+        analysis = self.analyzer.analyze_email(_email(0))
+        self.assertEqual((analysis['importance'], analysis['summary'], analysis['category']),
+                         (0.7, "Quarterly numbers", "work"))
+        
+        self.create.side_effect = lambda **kwargs: _completion(
+            '{"importance": 0.9, "category": "work", "action": "read", "summary": "The board moved the')
+        analysis = self.analyzer.analyze_email(_email(1))
+        self.assertEqual((analysis['importance'], analysis['summary'], analysis['category']),
+                         (0.9, "The board moved the", "work"))
+        
+        self.create.side_effect = lambda **kwargs: _completion("I can't help with that.")
+        self.assertEqual(self.analyzer.analyze_email(_email(2))['source'], "heuristic")
+    
+    def test_single_prompt_holds_clean_body(self):
+        """Test that the single-email prompt has the cleaned body and no template leftovers"""
+        email_data = dict(_email(0), body="<div>See you <b>tomorrow</b></div>")
+        prompt = self.analyzer._create_analysis_prompt(email_data)
+        
+        self.assertIn("Body: See you tomorrow\n", prompt)
+        self.assertNotIn("#", prompt)
+    
+    def test_cached_and_repeated_emails_are_not_sent(self):
+        """Test that cache hits and duplicates within a call skip the LLM"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.analyzer.cache = AnalysisCache(os.path.join(temp_dir, "analysis_cache.db"))
+            self.create.side_effect = lambda **kwargs: _completion(_answer(self._requested_ids(mock.Mock(kwargs=kwargs))))
+            
+            copy = dict(_email(0), **{'from': "Sender0 <SENDER0@example.com>"})
+            first = self.analyzer.analyze_batch([_email(0), _email(1), copy])
+            self.assertEqual(self._requested_ids(self.create.call_args), ['e0', 'e1'])
+            # Reused analyses don't repeat the token usage of the request
+            self.assertEqual(first[2], {field: value for field, value in first[0].items() if field not in TOKEN_FIELDS})
+            
+            second = self.analyzer.analyze_batch([_email(1), _email(2)])
+            self.assertEqual(self._requested_ids(self.create.call_args), ['e1'])
+            self.assertEqual(second[0]['summary'], first[1]['summary'])
+            self.assertEqual(second[0]['source'], "cache")
+            self.assertNotIn('prompt_tokens', second[0])
+            self.assertEqual(self.analyzer.cache.get_stats()['hits'], 1)
+    
+    def test_cache_key_covers_what_the_prompt_shows(self):
+        """Test that replies differing only in quoted history share a cached analysis"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.analyzer.cache = AnalysisCache(os.path.join(temp_dir, "analysis_cache.db"))
+            self.create.side_effect = lambda **kwargs: _completion(_answer(self._requested_ids(mock.Mock(kwargs=kwargs))))
+            reply = "Sounds good, see you at 3.\n\nOn Mon, 1 Jan 2024, Bob <bob@example.com> wrote:\n"
+            
+            self.analyzer.analyze_batch([dict(_email(0), body=reply + "> Can we meet?\n")])
+            self.analyzer.analyze_batch([dict(_email(0), body=reply + "> Are you free on Monday?\n")])
+            
+            self.assertEqual(self.create.call_count, 1)
+            self.assertEqual(self.analyzer.cache.get_stats()['hits'], 1)
+    
+    def test_near_duplicates_reuse_analysis(self):
+        """Test that a templated email reuses the analysis of an earlier copy without the LLM"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.analyzer.similarity_index = SimHashIndex(os.path.join(temp_dir, "analysis_cache.db"))
+            self.create.side_effect = lambda **kwargs: _completion(_answer(self._requested_ids(mock.Mock(kwargs=kwargs))))
+            
+            first = self.analyzer.analyze_batch([_order_email("10001")])
+            self.assertEqual(first[0]['source'], "llm")
+            
+            second = self.analyzer.analyze_batch([_order_email("20417"), _email(0)])
+            self.assertEqual(self._requested_ids(self.create.call_args), ['e1'])
+            self.assertEqual(second[0]['source'], "near_duplicate")
+            self.assertEqual(second[0]['summary'], first[0]['summary'])
+            self.assertTrue(second[0]['reused_from'])
+    
+    def test_confident_local_model_skips_llm(self):
+        """Test that the local model answers what it knows and learns from LLM verdicts"""
+        self.analyzer.local_model = _trained_classifier()
+        self.analyzer.local_min_examples = 20
+        self.create.side_effect = lambda **kwargs: _completion(_answer(self._requested_ids(mock.Mock(kwargs=kwargs))))
+        unknown = {'id': "x", 'from': "friend@home.example.org", 'subject': "Dinner on Sunday?",
+                   'body': "Are you free for dinner with the family on Sunday evening?"}
+        
+        results = self.analyzer.analyze_batch([_newsletter(20), unknown])
+        
+        self.assertEqual(self._requested_ids(self.create.call_args), ['e1'])
+        self.assertEqual(results[0]['source'], "local")
+        self.assertEqual(results[0]['category'], "newsletter")
+        self.assertEqual(results[0]['action'], "archive")
+        self.assertGreaterEqual(results[0]['confidence'], 0.9)
+        self.assertEqual(results[1]['source'], "llm")
+        self.assertEqual(self.analyzer.local_model.examples, 21)
+    
+    def test_untrained_local_model_is_not_used(self):
+        """Test that the local model waits for enough examples before answering"""
+        self.analyzer.local_model = _trained_classifier()
+        self.create.side_effect = lambda **kwargs: _completion(_answer(self._requested_ids(mock.Mock(kwargs=kwargs))))
+        
+        results = self.analyzer.analyze_batch([_newsletter(20)])
+        
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(results[0]['source'], "llm")
+
+def _routed_client(content, delay=0.0, error=None):
+    """Build an LLM client whose API answers content after delay seconds, or raises error"""
+    async def create(**kwargs):
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return _completion(content)
+    api = mock.MagicMock()
+    api.chat.completions.create = mock.AsyncMock(side_effect=create)
+    return AsyncLLMClient(api, f"model-{content}", requests_per_minute=None, tokens_per_minute=None, max_retries=0)
+
+class TestLLMRouter(unittest.TestCase):
+    """Test cases for routing requests between LLM backends"""
+    
+    def _complete(self, router):
+        return router.run(router.complete([{"role": "user", "content": "Hi"}], max_tokens=10)).text
+    
+    def _calls(self, router):
+        return [backend.client.client.chat.completions.create.call_count for backend in router.backends]
+    
+    def test_requests_go_to_fastest_backend(self):
+        """Test that every backend is measured and then the fastest one gets the requests"""
+        router = LLMRouter({"slow": _routed_client("slow", delay=0.05), "fast": _routed_client("fast")},
+                           hedge_requests=False)
+        answers = [self._complete(router) for _ in range(4)]
+        router.close()
+        
+        self.assertEqual(answers, ["slow", "fast", "fast", "fast"])
+        self.assertEqual(self._calls(router), [1, 3])
+    
+    def test_failed_backend_fails_over(self):
+        """Test that a request failing on one backend is answered by the next, which is then preferred"""
+        router = LLMRouter({"broken": _routed_client("broken", error=RuntimeError("down")),
+                            "healthy": _routed_client("healthy")})
+        answers = [self._complete(router) for _ in range(3)]
+        router.close()
+        
+        self.assertEqual(answers, ["healthy"] * 3)
+        self.assertEqual(self._calls(router), [1, 3])
+        self.assertEqual(router.stats['failovers'], 1)
+        self.assertEqual(router.backends[0].error_rate(), 1.0)
+    
+    def test_all_backends_failing_raises(self):
+        """Test that the last backend's error is raised when every backend fails"""
+        router = LLMRouter({"a": _routed_client("a", error=RuntimeError("down")),
+                            "b": _routed_client("b", error=RuntimeError("down too"))})
+        with self.assertRaises(LLMRequestError) as raised:
+            self._complete(router)
+        router.close()
+        self.assertIn("down too", str(raised.exception))
+    
+    def test_late_request_is_hedged(self):
+        """Test that a request running past the backend's p95 latency is also sent to the next backend"""
+        router = LLMRouter({"stalled": _routed_client("stalled", delay=2.0), "spare": _routed_client("spare")},
+                           hedge_min_samples=5)
+        for backend in router.backends:
+            for _ in range(5):
+                backend.record(0.01 if backend.name == "stalled" else 0.02, True)
+        
+        start = time.monotonic()
+        answer = self._complete(router)
+        elapsed = time.monotonic() - start
+        router.close()
+        
+        self.assertEqual(answer, "spare")
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual((router.stats['hedged'], router.stats['hedge_wins']), (1, 1))
+        # The abandoned request counts as at least as slow as it was, but doesn't move the hedge deadline
+        self.assertGreater(router.backends[0].latency(1.0, include_censored=True), 0.01)
+        self.assertEqual(router.backends[0].latency(1.0), 0.01)
+        self.assertEqual(router.backends[0].sample_count(), 5)
+    
+    def test_analyses_are_cached_under_the_model_that_answered(self):
+        """Test that an answer of a fallback backend is not reused for the preferred backend's model"""
+        with mock.patch.dict('os.environ', {}, clear=True):
+            analyzer = EmailAnalyzer()
+        answer = json.dumps({"importance": 0.9, "summary": "Routed", "category": "work", "action": "read"})
+        analyzer.llm_client = LLMRouter({"broken": _routed_client("broken", error=RuntimeError("down")),
+                                         "healthy": _routed_client(answer)})
+        analyzer.model = "model-broken"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            analyzer.cache = AnalysisCache(os.path.join(temp_dir, "analysis_cache.db"))
+            
+            analysis = analyzer.analyze_email(_email(0))
+            
+            self.assertEqual(analysis['model'], f"model-{answer}")
+            self.assertIsNone(analyzer.cache.get(analyzer._content_key(_email(0))))
+            self.assertIsNotNone(analyzer.cache.get(analyzer._content_key(_email(0), f"model-{answer}")))
+        analyzer.close()
+    
+    def test_rejected_response_format_is_dropped_per_backend(self):
+        """Test that a backend rejecting the response format doesn't take it away from the others"""
+        with mock.patch.dict('os.environ', {}, clear=True):
+            analyzer = EmailAnalyzer()
+        rejected = openai.BadRequestError(
+            "response_format is not supported",
+            response=httpx.Response(400, request=httpx.Request('POST', "https://llm.example.com")),
+            body=None
+        )
+        
+        def reject_response_format(**kwargs):
+            if 'response_format' in kwargs:
+                raise rejected
+            return _completion(_answer(['e0']))
+        plain = _routed_client(_answer(['e0']))
+        plain.client.chat.completions.create.side_effect = reject_response_format
+        structured = _routed_client(_answer(['e0']))
+        analyzer.llm_client = LLMRouter({"plain": plain, "structured": structured}, hedge_requests=False)
+        
+        for index in range(4):
+            self.assertEqual(analyzer.analyze_batch([_email(index)])[0]['source'], "llm")
+        analyzer.close()
+        
+        def formats(backend):
+            return [call.kwargs.get('response_format') for call in backend.client.chat.completions.create.call_args_list]
+        json_object = {"type": "json_object"}
+        self.assertEqual(formats(plain)[:2], [json_object, None])
+        self.assertNotIn(json_object, formats(plain)[2:])
+        self.assertTrue(formats(structured))
+        self.assertEqual(formats(structured), [json_object] * len(formats(structured)))
+        self.assertFalse(plain.response_format_supported)
+        self.assertTrue(structured.response_format_supported)
+    
+    def test_analyzer_routes_between_configured_providers(self):
+        """Test that providers without an API key are skipped and several usable ones are routed"""
+        providers = [
+            {"name": "qwen", "base_url": "https://qwen.example.com/v1", "model": "qwen-plus",
+             "api_key_env": "QWEN_KEY"},
+            {"name": "openai", "base_url": "https://openai.example.com/v1", "model": "gpt-4o-mini",
+             "api_key_env": "OPENAI_KEY", "requests_per_minute": 500},
+            {"name": "gemini", "base_url": "https://gemini.example.com/v1", "model": "gemini",
+             "api_key_env": "GEMINI_KEY"}
+        ]
+        with mock.patch.dict('os.environ', {"QWEN_KEY": "a", "OPENAI_KEY": "b"}, clear=True):
+            analyzer = EmailAnalyzer(providers=providers)
+        
+        self.assertIsInstance(analyzer.llm_client, LLMRouter)
+        self.assertEqual([backend.name for backend in analyzer.llm_client.backends], ["qwen", "openai"])
+        self.assertEqual(analyzer.llm_client.backends[1].client.requests.rate, 500 / 60)
+        self.assertEqual(analyzer.model, "qwen-plus")
+        analyzer.close()
+
+class TestLocalClassifier(unittest.TestCase):
+    """Test cases for the LocalClassifier class"""
+    
+    def test_predicts_learned_categories(self):
+        """Test that categories, actions and importance follow the training examples"""
+        classifier = _trained_classifier()
+        
+        work, newsletter = classifier.predict_batch([_email(42), _newsletter(42)])
+        self.assertEqual((work['category'], work['action'], work['importance']), ("work", "read", 0.8))
+        self.assertEqual((newsletter['category'], newsletter['action']), ("newsletter", "archive"))
+        self.assertEqual(work['source'], "local")
+        self.assertGreater(work['confidence'], 0.99)
+    
+    def test_needs_two_categories(self):
+        """Test that a model that has seen a single category makes no prediction"""
+        classifier = LocalClassifier()
+        self.assertIsNone(classifier.predict(_email(0)))
+        classifier.learn(_email(0), {"importance": 0.8, "category": "work", "action": "read"})
+        self.assertIsNone(classifier.predict(_email(1)))
+
+class TestPromptBuilder(unittest.TestCase):
+    """Test cases for the PromptBuilder class"""
+    
+    def test_strips_quotes_and_signature(self):
+        """Test that quoted history, signatures and link-only lines are removed"""
+        body = ("Sounds good, see you at 3.\n\nhttps://meet.example.com/abc\n\n-- \nAlice\n"
+                "On Mon, 1 Jan 2024 at 10:00, Bob <bob@example.com> wrote:\n> Can we meet?\n")
+        self.assertEqual(PromptBuilder().clean_body(body), "Sounds good, see you at 3.")
+        self.assertEqual(PromptBuilder().clean_body("> Only quoted text"), "> Only quoted text")
+    
+    def test_body_fits_token_budget(self):
+        """Test that long bodies are cut at a word boundary within the budget"""
+        body = "First paragraph.\n\n" + "word " * 500
+        cleaned = PromptBuilder(body_tokens=50).clean_body(body)
+        
+        self.assertTrue(cleaned.startswith("First paragraph.\n\nword word"))
+        self.assertTrue(cleaned.endswith("word ..."))
+        self.assertLessEqual(count_tokens(cleaned), 52)
+
+class TestResponseParser(unittest.TestCase):
+    """Test cases for parsing LLM answers"""
+    
+    def test_objects_are_returned_as_they_complete(self):
+        """Test that streamed array elements are returned once closed, ignoring braces in strings"""
+        answer = 'Sure! {"analyses": [{"id": "e0", "summary": "Use {braces} and \\"quotes\\""}, {"id": "e1"}]}'
+        parser = IncrementalJSONParser()
+        
+        found = []
+        for start in range(0, len(answer), 7):
+            found.append([item.get('id') for item in parser.feed(answer[start:start + 7])])
+        
+        ids = [item_id for chunk in found for item_id in chunk]
+        self.assertEqual(ids, ["e0", "e1", None])
+        self.assertEqual(extract_objects(answer)[0]['summary'], 'Use {braces} and "quotes"')
+    
+    def test_cut_off_answer_keeps_finished_objects(self):
+        """Test that an answer cut off by the token limit still yields its complete items"""
+        answer = '```json\n[{"id": "e0", "importance": 1}, {"id": "e1", "importance": 0.'
+        self.assertEqual(extract_objects(answer), [{"id": "e0", "importance": 1}])
+    
+    def test_brace_in_prose_does_not_hide_objects(self):
+        """Test that an object inside an unmatched or invalid brace of the prose is still found"""
+        analysis = '{"importance": 0.7, "summary": "Hi", "category": "work", "action": "read"}'
+        self.assertEqual(extract_objects("Result {as requested:\n" + analysis)[0]['importance'], 0.7)
+        self.assertEqual(extract_objects("Result {as requested: " + analysis + " done}")[0]['importance'], 0.7)
+        
+        batch = '{"analyses": [{"id": "e0"}, {"id": "e1"'
+        self.assertEqual(extract_objects("Note {see below}: " + batch), [{"id": "e0"}])
+    
+    def test_validation(self):
+        """Test that analyses are checked for types and normalized"""
+        self.assertEqual(
+            validate_analysis({"id": 3, "importance": 1.5, "summary": " Hi ", "category": "Promotions",
+                               "action": "DELETE"}, require_id=True),
+            {"importance": 1.0, "summary": "Hi", "category": "other", "action": "delete", "id": "3"}
+        )
+        self.assertIsNone(validate_analysis({"importance": "high", "summary": "Hi", "category": "work",
+                                             "action": "read"}))
+        self.assertIsNone(validate_analysis({"importance": 0.5, "category": "work", "action": "read"}))
+        self.assertIsNone(validate_analysis({"importance": True, "summary": "Hi", "category": "work",
+                                             "action": "read"}))
+        self.assertIsNone(validate_analysis({"importance": 0.5, "summary": "Hi", "category": "work",
+                                             "action": "read"}, require_id=True))
+    
+    def test_recover_fields(self):
+        """Test that fields are recovered from text that isn't JSON"""
+        self.assertEqual(recover_fields('importance: 0.3, category = spam'),
+                         {"importance": 0.3, "category": "spam"})
+        self.assertEqual(recover_fields('{"summary": "Line\\nbreak'), {"summary": "Line\nbreak"})
+
+class TestRuleEngine(unittest.TestCase):
+    """Test cases for the RuleEngine class"""
+    
+    def _evaluate(self, engine, sender="someone@example.com", subject="", body=""):
+        return engine.evaluate({'from': sender, 'subject': subject, 'body': body})
+    
+    def test_default_rules(self):
+        """Test that the default rules categorize by subject, body and sender"""
+        engine = RuleEngine()
+        
+        self.assertEqual(self._evaluate(engine, subject="URGENT: Project Deadline"),
+                         {"importance": 0.8, "category": "work", "action": "read"})
+        self.assertEqual(self._evaluate(engine, subject="Best deals of the week")['category'], "newsletter")
+        self.assertEqual(self._evaluate(engine, body="Click to Unsubscribe")['action'], "delete")
+        self.assertEqual(self._evaluate(engine, sender="NoReply@shop.example.com")['category'], "spam")
+        self.assertEqual(self._evaluate(engine, subject="Family photos")['category'], "personal")
+        self.assertEqual(self._evaluate(engine, subject="Lunch?")['category'], "other")
+        self.assertAlmostEqual(self._evaluate(engine, sender="Boss@corp.example.com", subject="meeting")['importance'], 1.0)
+    
+    def test_rule_order_and_weights(self):
+        """Test that the first matching category wins, weights add up and keywords nest"""
+        engine = RuleEngine({
+            "categories": {"work": {"importance": 0.6, "action": "read"},
+                           "spam": {"importance": 0.1, "action": "delete"},
+                           "other": {"importance": 0.5, "action": "read"}},
+            "rules": [
+                {"fields": ["subject", "body"], "keywords": ["invoice"], "category": "work"},
+                {"fields": ["subject"], "keywords": ["invoices overdue"], "category": "spam"},
+                {"fields": ["body"], "keywords": ["urgent"], "weight": 0.3},
+                {"fields": ["body"], "keywords": ["gent"], "weight": 0.05}
+            ]
+        })
+        
+        results = engine.evaluate_batch([
+            {'subject': "Invoices overdue", 'body': "This is urgent"},
+            {'subject': "Hello", 'body': "invoice attached"},
+            {'subject': "Hello", 'body': "nothing"}
+        ])
+        self.assertEqual(results[0]['category'], "work")
+        self.assertAlmostEqual(results[0]['importance'], 0.95)
+        self.assertEqual(results[1]['category'], "work")
+        self.assertEqual(results[2], {"importance": 0.5, "category": "other", "action": "read"})
+    
+    def test_overlapping_keywords_all_match(self):
+        """Test that a keyword starting inside another keyword's match is still reported"""
+        engine = RuleEngine({
+            "categories": {"other": {"importance": 0.5, "action": "read"}},
+            "rules": [
+                {"fields": ["subject"], "keywords": ["invoice"], "weight": 0.1},
+                {"fields": ["subject"], "keywords": ["ice cream"], "weight": 0.2},
+                {"fields": ["subject"], "keywords": ["cream"], "weight": 0.05}
+            ]
+        })
+        
+        self.assertEqual(engine.matching_rules([{'subject': "Invoice cream delivery"}]), [{0, 1, 2}])
+        self.assertAlmostEqual(self._evaluate(engine, subject="Invoice cream")['importance'], 0.85)
+    
+    def test_invalid_config_falls_back_to_defaults(self):
+        """Test that rules with undefined categories or fields are rejected"""
+        with self.assertRaises(ValueError):
+            RuleEngine({"categories": {"other": {}}, "rules": [{"keywords": ["x"], "category": "work"}]})
+        
+        engine = RuleEngine.from_config({"rules": [{"fields": ["headers"], "keywords": ["x"]}]})
+        self.assertEqual(self._evaluate(engine, subject="meeting")['category'], "work")
+
+class TestAnalysisCache(unittest.TestCase):
+    """Test cases for the AnalysisCache class"""
+    
+    def setUp(self):
+        """Create a cache in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "analysis_cache.db")
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_key_depends_on_model_and_prompt_version(self):
+        """Test that the key ignores formatting but not the model or prompt version"""
+        key = content_key(_email(0), "qwen-plus", "1")
+        
+        reformatted = dict(_email(0), subject="  PROJECT   update 0 ")
+        self.assertEqual(content_key(reformatted, "qwen-plus", "1"), key)
+        self.assertNotEqual(content_key(_email(0), "qwen-max", "1"), key)
+        self.assertNotEqual(content_key(_email(0), "qwen-plus", "2"), key)
+    
+    def test_expired_entries_miss(self):
+        """Test that entries older than the TTL are not returned"""
+        cache = AnalysisCache(self.path, ttl=60)
+        cache.put("key", {"summary": "cached"})
+        self.assertEqual(cache.get("key"), {"summary": "cached"})
+        
+        with mock.patch('src.ai.cache.time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get("key"))
+        self.assertEqual(cache.get_stats()['misses'], 1)
+    
+    def test_least_recently_used_are_evicted(self):
+        """Test that the cache stays within max_entries, keeping recently used entries"""
+        cache = AnalysisCache(self.path, max_entries=2)
+        now = time.time()
+        for offset, key in enumerate(["a", "b"]):
+            with mock.patch('src.ai.cache.time.time', return_value=now + offset):
+                cache.put(key, {"key": key})
+        with mock.patch('src.ai.cache.time.time', return_value=now + 2):
+            cache.get("a")
+        with mock.patch('src.ai.cache.time.time', return_value=now + 3):
+            cache.put("c", {"key": "c"})
+        
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+
+class TestSimHashIndex(unittest.TestCase):
+    """Test cases for SimHash fingerprints and the SimHashIndex class"""
+    
+    def setUp(self):
+        """Create an index in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "analysis_cache.db")
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def _text(self, email_data):
+        return email_data['subject'] + "\n" + email_data['body']
+    
+    def test_fingerprint_ignores_variable_values(self):
+        """Test that templated copies are near, different emails far, and short texts skipped"""
+        first = simhash(self._text(_order_email("10001")))
+        self.assertLessEqual(hamming_distance(first, simhash(self._text(_order_email("20417")))), 3)
+        self.assertGreater(hamming_distance(first, simhash(self._text(_email(0)))), 10)
+        self.assertIsNone(simhash("Thanks!"))
+    
+    def test_find_within_scope(self):
+        """Test that near-duplicates are found only within the same scope"""
+        index = SimHashIndex(self.path)
+        index.add("key", "orders@shop.example.com", self._text(_order_email("10001")), {"summary": "shipped"})
+        
+        match = index.find("orders@shop.example.com", self._text(_order_email("20417")))
+        self.assertEqual(match[0], "key")
+        self.assertEqual(match[2], {"summary": "shipped"})
+        self.assertIsNone(index.find("other@example.com", self._text(_order_email("20417"))))
+        self.assertIsNone(index.find("orders@shop.example.com", self._text(_email(0))))
+        self.assertEqual(index.get_stats()['hits'], 1)
+    
+    def test_expired_entries_miss(self):
+        """Test that entries older than the TTL are not matched"""
+        index = SimHashIndex(self.path, ttl=60)
+        index.add("key", "scope", self._text(_order_email("10001")), {"summary": "shipped"})
+        
+        with mock.patch('src.ai.similarity.time.time', return_value=time.time() + 61):
+            self.assertIsNone(index.find("scope", self._text(_order_email("10001"))))
+
+class TestTokenBucket(unittest.TestCase):
+    """Test cases for the TokenBucket rate limiter"""
+    
+    def test_waits_once_budget_is_spent(self):
+        """Test that reservations beyond the capacity wait for the refill"""
+        bucket = TokenBucket(600, capacity=2)  # 10 tokens per second
+        
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.02)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, delta=0.02)
+    
+    def test_block_holds_back_reservations(self):
+        """Test that a Retry-After block delays even available tokens"""
+        bucket = TokenBucket(600)
+        bucket.block(0.5)
+        self.assertAlmostEqual(bucket.reserve(), 0.5, delta=0.05)
+    
+    def _client(self, create):
+        api = mock.MagicMock()
+        api.chat.completions.create = create
+        return AsyncLLMClient(api, "test-model", requests_per_minute=None, tokens_per_minute=6000,
+                              max_retries=2, backoff_base=0.01)
+    
+    def test_failed_attempts_are_refunded(self):
+        """Test that retried and failed requests give their token reservation back"""
+        client = self._client(mock.AsyncMock(side_effect=asyncio.TimeoutError()))
+        with self.assertRaises(LLMRequestError):
+            client.run(client.complete([{"role": "user", "content": "Hi"}], max_tokens=1000,
+                                       estimated_prompt_tokens=1000))
+        client.close()
+        
+        self.assertEqual(client.stats['retries'], 2)
+        self.assertGreater(client.tokens.tokens, 5900)
+    
+    def test_cancelled_attempts_are_refunded(self):
+        """Test that an abandoned request, such as a hedge that lost, gives its token reservation back"""
+        started = threading.Event()
+        
+        async def stall(**kwargs):
+            started.set()
+            await asyncio.sleep(10)
+        client = self._client(stall)
+        
+        async def complete_and_cancel():
+            task = asyncio.ensure_future(client.complete([{"role": "user", "content": "Hi"}], max_tokens=1000,
+                                                         estimated_prompt_tokens=1000))
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        client.run(complete_and_cancel())
+        client.close()
+        
+        self.assertGreater(client.tokens.tokens, 5900)
+
+if __name__ == "__main__":
+    unittest.main()
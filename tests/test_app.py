@@ -0,0 +1,169 @@
+"""
+Tests for the main application flow of the Personal Email Management Assistant
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / ".." / "src"))
+
+from src.ai.local_model import LocalClassifier
+from src.app import EmailAssistant
+from src.config.manager import ConfigManager
+from src.database.db import EmailDatabase
+
+class TestEmailAssistant(unittest.TestCase):
+    """Test cases for the EmailAssistant class"""
+    
+    def setUp(self):
+        """Set up an assistant with a temporary config and mocked IMAP access"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        config_path = os.path.join(self.temp_dir.name, "app_config.json")
+        
+        # Keep the database, the analysis cache next to it and the log in the temporary directory
+        config = ConfigManager(config_path)
+        config.config.update({
+            "database_path": os.path.join(self.temp_dir.name, "emails.db"),
+            "log_file": os.path.join(self.temp_dir.name, "email_assistant.log")
+        })
+        config.save_config()
+        
+        self.assistant = EmailAssistant(config_path)
+        self.assistant.database.close()
+        self.assistant.database = mock.MagicMock()
+        
+        for i in range(3):
+            self.assistant.email_processor.add_account(f"user{i}@example.com", "password", "imap.example.com")
+    
+    def tearDown(self):
+        self.assistant.shutdown()
+        self.temp_dir.cleanup()
+    
+    def test_failing_account_does_not_stop_others(self):
+        """Test that an error in one account is isolated from the other accounts"""
+        processed = []
+        lock = threading.Lock()
+        
+        def process_account(account):
+            if account['email'] == "user1@example.com":
+                raise RuntimeError("server went away")
+            with lock:
+                processed.append(account['email'])
+        
+        with mock.patch.object(self.assistant, '_process_account', side_effect=process_account):
+            self.assistant.process_emails()
+        
+        self.assertEqual(sorted(processed), ["user0@example.com", "user2@example.com"])
+    
+    def test_accounts_processed_concurrently(self):
+        """Test that accounts are processed in parallel up to the configured limit"""
+        self.assistant.config_manager.config["max_concurrent_accounts"] = 3
+        barrier = threading.Barrier(3, timeout=5)
+        
+        # Every account waits for the others, which only succeeds when they run in parallel
+        with mock.patch.object(self.assistant, '_process_account', side_effect=lambda account: barrier.wait()):
+            self.assistant.process_emails()
+        
+        self.assertFalse(barrier.broken)
+    
+    def test_hung_account_is_skipped_until_it_finishes(self):
+        """Test that an account still running after its timeout is not started again in the next cycle"""
+        self.assistant.config_manager.config["account_timeout"] = 0.2
+        release = threading.Event()
+        started = []
+        lock = threading.Lock()
+        
+        def process_account(account):
+            with lock:
+                started.append(account['email'])
+            if account['email'] == "user1@example.com":
+                release.wait(5)
+        
+        with mock.patch.object(self.assistant, '_process_account', side_effect=process_account):
+            with self.assertLogs('src.app', level='ERROR'):
+                self.assistant.process_emails()
+            self.assertEqual(list(self.assistant.hung_accounts), ["user1@example.com"])
+            
+            with self.assertLogs('src.app', level='WARNING'):
+                self.assistant.process_emails()
+            self.assertEqual(started.count("user1@example.com"), 1)
+            self.assertEqual(started.count("user0@example.com"), 2)
+            
+            release.set()
+            self.assistant.hung_accounts["user1@example.com"].result(timeout=5)
+            self.assistant.process_emails()
+            self.assertEqual(started.count("user1@example.com"), 2)
+            self.assertEqual(self.assistant.hung_accounts, {})
+    
+    def test_review_teaches_local_model(self):
+        """Test that the action chosen in review mode is learned at once, not at the next start"""
+        self.assistant.database = EmailDatabase(os.path.join(self.temp_dir.name, "reviewed.db"))
+        self.assistant.email_analyzer.local_model = LocalClassifier()
+        llm_email = {'id': "1", 'from': "boss@example.com", 'subject': "Report", 'body': "Numbers"}
+        local_email = {'id': "2", 'from': "boss@example.com", 'subject': "Plan", 'body': "Ideas"}
+        analysis = {'importance': 0.8, 'category': "work", 'action': "read"}
+        self.assistant.database.save_email(llm_email, dict(analysis, source="llm"))
+        self.assistant.database.save_email(local_email, dict(analysis, source="local"))
+        # The LLM's analysis was learned when it was made
+        self.assistant.email_analyzer.local_model.learn(llm_email, analysis)
+        
+        with mock.patch('builtins.input', return_value="archive"), mock.patch('builtins.print'):
+            self.assistant.review_emails()
+        
+        local_model = self.assistant.email_analyzer.local_model
+        self.assertEqual(local_model.examples, 2)
+        self.assertEqual(local_model._actions["work"], {"read": 0, "archive": 2})
+        self.assistant.database.close()
+    
+    def test_review_deletes_by_uid_only_when_it_is_safe(self):
+        """Test that emails are deleted by stored UID, and never by sequence number or after a UIDVALIDITY reset"""
+        self.assistant.database = EmailDatabase(os.path.join(self.temp_dir.name, "reviewed.db"))
+        analysis = {'importance': 0.2, 'category': "spam", 'action': "delete"}
+        self.assistant.database.save_emails([
+            ({'id': "3", 'from': "old@example.com", 'subject': "Stored by sequence number"}, analysis),
+            ({'account': "user0@example.com", 'folder': "INBOX", 'uidvalidity': 5, 'uid': 7,
+              'from': "spam@example.com", 'subject': "Same folder"}, analysis),
+            ({'account': "user0@example.com", 'folder': "Old", 'uidvalidity': 4, 'uid': 8,
+              'from': "spam@example.com", 'subject': "Reset folder"}, analysis)
+        ])
+        self.assistant.connection_pool = mock.MagicMock()
+        processor = self.assistant.email_processor
+        
+        with mock.patch.object(processor, 'select_folder', return_value={'uidvalidity': 5, 'highestmodseq': None}), \
+                mock.patch.object(processor, 'delete_email') as delete_email, \
+                mock.patch('builtins.input', return_value="delete"), mock.patch('builtins.print'), \
+                self.assertLogs('src.app', level='WARNING'):
+            self.assistant.review_emails()
+        
+        delete_email.assert_called_once_with(mock.ANY, "7", None)
+        remaining = self.assistant.database.get_unprocessed_emails()
+        self.assertEqual(sorted(email['subject'] for email in remaining), ["Reset folder", "Stored by sequence number"])
+        self.assistant.database.close()
+    
+    def test_review_keeps_emails_the_server_did_not_delete(self):
+        """Test that a failed folder select or a refused delete leaves the email unreviewed"""
+        self.assistant.database = EmailDatabase(os.path.join(self.temp_dir.name, "reviewed.db"))
+        self.assistant.database.save_email({'account': "user0@example.com", 'folder': "INBOX", 'uidvalidity': 5,
+                                            'uid': 7, 'from': "spam@example.com", 'subject': "Spam"},
+                                           {'importance': 0.2, 'category': "spam", 'action': "delete"})
+        self.assistant.connection_pool = mock.MagicMock()
+        processor = self.assistant.email_processor
+        
+        for state in [None, {'uidvalidity': 5, 'highestmodseq': None}]:
+            with mock.patch.object(processor, 'select_folder', return_value=state), \
+                    mock.patch.object(processor, 'delete_email', return_value=False) as delete_email, \
+                    mock.patch('builtins.input', return_value="delete"), mock.patch('builtins.print'), \
+                    self.assertLogs('src.app', level='ERROR'):
+                self.assistant.review_emails()
+            self.assertEqual(delete_email.call_count, 0 if state is None else 1)
+            self.assertEqual(len(self.assistant.database.get_unprocessed_emails()), 1)
+        self.assistant.database.close()
+
+if __name__ == "__main__":
+    unittest.main()
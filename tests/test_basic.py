@@ -2,6 +2,7 @@
 Tests for the Personal Email Management Assistant
 """
 
+import base64
 import unittest
 import sys
 from pathlib import Path
@@ -11,6 +12,20 @@ sys.path.insert(0, str(Path(__file__).parent / ".." / "src"))
 
 from src.config.manager import ConfigManager
 from src.email_handler.processor import EmailProcessor
+from src.email_handler.fetch_parser import parse_fetch_response, parse_sexp, find_text_part
+from src.email_handler.connection_pool import IMAPConnectionPool
+from src.email_handler.idle import idle_wait
+from src.email_handler.mime import parse_message, extract_body, decode_text
+from src.utils.text import html_to_text
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.application import MIMEApplication
+from unittest import mock
+
+def _raw_message(subject: str, body: str) -> bytes:
+    """Build a minimal raw RFC822 message"""
+    return (f"From: sender@example.com\r\nSubject: {subject}\r\n"
+            f"Date: Mon, 1 Jan 2024 10:00:00 +0000\r\n\r\n{body}\r\n").encode()
 
 class TestConfigManager(unittest.TestCase):
     """Test cases for the ConfigManager class"""
@@ -58,6 +73,317 @@ class TestEmailProcessor(unittest.TestCase):
         account = self.email_processor.accounts[0]
         self.assertEqual(account["email"], "test@example.com")
         self.assertEqual(account["imap_server"], "imap.example.com")
+    
+    def _mock_mailbox(self, uids, uidvalidity=7, missing=()):
+        """Create a mock IMAP session serving unread messages with the given UIDs, failing to return missing ones"""
+        mail = mock.MagicMock()
+        mail.select.return_value = ('OK', [str(len(uids)).encode()])
+        mail.response.side_effect = lambda code: (code, [str(uidvalidity).encode()] if code == 'UIDVALIDITY' else [None])
+        fetch_calls = []
+        
+        def uid_command(command, *args):
+            if command == 'SEARCH':
+                low = int(args[1].split(':')[0]) if args[0] == 'UID' else 1
+                # Like real servers, "n:*" always includes the highest UID
+                found = [uid for uid in uids if uid >= low] or uids[-1:]
+                return 'OK', [' '.join(str(uid) for uid in found).encode()]
+            if command == 'FETCH':
+                fetch_calls.append(args[0])
+                data = []
+                for uid in reversed(args[0].split(',')):
+                    if int(uid) in missing:
+                        continue
+                    raw = _raw_message(f"Subject {uid}", "Hello")
+                    data.append((b'1 (UID %s RFC822 {%d}' % (uid.encode(), len(raw)), raw))
+                    data.append(b')')
+                return 'OK', data
+            return 'OK', [None]
+        
+        mail.uid.side_effect = uid_command
+        return mail, fetch_calls
+    
+    def test_fetch_emails_batches_requests(self):
+        """Test that messages are fetched with one UID FETCH per batch"""
+        mail, fetch_calls = self._mock_mailbox([1, 2, 3, 4, 5])
+        emails = self.email_processor.fetch_emails(mail, limit=5, batch_size=2)
+        
+        self.assertEqual(fetch_calls, ['1,2', '3,4', '5'])
+        self.assertEqual([e['id'] for e in emails], ['1', '2', '3', '4', '5'])
+        self.assertEqual(emails[2]['subject'], "Subject 3")
+        self.assertEqual(emails[2]['body'].strip(), "Hello")
+        self.assertEqual(emails[2]['uidvalidity'], 7)
+    
+    def test_fetch_emails_incremental(self):
+        """Test that only messages above the stored high-water mark are fetched"""
+        mail, fetch_calls = self._mock_mailbox([3, 8, 9])
+        emails = self.email_processor.fetch_emails(mail, sync_state={'uidvalidity': 7, 'last_uid': 8})
+        self.assertEqual([e['uid'] for e in emails], [9])
+        
+        # Nothing new: the "n:*" quirk must not return the last message again
+        mail, fetch_calls = self._mock_mailbox([3, 8, 9])
+        emails = self.email_processor.fetch_emails(mail, sync_state={'uidvalidity': 7, 'last_uid': 9})
+        self.assertEqual(emails, [])
+        self.assertEqual(fetch_calls, [])
+        
+        # A new UIDVALIDITY invalidates the stored state
+        mail, fetch_calls = self._mock_mailbox([3, 8, 9], uidvalidity=8)
+        emails = self.email_processor.fetch_emails(mail, sync_state={'uidvalidity': 7, 'last_uid': 9})
+        self.assertEqual([e['uid'] for e in emails], [3, 8, 9])
+
+    def test_fetch_emails_oldest_first(self):
+        """Test that a first sync beyond the limit starts with the oldest unread messages"""
+        mail, fetch_calls = self._mock_mailbox([3, 8, 9, 12])
+        emails = self.email_processor.fetch_emails(mail, limit=2)
+        self.assertEqual([e['uid'] for e in emails], [3, 8])
+        
+        mail, fetch_calls = self._mock_mailbox([3, 8, 9, 12])
+        emails = self.email_processor.fetch_emails(mail, limit=2, sync_state={'uidvalidity': 7, 'last_uid': 8})
+        self.assertEqual([e['uid'] for e in emails], [9, 12])
+    
+    def test_fetch_emails_reports_failed_uids(self):
+        """Test that messages missing from a FETCH response are reported"""
+        mail, fetch_calls = self._mock_mailbox([1, 2, 3], missing={2})
+        failed_uids = []
+        emails = self.email_processor.fetch_emails(mail, failed_uids=failed_uids)
+        self.assertEqual([e['uid'] for e in emails], [1, 3])
+        self.assertEqual(failed_uids, [2])
+
+class TestFlagChanges(unittest.TestCase):
+    """Test cases for bulk flag updates"""
+    
+    def setUp(self):
+        self.email_processor = EmailProcessor()
+        self.mail = mock.MagicMock()
+        self.mail.capabilities = ('IMAP4REV1', 'UIDPLUS')
+        
+        def uid_command(command, *args):
+            if command == 'STORE':
+                uids = []
+                for part in args[0].split(','):
+                    low, _, high = part.partition(':')
+                    uids.extend(range(int(low), int(high or low) + 1))
+                # UID 4 no longer exists, so the server doesn't report it
+                data = [b'%d (UID %d FLAGS %s)' % (uid, uid, args[2].encode()) for uid in uids if uid != 4]
+                return 'OK', data
+            return 'OK', [None]
+        
+        self.mail.uid.side_effect = uid_command
+    
+    def test_uid_set(self):
+        """Test compressing UIDs into a sequence set"""
+        self.assertEqual(self.email_processor._uid_set(['7', '1', '2', '3', '9', '10']), '1:3,7,9:10')
+    
+    def test_bulk_read_and_delete(self):
+        """Test that reads and deletes each take one STORE and deletes one UID EXPUNGE"""
+        results = self.email_processor.apply_flag_changes(
+            self.mail, read_ids=['1', '2', '3', '4'], delete_ids=['1', '2', '3', '7']
+        )
+        
+        self.assertEqual(results['read'], {'1': True, '2': True, '3': True, '4': False})
+        self.assertTrue(all(results['deleted'].values()))
+        self.mail.uid.assert_has_calls([
+            mock.call('STORE', '1:4', '+FLAGS', '(\\Seen)'),
+            mock.call('STORE', '1:3,7', '+FLAGS', '(\\Deleted)'),
+            mock.call('EXPUNGE', '1:3,7'),
+        ])
+        self.mail.expunge.assert_not_called()
+    
+    def test_single_changes_report_the_server_result(self):
+        """Test that mark_as_read and delete_email tell whether the server applied the change"""
+        self.assertTrue(self.email_processor.mark_as_read(self.mail, '3'))
+        self.assertTrue(self.email_processor.delete_email(self.mail, '5'))
+        
+        self.mail.uid.side_effect = lambda command, *args: ('NO', [b'Permission denied'])
+        self.assertFalse(self.email_processor.mark_as_read(self.mail, '3'))
+        self.assertFalse(self.email_processor.delete_email(self.mail, '5'))
+    
+    def test_delete_moves_to_trash(self):
+        """Test that deletes use a single UID MOVE when the server supports it"""
+        self.mail.capabilities = ('IMAP4REV1', 'MOVE')
+        results = self.email_processor.apply_flag_changes(self.mail, delete_ids=['5', '6'], trash_folder='Trash')
+        
+        self.assertEqual(results['deleted'], {'5': True, '6': True})
+        self.mail.uid.assert_called_once_with('MOVE', '5:6', 'Trash')
+    
+    def test_failed_move_keeps_messages(self):
+        """Test that a failing UID MOVE to the trash doesn't fall back to deleting in place"""
+        self.mail.capabilities = ('IMAP4REV1', 'MOVE', 'UIDPLUS')
+        self.mail.uid.side_effect = lambda command, *args: ('NO', [b'[TRYCREATE] No such mailbox'])
+        
+        with self.assertLogs('src.email_handler.processor', level='ERROR'):
+            results = self.email_processor.apply_flag_changes(self.mail, delete_ids=['5'], trash_folder='Trash')
+        
+        self.assertEqual(results['deleted'], {'5': False})
+        self.mail.uid.assert_called_once_with('MOVE', '5', 'Trash')
+        self.mail.expunge.assert_not_called()
+
+class TestPartialFetch(unittest.TestCase):
+    """Test cases for structure-aware partial fetching"""
+    
+    def test_only_text_section_is_downloaded(self):
+        """Test that partial mode downloads headers and the text section with a byte cap"""
+        headers = b"From: sender@example.com\r\nSubject: Report\r\nDate: Mon, 1 Jan 2024 10:00:00 +0000\r\n\r\n"
+        body = "Grüße aus Köln".encode('iso-8859-1')
+        encoded = base64.b64encode(body)
+        requests = []
+        
+        def uid_command(command, *args):
+            if command == 'SEARCH':
+                return 'OK', [b'5']
+            requests.append(args[1])
+            if 'BODYSTRUCTURE' in args[1]:
+                return 'OK', [
+                    (b'1 (UID 5 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "iso-8859-1") NIL NIL "BASE64" 20 1 NIL NIL NIL)'
+                     b'("IMAGE" "PNG" NIL NIL NIL "BASE64" 5000000 NIL NIL NIL) "MIXED")'
+                     b' BODY[HEADER.FIELDS (FROM SUBJECT DATE)] {%d}' % len(headers), headers),
+                    b')'
+                ]
+            return 'OK', [(b'1 (UID 5 BODY[1]<0> {%d}' % len(encoded), encoded), b')']
+        
+        mail = mock.MagicMock()
+        mail.select.return_value = ('OK', [b'1'])
+        mail.response.side_effect = lambda code: (code, [b'1'] if code == 'UIDVALIDITY' else [None])
+        mail.uid.side_effect = uid_command
+        
+        emails = EmailProcessor().fetch_emails(mail, fetch_mode='partial', max_body_bytes=4096)
+        
+        self.assertEqual(requests[1], '(UID BODY.PEEK[1]<0.4096>)')
+        self.assertEqual(emails[0]['subject'], "Report")
+        self.assertEqual(emails[0]['body'], "Grüße aus Köln")
+
+class TestIMAPConnectionPool(unittest.TestCase):
+    """Test cases for the IMAPConnectionPool class"""
+    
+    def setUp(self):
+        """Set up a pool whose sessions are mocks"""
+        self.account = {'email': "test@example.com"}
+        self.connect = mock.MagicMock(side_effect=lambda account, timeout=None: mock.MagicMock())
+        self.pool = IMAPConnectionPool(self.connect, keepalive_interval=0)
+    
+    def test_sessions_are_reused(self):
+        """Test that a released session is handed out again without logging in"""
+        mail = self.pool.acquire(self.account)
+        mail.noop.return_value = ('OK', [b''])
+        self.pool.release(self.account, mail)
+        
+        self.assertIs(self.pool.acquire(self.account), mail)
+        self.assertEqual(self.connect.call_count, 1)
+        stats = self.pool.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    
+    def test_dead_session_is_replaced(self):
+        """Test that a session failing NOOP is dropped and a new one is opened"""
+        mail = self.pool.acquire(self.account)
+        mail.noop.side_effect = OSError("connection reset")
+        self.pool.release(self.account, mail)
+        
+        new_mail = self.pool.acquire(self.account)
+        self.assertIsNot(new_mail, mail)
+        self.assertEqual(self.connect.call_count, 2)
+        self.assertEqual(self.pool.get_stats()['reconnects'], 1)
+
+class TestIdle(unittest.TestCase):
+    """Test cases for IMAP IDLE handling"""
+    
+    def _mock_session(self, lines):
+        mail = mock.MagicMock()
+        mail._new_tag.return_value = b'A001'
+        mail.readline.side_effect = lines
+        return mail
+    
+    def test_idle_reports_new_mail(self):
+        """Test that an EXISTS response ends IDLE and reports new mail"""
+        mail = self._mock_session([b'+ idling\r\n', b'* 4 EXISTS\r\n', b'A001 OK IDLE terminated\r\n'])
+        with mock.patch('src.email_handler.idle._readable', return_value=True):
+            self.assertTrue(idle_wait(mail, timeout=5))
+        mail.send.assert_has_calls([mock.call(b'A001 IDLE\r\n'), mock.call(b'DONE\r\n')])
+    
+    def test_idle_timeout(self):
+        """Test that IDLE is ended cleanly when nothing arrives"""
+        mail = self._mock_session([b'+ idling\r\n', b'* 2 EXPUNGE\r\n', b'A001 OK IDLE terminated\r\n'])
+        with mock.patch('src.email_handler.idle._readable', return_value=False):
+            self.assertFalse(idle_wait(mail, timeout=0.01))
+        mail.send.assert_called_with(b'DONE\r\n')
+
+class TestMimeParsing(unittest.TestCase):
+    """Test cases for the streaming MIME parser"""
+    
+    def test_parsing_stops_after_text_part(self):
+        """Test that parts after the text body are never parsed"""
+        message = MIMEMultipart()
+        message.attach(MIMEText("Plain body", "plain", "utf-8"))
+        message.attach(MIMEApplication(b"\0" * 1000000, Name="big.bin"))
+        
+        parsed = parse_message(message.as_bytes(), chunk_size=4096)
+        
+        self.assertEqual(extract_body(parsed), "Plain body")
+        self.assertLess(sum(len(part.get_payload()) for part in parsed.get_payload()), 100000)
+    
+    def test_size_cap(self):
+        """Test that at most max_bytes of the message are parsed"""
+        raw = b"Subject: Big\r\n\r\n" + b"a" * 100000
+        parsed = parse_message(raw, max_bytes=1000)
+        self.assertEqual(parsed['Subject'], "Big")
+        self.assertLessEqual(len(parsed.get_payload()), 1000)
+    
+    def test_html_body_is_converted(self):
+        """Test that HTML-only emails are converted to text"""
+        message = MIMEText("<html><head><style>p {}</style></head><body><p>Hello&nbsp;<b>World</b></p>"
+                           "<script>x()</script></body></html>", "html", "utf-8")
+        self.assertEqual(extract_body(parse_message(message.as_bytes())), "Hello World")
+    
+    def test_charset_detection(self):
+        """Test decoding with declared, mislabelled and missing charsets"""
+        self.assertEqual(decode_text("Grüße".encode('utf-8')), "Grüße")
+        self.assertEqual(decode_text("Grüße".encode('cp1252'), 'iso-8859-1'), "Grüße")
+        self.assertEqual(decode_text("你好".encode('gbk'), 'gb2312'), "你好")
+        self.assertEqual(decode_text("Grüße".encode('utf-8'), 'utf-8-bogus'), "Grüße")
+        self.assertEqual(decode_text(b'<meta charset="koi8-r">' + "Привет".encode('koi8-r'), is_html=True)[-6:], "Привет")
+    
+    def test_html_to_text_line_breaks(self):
+        """Test that block elements become line breaks"""
+        self.assertEqual(html_to_text("<div>One</div><div>Two<br>Three</div>"), "One\n\nTwo\nThree")
+
+class TestFetchParser(unittest.TestCase):
+    """Test cases for the FETCH response parser"""
+    
+    def test_parse_literals_and_lists(self):
+        """Test parsing messages with literals, nested lists and section names"""
+        raw = _raw_message("Hi", "Body")
+        data = [
+            (b'7 (UID 42 FLAGS (\\Seen) BODY[HEADER.FIELDS (FROM SUBJECT)] {%d}' % len(raw), raw),
+            b' INTERNALDATE "01-Jan-2024 10:00:00 +0000")',
+            b'8 (UID 43 FLAGS ())',
+        ]
+        messages = parse_fetch_response(data)
+        
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[0]['SEQ'], '7')
+        self.assertEqual(messages[0]['UID'], '42')
+        self.assertEqual(messages[0]['FLAGS'], ['\\Seen'])
+        self.assertEqual(messages[0]['BODY[HEADER.FIELDS (FROM SUBJECT)]'], raw)
+        self.assertEqual(messages[0]['INTERNALDATE'], "01-Jan-2024 10:00:00 +0000")
+        self.assertEqual(messages[1]['FLAGS'], [])
+
+    
+    def test_find_text_part(self):
+        """Test picking the text/plain section out of a nested BODYSTRUCTURE"""
+        structure = parse_sexp(
+            b'((("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 120 4 NIL NIL NIL)'
+            b'("TEXT" "PLAIN" ("CHARSET" "iso-8859-1") NIL NIL "BASE64" 80 2 NIL NIL NIL) "ALTERNATIVE")'
+            b'("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 900000 NIL ("ATTACHMENT" ("FILENAME" "a.pdf")) NIL)'
+            b' "MIXED")'
+        )
+        part = find_text_part(structure)
+        self.assertEqual(part['section'], '1.2')
+        self.assertEqual(part['charset'], 'iso-8859-1')
+        self.assertEqual(part['encoding'], 'BASE64')
+        
+        single = parse_sexp(b'("TEXT" "PLAIN" ("CHARSET" "us-ascii") NIL NIL "7BIT" 10 1 NIL NIL NIL)')
+        self.assertEqual(find_text_part(single)['section'], '1')
+        
+        attachment_only = parse_sexp(b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 10 NIL NIL NIL)')
+        self.assertIsNone(find_text_part(attachment_only))
 
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,327 @@
+"""
+Tests for the database module of the Personal Email Management Assistant
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / ".." / "src"))
+
+from src.database.db import EmailDatabase, fts_query, received_timestamp
+
+def _email(uid, account="user@example.com", folder="INBOX", **fields):
+    """Build an email dictionary as produced by EmailProcessor.fetch_emails"""
+    email_data = {
+        'id': str(uid),
+        'uid': uid,
+        'uidvalidity': 1,
+        'folder': folder,
+        'account': account,
+        'from': "sender@example.com",
+        'subject': f"Subject {uid}",
+        'date': "Mon, 1 Jan 2024 10:00:00 +0000",
+        'body': "Hello"
+    }
+    email_data.update(fields)
+    return email_data
+
+ANALYSIS = {"importance": 0.5, "summary": "Summary", "category": "other", "action": "read"}
+
+class TestEmailDatabase(unittest.TestCase):
+    """Test cases for the EmailDatabase class"""
+    
+    def setUp(self):
+        """Create a database in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database = EmailDatabase(os.path.join(self.temp_dir.name, "emails.db"))
+    
+    def tearDown(self):
+        self.database.close()
+        self.temp_dir.cleanup()
+    
+    def test_folder_state_roundtrip(self):
+        """Test storing and updating UID high-water marks"""
+        self.assertIsNone(self.database.get_folder_state("user@example.com", "INBOX"))
+        
+        self.database.update_folder_state("user@example.com", "INBOX", 5, 10)
+        self.database.update_folder_state("user@example.com", "INBOX", 5, 12)
+        
+        state = self.database.get_folder_state("user@example.com", "INBOX")
+        self.assertEqual(state, {'uidvalidity': 5, 'last_uid': 12, 'highestmodseq': None})
+    
+    def test_same_uid_in_different_accounts(self):
+        """Test that equal UIDs from different accounts are stored separately"""
+        self.database.save_email(_email(1, account="a@example.com"), ANALYSIS)
+        self.database.save_email(_email(1, account="b@example.com"), ANALYSIS)
+        
+        emails = self.database.get_unprocessed_emails()
+        self.assertEqual(sorted(e['account'] for e in emails), ["a@example.com", "b@example.com"])
+        self.assertEqual({e['uid'] for e in emails}, {1})
+    
+    def test_token_usage_roundtrip(self):
+        """Test that the token usage of an analysis is stored with the email"""
+        self.database.save_email(_email(1), dict(ANALYSIS, source="llm", prompt_tokens=310, completion_tokens=42))
+        self.database.save_email(_email(2), ANALYSIS)
+        
+        emails = {e['uid']: e for e in self.database.get_unprocessed_emails()}
+        self.assertEqual((emails[1]['prompt_tokens'], emails[1]['completion_tokens']), (310, 42))
+        self.assertIsNone(emails[2]['prompt_tokens'])
+    
+    def test_training_examples(self):
+        """Test that LLM analyses and reviewed emails are training examples, with the reviewed action preferred"""
+        self.database.save_email(_email(1), dict(ANALYSIS, source="llm"))
+        self.database.save_email(_email(2), dict(ANALYSIS, source="heuristic"))
+        self.database.save_email(_email(3), dict(ANALYSIS, source="llm"))
+        self.database.save_email(_email(4), dict(ANALYSIS, source="local"))
+        for email in self.database.get_unprocessed_emails():
+            if email['uid'] == 3:
+                self.database.mark_email_processed(email['db_id'], reviewed_action="delete")
+            if email['uid'] == 4:
+                self.database.mark_email_processed(email['db_id'], reviewed_action="archive")
+        
+        examples = self.database.get_training_examples()
+        self.assertEqual([email_data['subject'] for email_data, _ in examples], ["Subject 4", "Subject 3", "Subject 1"])
+        self.assertEqual(examples[0][0]['body'], "Hello")
+        self.assertEqual([analysis['action'] for _, analysis in examples], ["archive", "delete", "read"])
+    
+    def test_mark_uids_processed(self):
+        """Test that UIDs are resolved within one folder and UIDVALIDITY"""
+        self.database.save_email(_email(1), ANALYSIS)
+        self.database.save_email(_email(2), ANALYSIS)
+        self.database.save_email(_email(1, folder="Work"), ANALYSIS)
+        self.database.save_email(_email(3, uidvalidity=2), ANALYSIS)
+        
+        self.assertEqual(sorted(self.database.get_unprocessed_uids("user@example.com", "INBOX", 1)), [1, 2])
+        self.assertEqual(self.database.mark_uids_processed("user@example.com", "INBOX", 1, [1, 3]), 1)
+        
+        self.assertEqual(self.database.get_unprocessed_uids("user@example.com", "INBOX", 1), [2])
+        self.assertEqual(self.database.get_unprocessed_uids("user@example.com", "Work", 1), [1])
+        self.assertEqual(self.database.get_unprocessed_uids("user@example.com", "INBOX", 2), [3])
+    
+    def test_connections_are_tuned_and_shared(self):
+        """Test that pooled connections use WAL mode with the configured pragmas and are reused across threads"""
+        connections = self.database.connections
+        with connections.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 5000)
+            self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -16 * 1024)
+        
+        # A new thread, such as a web request's, borrows the idle connection instead of connecting
+        borrowed = []
+        def borrow():
+            with connections.connection() as other:
+                borrowed.append(other)
+                other.execute("SELECT 1")
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        thread.join()
+        self.assertIs(borrowed[0], conn)
+        
+        # Connections borrowed at the same time are distinct; beyond pool_size they are closed when handed back
+        connections.pool_size = 1
+        with connections.connection() as first, connections.connection() as second:
+            self.assertIsNot(first, second)
+        self.assertEqual(connections.open_connections(), 1)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            first.execute("SELECT 1")
+    
+    def test_reads_are_not_blocked_by_a_writer(self):
+        """Test that readers see committed data while another connection holds a write transaction"""
+        self.database.save_email(_email(1), ANALYSIS)
+        writer = sqlite3.connect(self.database.db_path)
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("UPDATE emails SET summary = 'Pending'")
+        
+        start = time.monotonic()
+        emails = self.database.get_unprocessed_emails()
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual([e['summary'] for e in emails], ["Summary"])
+        
+        writer.commit()
+        writer.close()
+        self.assertEqual([e['summary'] for e in self.database.get_unprocessed_emails()], ["Pending"])
+    
+    def test_save_emails_in_one_transaction(self):
+        """Test that a batch is saved at once and a failing batch saves nothing"""
+        self.assertEqual(self.database.save_emails([(_email(uid), ANALYSIS) for uid in range(1, 101)]), 100)
+        self.assertEqual(len(self.database.get_unprocessed_emails(1000)), 100)
+        # Repeats of an email within a batch are saved, and counted, once
+        self.assertEqual(self.database.save_emails([(_email(1), ANALYSIS), (_email(1), ANALYSIS)]), 1)
+        
+        batch = [(_email(101), ANALYSIS), (_email(102, subject={"not": "a string"}), ANALYSIS)]
+        with self.assertLogs('src.database.db', level='ERROR'):
+            self.assertEqual(self.database.save_emails(batch), 0)
+        self.assertEqual(len(self.database.get_unprocessed_emails(1000)), 100)
+    
+    def test_saving_again_updates_in_place(self):
+        """Test that saving a stored email again keeps its row id and review state"""
+        self.database.save_email(_email(1), dict(ANALYSIS, source="llm"))
+        stored = self.database.get_unprocessed_emails()[0]
+        self.database.mark_email_processed(stored['db_id'], reviewed_action="archive")
+        
+        self.assertTrue(self.database.save_email(_email(1), dict(ANALYSIS, source="llm", summary="Updated")))
+        
+        self.assertEqual(self.database.get_unprocessed_emails(), [])
+        updated = self.database.get_processed_emails()[0]
+        self.assertEqual((updated['db_id'], updated['summary']), (stored['db_id'], "Updated"))
+        self.assertEqual(self.database.get_training_examples()[0][1]['action'], "archive")
+    
+    def test_emails_are_sorted_by_parsed_date(self):
+        """Test that emails of equal importance are newest first by their Date header, not its text"""
+        self.database.save_email(_email(1, date="Tue, 2 Jan 2024 09:00:00 +0000"), ANALYSIS)
+        self.database.save_email(_email(2, date="Wed, 10 Jan 2024 09:00:00 +0000"), ANALYSIS)
+        self.database.save_email(_email(3, date="Tue, 02 Jan 2024 07:30:00 -0500"), ANALYSIS)
+        
+        emails = self.database.get_unprocessed_emails()
+        self.assertEqual([e['uid'] for e in emails], [2, 3, 1])
+        self.assertEqual(emails[0]['received_ts'], 1704877200)
+    
+    def test_filters_use_indexes(self):
+        """Test that the dashboard's queries read an index instead of sorting the table"""
+        self.database.save_email(_email(1, category="work"), dict(ANALYSIS, category="work"))
+        self.database.save_email(_email(2, account="b@example.com"), ANALYSIS)
+        
+        self.assertEqual([e['uid'] for e in self.database.get_unprocessed_emails(category="work")], [1])
+        self.assertEqual([e['account'] for e in self.database.get_unprocessed_emails(account="b@example.com")],
+                         ["b@example.com"])
+        
+        for condition, params in [("processed = ?", (0,)), ("processed = ? AND account = ?", (0, "b@example.com")),
+                                  ("processed = ? AND category = ?", (0, "work"))]:
+            with self.database.connections.connection() as conn:
+                plan = " ".join(row[3] for row in conn.execute(
+                    f"EXPLAIN QUERY PLAN SELECT * FROM emails WHERE {condition} "
+                    "ORDER BY importance DESC, received_ts DESC LIMIT 10", params))
+            self.assertIn("USING INDEX", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+    
+    def test_received_ts_is_backfilled(self):
+        """Test that opening a database from before received_ts fills it for stored emails"""
+        path = os.path.join(self.temp_dir.name, "old.db")
+        with sqlite3.connect(path) as conn:
+            conn.execute("""
+                CREATE TABLE emails (id INTEGER PRIMARY KEY AUTOINCREMENT, email_id TEXT UNIQUE, sender TEXT,
+                                     subject TEXT, body TEXT, date TEXT, importance REAL, summary TEXT,
+                                     category TEXT, action TEXT, processed BOOLEAN DEFAULT FALSE,
+                                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+            """)
+            conn.execute("INSERT INTO emails (email_id, date, created_at) VALUES "
+                         "('a', 'Mon, 1 Jan 2024 10:00:00 +0000', '2024-02-01 00:00:00'), "
+                         "('b', 'not a date', '2024-02-01 00:00:00')")
+        conn.close()
+        
+        database = EmailDatabase(path)
+        emails = {e['id']: e['received_ts'] for e in database.get_unprocessed_emails()}
+        database.close()
+        self.assertEqual(emails, {'a': 1704103200, 'b': 1706745600})
+    
+    def test_received_timestamp(self):
+        """Test parsing Date headers, including ones without a zone and broken ones"""
+        self.assertEqual(received_timestamp("Mon, 1 Jan 2024 10:00:00 +0100"), 1704099600)
+        self.assertEqual(received_timestamp("Mon, 1 Jan 2024 10:00:00 -0000"), 1704103200)
+        self.assertIsNone(received_timestamp("yesterday"))
+        self.assertIsNone(received_timestamp(None))
+    
+    def test_bodies_are_loaded_on_demand(self):
+        """Test that list queries leave bodies out and get_email loads one compressed body"""
+        body = "Quarterly report attached. " * 200 + "\u041f\u0440\u0438\u0432\u0435\u0442"
+        self.database.save_email(_email(1, body=body), ANALYSIS)
+        
+        listed = self.database.get_unprocessed_emails()[0]
+        self.assertNotIn('body', listed)
+        self.assertEqual(self.database.get_email(listed['db_id'])['body'], body)
+        self.assertIsNone(self.database.get_email(listed['db_id'] + 1))
+        
+        with self.database.connections.connection() as conn:
+            stored = conn.execute("SELECT body FROM email_bodies").fetchone()[0]
+        self.assertLess(len(stored), len(body) // 10)
+    
+    def test_body_of_keyless_email_is_stored(self):
+        """Test that an email without account, UID or Message-ID keeps its body"""
+        keyless = {'from': "sender@example.com", 'subject': "hello world", 'body': "secret invoice body"}
+        self.assertEqual(self.database.save_emails([(keyless, ANALYSIS), (keyless, ANALYSIS)]), 2)
+        
+        self.assertEqual([self.database.get_email(db_id)['body'] for db_id in (1, 2)], ["secret invoice body"] * 2)
+        self.assertEqual([e['db_id'] for e in self.database.search_emails("hello invoice")], [1, 2])
+    
+    def test_inline_bodies_are_moved(self):
+        """Test that opening a database with inline bodies moves them to email_bodies"""
+        self.database.save_email(_email(1), ANALYSIS)
+        with self.database.connections.connection() as conn:
+            conn.execute("DELETE FROM email_bodies")
+            conn.execute("UPDATE emails SET body = 'Inline body'")
+        self.database.close()
+        
+        self.database = EmailDatabase(self.database.db_path)
+        db_id = self.database.get_unprocessed_emails()[0]['db_id']
+        self.assertEqual(self.database.get_email(db_id)['body'], "Inline body")
+        with self.database.connections.connection() as conn:
+            self.assertIsNone(conn.execute("SELECT body FROM emails").fetchone()[0])
+    
+    def test_search_ranks_and_filters(self):
+        """Test that search finds every word in any column, best match first, within the filters"""
+        self.database.save_emails([
+            (_email(1, subject="Invoice for March", body="Please pay the invoice"), ANALYSIS),
+            (_email(2, body="The invoice is attached", date="Mon, 5 Feb 2024 10:00:00 +0000"),
+             dict(ANALYSIS, importance=0.9, category="finance")),
+            (_email(3, account="b@example.com", subject="Your receipt", **{'from': "orders@shop.example"}), ANALYSIS),
+            (_email(4, body="Lunch on friday?"), ANALYSIS)
+        ])
+        
+        results = self.database.search_emails("invoice")
+        self.assertEqual([e['uid'] for e in results], [1, 2])
+        self.assertLess(results[0]['rank'], results[1]['rank'])
+        self.assertNotIn('body', results[0])
+        self.assertEqual([e['uid'] for e in self.database.search_emails("invoic")], [1, 2])
+        self.assertEqual([e['uid'] for e in self.database.search_emails("shop rece")], [3])
+        self.assertEqual([e['uid'] for e in self.database.search_emails("pay invoice")], [1])
+        self.assertEqual([e['uid'] for e in self.database.search_emails("FRIDAY lunch")], [4])
+        
+        self.assertEqual([e['uid'] for e in self.database.search_emails("invoice", category="finance")], [2])
+        self.assertEqual([e['uid'] for e in self.database.search_emails("invoice", min_importance=0.8)], [2])
+        self.assertEqual([e['uid'] for e in self.database.search_emails("invoice", since=1706745600)], [2])
+        self.assertEqual([e['uid'] for e in self.database.search_emails("invoice", until=1706745600)], [1])
+        self.assertEqual([e['uid'] for e in self.database.search_emails("receipt", account="b@example.com")], [3])
+        self.assertEqual(self.database.search_emails("receipt", account="user@example.com"), [])
+        self.assertEqual(self.database.search_emails("invoice", processed=True), [])
+        
+        # Without words only the filters apply, most important first
+        results = self.database.search_emails('" - *')
+        self.assertEqual(sorted(e['uid'] for e in results), [1, 2, 3, 4])
+        self.assertEqual((results[0]['uid'], results[0]['rank']), (2, None))
+        self.assertEqual([e['uid'] for e in self.database.search_emails('', category="finance")], [2])
+    
+    def test_search_index_follows_saves(self):
+        """Test that saving an email again replaces what the index holds for it"""
+        self.database.save_email(_email(1, body="Draft agenda"), ANALYSIS)
+        self.database.save_emails([(_email(1, body="First"), ANALYSIS), (_email(1, body="Final agenda"), ANALYSIS)])
+        
+        self.assertEqual(self.database.search_emails("draft"), [])
+        self.assertEqual(self.database.search_emails("first"), [])
+        self.assertEqual(len(self.database.search_emails("final agenda")), 1)
+        self.database.save_email(_email(1, body="Final agenda"), ANALYSIS)
+        self.assertEqual(len(self.database.search_emails("final agenda")), 1)
+        
+        # Opening an older database indexes the emails it already has
+        with self.database.connections.connection() as conn:
+            conn.execute("DROP TABLE emails_fts")
+        self.database.close()
+        self.database = EmailDatabase(self.database.db_path)
+        self.assertEqual(len(self.database.search_emails("agenda")), 1)
+    
+    def test_fts_query(self):
+        """Test that user input becomes a safe query of all its words, the last one as a prefix"""
+        self.assertEqual(fts_query('invoice "march" OR'), '"invoice" "march" "OR"')
+        self.assertEqual(fts_query("caf\u00e9"), '"caf\u00e9"*')
+        self.assertEqual(fts_query("invoice -march"), '"invoice" "march"*')
+        self.assertIsNone(fts_query(" - * "))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+"""
+Integration tests running EmailProcessor against the in-process IMAP stand-in server
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / ".." / "src"))
+
+from src.app import EmailAssistant
+from src.config.manager import ConfigManager
+from src.email_handler.processor import EmailProcessor
+from src.email_handler.idle import IdleWatcher, idle_wait
+from tests.imap_server import IMAPStandInServer, make_message
+
+class TestIMAPIntegration(unittest.TestCase):
+    """Test cases for a real IMAP conversation with EmailProcessor"""
+
+    def setUp(self):
+        """Start a stand-in server with a small mixed mailbox"""
+        self.server = IMAPStandInServer()
+        self.server.populate(25, attachment_size=20000)
+        self.server.start()
+
+        self.email_processor = EmailProcessor()
+        self.email_processor.add_account("user@example.com", "password", "127.0.0.1", self.server.port, use_ssl=False)
+        self.account = self.email_processor.accounts[0]
+        self.mail = self.email_processor.connect_account(self.account, timeout=10)
+
+    def tearDown(self):
+        self.mail.logout()
+        self.server.stop()
+
+    def test_full_and_partial_fetch_agree(self):
+        """Test that partial fetches return the same bodies as full fetches"""
+        partial = self.email_processor.fetch_emails(self.mail, limit=25, fetch_mode='partial')
+        full = self.email_processor.fetch_emails(self.mail, limit=25, fetch_mode='full')
+
+        self.assertEqual(len(partial), 25)
+        self.assertEqual([e['body'] for e in partial], [e['body'] for e in full])
+        self.assertIn("Привет из Москвы #3", partial[3]['body'])
+        self.assertEqual(self.server.commands['UID FETCH'], 1 + 2 + 1)
+
+    def test_incremental_sync(self):
+        """Test that a second sync only fetches newly delivered mail"""
+        emails = self.email_processor.fetch_emails(self.mail, limit=100, fetch_mode='partial')
+        sync_state = {'uidvalidity': emails[-1]['uidvalidity'], 'last_uid': emails[-1]['uid']}
+
+        self.server.deliver(make_message(1000))
+        emails = self.email_processor.fetch_emails(self.mail, limit=100, fetch_mode='partial', sync_state=sync_state)
+
+        self.assertEqual([e['uid'] for e in emails], [26])
+        self.assertIn("#1000", emails[0]['body'])
+
+    def test_bulk_flag_changes(self):
+        """Test that reads and deletes are applied to the mailbox in bulk"""
+        emails = self.email_processor.fetch_emails(self.mail, limit=10, fetch_mode='partial')
+        ids = [e['id'] for e in emails]
+
+        results = self.email_processor.apply_flag_changes(self.mail, read_ids=ids, delete_ids=ids[:3])
+
+        self.assertTrue(all(results['read'].values()))
+        self.assertTrue(all(results['deleted'].values()))
+        self.assertEqual(len(self.server.folders['INBOX'].messages), 22)
+        self.assertEqual(self.server.commands['UID STORE'], 2)
+        self.assertEqual(self.server.commands['UID EXPUNGE'], 1)
+        self.assertEqual(len(self.email_processor.fetch_emails(self.mail, limit=100)), 15)
+
+    def test_idle_watcher_reports_delivery(self):
+        """Test that an IDLE session reports newly delivered mail"""
+        notified = threading.Event()
+        watcher = IdleWatcher(self.account, self.email_processor.connect_account,
+                              lambda account: notified.set(), timeout=10)
+        watcher.start()
+        try:
+            for _ in range(100):
+                if watcher.active:
+                    break
+                notified.wait(0.05)
+            self.assertTrue(watcher.active)
+
+            self.server.deliver(make_message(2000))
+            self.assertTrue(notified.wait(5))
+        finally:
+            watcher.stop()
+
+    def test_idle_sees_mail_reported_with_the_continuation(self):
+        """Test that new mail announced in the same packet as the IDLE continuation is seen at once"""
+        self.email_processor.select_folder(self.mail)
+        self.server.deliver(make_message(2000))
+
+        start = time.monotonic()
+        self.assertTrue(idle_wait(self.mail, timeout=5))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_qresync_reports_changes_from_other_clients(self):
+        """Test that reads and expunges since the stored MODSEQ are found with one FETCH"""
+        state = self.email_processor.select_folder(self.mail)
+        self.assertIsNotNone(state['highestmodseq'])
+        
+        self.server.set_flags(2, {'\\Seen'})
+        self.server.set_flags(4, {'\\Deleted'})
+        self.server.expunge_uids([3])
+        
+        self.email_processor.select_folder(self.mail)
+        fetches = self.server.commands['UID FETCH']
+        changes = self.email_processor.fetch_changes(self.mail, [1, 2, 3, 4], state)
+        
+        self.assertEqual(changes, {'seen': [2], 'removed': [3, 4]})
+        self.assertEqual(self.server.commands['UID FETCH'], fetches + 1)
+    
+    def test_changes_without_condstore(self):
+        """Test that changes are found from the flags of the known UIDs on servers without CONDSTORE"""
+        self.server.capabilities = ('IMAP4rev1', 'UIDPLUS')
+        mail = self.email_processor.connect_account(self.account, timeout=10)
+        try:
+            state = self.email_processor.select_folder(mail)
+            self.assertIsNone(state['highestmodseq'])
+            
+            self.server.set_flags(2, {'\\Seen'})
+            self.server.expunge_uids([3])
+            
+            changes = self.email_processor.fetch_changes(mail, [1, 2, 3], state)
+            self.assertEqual(changes, {'seen': [2], 'removed': [3]})
+        finally:
+            mail.logout()
+
+class TestFolderSync(unittest.TestCase):
+    """Test cases for multi-folder processing in EmailAssistant against the stand-in server"""
+    
+    def setUp(self):
+        """Set up an assistant monitoring two folders on a stand-in server"""
+        self.server = IMAPStandInServer()
+        self.server.populate(3, attachment_size=2000)
+        self.server.populate(2, folder='Work', attachment_size=2000)
+        self.server.start()
+        
+        self.temp_dir = tempfile.TemporaryDirectory()
+        config_path = os.path.join(self.temp_dir.name, "app_config.json")
+        config = ConfigManager(config_path)
+        config.config.update({
+            "database_path": os.path.join(self.temp_dir.name, "emails.db"),
+            "log_file": os.path.join(self.temp_dir.name, "email_assistant.log"),
+            "mark_as_read": False
+        })
+        config.save_config()
+        self.assistant = EmailAssistant(config_path)
+        self.assistant.email_analyzer = mock.MagicMock()
+        self.assistant.email_analyzer.analyze_batch.side_effect = lambda emails, **options: [{
+            'importance': 0.1, 'summary': "Summary", 'category': "personal", 'action': "read"
+        } for _ in emails]
+        self.assistant.email_processor.add_account("user@example.com", "password", "127.0.0.1", self.server.port,
+                                                   use_ssl=False, folders=['INBOX', 'Work'])
+    
+    def tearDown(self):
+        self.assistant.shutdown()
+        self.server.stop()
+        self.temp_dir.cleanup()
+    
+    def _unprocessed(self):
+        return sorted((e['folder'], e['uid']) for e in self.assistant.database.get_unprocessed_emails(100))
+    
+    def test_changes_from_other_clients_are_synced(self):
+        """Test that every folder is fetched and mail read or removed elsewhere is marked processed"""
+        account = self.assistant.email_processor.accounts[0]
+        self.assistant._process_account(account)
+        self.assertEqual(self._unprocessed(), [('INBOX', 1), ('INBOX', 2), ('INBOX', 3), ('Work', 1), ('Work', 2)])
+        
+        self.server.set_flags(2, {'\\Seen'})
+        self.server.expunge_uids([1], folder='Work')
+        self.assistant._process_account(account)
+        self.assertEqual(self._unprocessed(), [('INBOX', 1), ('INBOX', 3), ('Work', 2)])
+        
+        # Unchanged folders cost no more than their SELECT
+        searches = self.server.commands['UID SEARCH']
+        self.assistant._process_account(account)
+        self.assertEqual(self.server.commands['UID SEARCH'], searches)
+    
+    def test_backlog_is_fetched_oldest_first(self):
+        """Test that mail beyond the per-check limit is fetched by the following checks"""
+        self.assistant.config_manager.config["max_emails_per_check"] = 2
+        account = self.assistant.email_processor.accounts[0]
+        self.assistant._process_account(account)
+        self.assertEqual(self._unprocessed(), [('INBOX', 1), ('INBOX', 2), ('Work', 1), ('Work', 2)])
+        
+        self.assistant._process_account(account)
+        self.assertEqual(self._unprocessed(), [('INBOX', 1), ('INBOX', 2), ('INBOX', 3), ('Work', 1), ('Work', 2)])
+    
+    def test_failed_download_is_retried(self):
+        """Test that the high-water mark stops below a message that couldn't be fetched"""
+        account = self.assistant.email_processor.accounts[0]
+        fetch_partial = self.assistant.email_processor._fetch_partial
+        
+        def lose_uid_2(mail, uids, *args):
+            return {uid: email for uid, email in fetch_partial(mail, uids, *args).items() if uid != 2}
+        
+        with mock.patch.object(self.assistant.email_processor, '_fetch_partial', side_effect=lose_uid_2):
+            self.assistant._process_account(account)
+        self.assertEqual(self._unprocessed(), [('INBOX', 1), ('INBOX', 3), ('Work', 1)])
+        self.assertEqual(self.assistant.database.get_folder_state("user@example.com", 'INBOX')['last_uid'], 1)
+        
+        self.assistant._process_account(account)
+        self.assertEqual(self._unprocessed(), [('INBOX', 1), ('INBOX', 2), ('INBOX', 3), ('Work', 1), ('Work', 2)])
+        self.assertEqual(self.assistant.database.get_folder_state("user@example.com", 'INBOX')['last_uid'], 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Integration tests running EmailAnalyzer against the in-process LLM stand-in server
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+import httpx
+import openai
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / ".." / "src"))
+
+from src.ai.analyzer import EmailAnalyzer
+from src.ai.llm_client import AsyncLLMClient
+from tests.llm_server import CassetteMiss, CassetteTransport, LLMStandInServer, canned_responder
+
+def _emails():
+    """Build a small inbox whose categories the default rules decide"""
+    return [
+        {'id': '1', 'from': "manager@corp.example.com", 'subject': "Urgent: project deadline",
+         'body': "Please send the report today."},
+        {'id': '2', 'from': "news@deals.example.com", 'subject': "Weekly discount",
+         'body': "<p>Big sale.</p><p>Unsubscribe</p>"},
+        {'id': '3', 'from': "friend@home.example.org", 'subject': "Family dinner",
+         'body': "Are you free on Sunday?"},
+    ]
+
+class TestLLMIntegration(unittest.TestCase):
+    """Test cases for real HTTP conversations between EmailAnalyzer and an LLM endpoint"""
+    
+    def setUp(self):
+        self.server = LLMStandInServer(seed=1)
+        self.server.start()
+        self.temp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.server.stop()
+        self.temp_dir.cleanup()
+    
+    def _analyzer(self, transport=None, max_retries=5):
+        """Build an analyzer whose LLM client talks to the stand-in server"""
+        with mock.patch.dict('os.environ', {}, clear=True):
+            analyzer = EmailAnalyzer(local_model=None)
+        api = openai.AsyncOpenAI(
+            api_key="test",
+            base_url=self.server.base_url,
+            http_client=httpx.AsyncClient(transport=transport) if transport else None,
+            max_retries=0
+        )
+        analyzer.llm_client = AsyncLLMClient(api, analyzer.model, requests_per_minute=None, tokens_per_minute=None,
+                                             max_retries=max_retries, backoff_base=0.01)
+        return analyzer
+    
+    def test_batched_analysis(self):
+        """Test that a batch is sent in one request and every email gets its own answer"""
+        analyzer = self._analyzer()
+        results = analyzer.analyze_batch(_emails())
+        analyzer.close()
+        
+        self.assertEqual([r['category'] for r in results], ["work", "newsletter", "personal"])
+        self.assertTrue(all(r['source'] == "llm" for r in results))
+        self.assertTrue(all(r['prompt_tokens'] > 0 and r['completion_tokens'] > 0 for r in results))
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.server.received[0]['response_format'], {"type": "json_object"})
+    
+    def test_single_analysis(self):
+        """Test that a single email is answered with one analysis object"""
+        analyzer = self._analyzer()
+        result = analyzer.analyze_email(_emails()[0])
+        analyzer.close()
+        
+        self.assertEqual(result['category'], "work")
+        self.assertEqual(result['summary'], "manager@corp.example.com wrote about Urgent: project deadline.")
+    
+    def test_injected_errors_are_retried(self):
+        """Test that 429 answers are retried until the request succeeds"""
+        self.server.error_rate = 0.5
+        analyzer = self._analyzer(max_retries=20)
+        results = [analyzer.analyze_email(email_data) for email_data in _emails()]
+        retries = analyzer.llm_client.stats['retries']
+        analyzer.close()
+        
+        self.assertEqual([r['source'] for r in results], ["llm"] * 3)
+        self.assertGreater(retries, 0)
+        self.assertEqual(self.server.requests, 3 + retries)
+    
+    def test_prose_answers(self):
+        """Test that answers wrapped in prose and code fences are still parsed"""
+        self.server.responder = canned_responder([
+            'Sure! Here is the analysis:\n```json\n{"importance": 0.9, "summary": "Report due.", '
+            '"category": "Work", "action": "read",}\n```'
+        ])
+        analyzer = self._analyzer()
+        result = analyzer.analyze_email(_emails()[0])
+        analyzer.close()
+        
+        self.assertEqual(result['category'], "work")
+        self.assertEqual(result['importance'], 0.9)
+    
+    def test_cassette_record_and_replay(self):
+        """Test that recorded answers are replayed without the server"""
+        path = os.path.join(self.temp_dir.name, "cassette.json")
+        analyzer = self._analyzer(CassetteTransport(path, mode="record"))
+        recorded = analyzer.analyze_batch(_emails())
+        analyzer.close()
+        self.server.stop()
+        
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 1)
+        
+        analyzer = self._analyzer(CassetteTransport(path), max_retries=0)
+        replayed = analyzer.analyze_batch(_emails())
+        self.assertEqual(replayed, recorded)
+        
+        # A request that was never recorded is not sent anywhere
+        with self.assertLogs('src.ai.analyzer', level='ERROR'):
+            result = analyzer.analyze_email(_emails()[1])
+        analyzer.close()
+        self.assertEqual(result['source'], "heuristic")
+    
+    def test_cassette_miss(self):
+        """Test that replaying an unknown request raises CassetteMiss"""
+        path = os.path.join(self.temp_dir.name, "cassette.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({}, f)
+        transport = CassetteTransport(path)
+        
+        async def send():
+            async with httpx.AsyncClient(transport=transport) as client:
+                await client.post("http://llm.test/v1/chat/completions", json={"model": "m"})
+        
+        with self.assertRaises(CassetteMiss):
+            asyncio.run(send())
+
+if __name__ == "__main__":
+    unittest.main()
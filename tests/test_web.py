@@ -2,14 +2,35 @@
 Test for the web interface of the Personal Email Management Assistant
 """
 
+import os
+import tempfile
 import unittest
 import sys
 from pathlib import Path
+from unittest import mock
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
 
-from src.web.app import app
+from src.config.manager import ConfigManager
+from src.database.db import EmailDatabase
+
+# Importing the web app opens its database, which is kept out of the working tree
+_temp_dir = tempfile.TemporaryDirectory()
+_config_get = ConfigManager.get
+
+def _temp_config_get(config_manager, key, default=None):
+    if key == "database_path":
+        return os.path.join(_temp_dir.name, "emails.db")
+    return _config_get(config_manager, key, default)
+
+with mock.patch.object(ConfigManager, 'get', _temp_config_get):
+    from src.web import app as web_app
+app = web_app.app
+
+def tearDownModule():
+    web_app.database.close()
+    _temp_dir.cleanup()
 
 class WebInterfaceTest(unittest.TestCase):
     """Test cases for the web interface"""
@@ -46,6 +67,37 @@ class WebInterfaceTest(unittest.TestCase):
         data = response.get_json()
         self.assertIn('success', data)
         # Note: success might be False if no accounts are configured
+    
+    def test_api_email_not_found(self):
+        """Test that the email detail endpoint answers 404 for an unknown email"""
+        response = self.app.get('/api/emails/0')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.get_json()['success'])
+    
+    def test_api_search(self):
+        """Test that the search endpoint answers queries and rejects invalid filters"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            database = EmailDatabase(os.path.join(temp_dir, "emails.db"))
+            analysis = {"importance": 0.8, "summary": "March invoice", "category": "finance", "action": "read"}
+            for uid, date in [(1, "Wed, 10 Jan 2024 10:00:00 +0000"), (2, "Sat, 10 Feb 2024 10:00:00 +0000")]:
+                database.save_email({'account': "user@example.com", 'folder': "INBOX", 'uid': uid,
+                                     'from': "billing@example.com", 'subject': f"Invoice {uid}",
+                                     'date': date, 'body': "Please pay the invoice"}, analysis)
+            
+            with mock.patch('src.web.app.database', database):
+                found = self.app.get('/api/search?q=invoic&since=2024-01-01&until=2024-01-31&min_importance=0.5')
+                filtered = self.app.get('/api/search?since=2024-02-01&category=finance')
+                missed = self.app.get('/api/search?q=invoice&category=spam')
+            database.close()
+        
+        self.assertEqual(found.status_code, 200)
+        self.assertEqual([email['uid'] for email in found.get_json()['emails']], [1])
+        self.assertEqual([email['uid'] for email in filtered.get_json()['emails']], [2])
+        self.assertEqual(missed.get_json(), {'success': True, 'emails': []})
+        
+        response = self.app.get('/api/search?q=invoice&since=yesterday')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.get_json()['success'])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file